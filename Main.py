@@ -1,3 +1,20 @@
+import os
+import sys
+import time
+
+# PKUMPRESS_STARTUP_TIMING=1 prints how long each startup phase took to stderr, so a slow import or widget shows up
+STARTUP_TIMING = bool(os.environ.get("PKUMPRESS_STARTUP_TIMING"))
+_startup_marks = [time.perf_counter()]
+
+
+def startup_mark(phase):
+    if not STARTUP_TIMING:
+        return
+    now = time.perf_counter()
+    sys.stderr.write(f"startup: {phase:<22} {1000 * (now - _startup_marks[-1]):8.1f} ms  (total {1000 * (now - _startup_marks[0]):8.1f} ms)\n")
+    _startup_marks.append(now)
+
+
 from PyQt5 import QtWidgets, QtCore, QtGui
 from subprocess import run, CalledProcessError
 from PyQt5.QtCore import (QMimeData, QProcess, QRect, Qt, QSize, QPoint, pyqtSignal, QThread)
@@ -5,21 +22,31 @@ from PyQt5.QtWidgets import (QVBoxLayout, QHBoxLayout,
         QWidget, QLabel, QApplication, QPushButton,
         QSizePolicy, QMainWindow, QTabWidget, QGroupBox,
         QFrame, QDialog, QComboBox, QFileDialog,
-        QLineEdit, QProgressBar, QMessageBox, QCheckBox,
-        QScrollArea, QStackedWidget, QTextEdit,
+        QLineEdit, QProgressBar, QMessageBox, QCheckBox, QSpinBox,
+        QScrollArea, QStackedWidget,
         QSpacerItem, QGraphicsView, QGraphicsScene,
         QGraphicsPixmapItem, QGraphicsTextItem, QLayout)
 from PyQt5.QtGui import (QFont, QMovie, QPixmap,
         QPainter, QImage, QIcon, QMouseEvent,
         QColor, QPalette, QFontDatabase)
+startup_mark("import PyQt5")
 from auth_window import AuthWindow
 from logs.preview_window import WatermarkPreview, PreviewWindow
-import sys
-import os
+startup_mark("import windows")
+from engine import (DEFAULT_CRF_VALUES, PRESETS, VIDEO_CODECS,
+        probe_media, format_eta,
+        default_max_jobs, make_output_path, EncodeJob, run_encode_safe, SEGMENT_MIN_DURATION, QUALITY_FLOORS, PREFLIGHT_MAX_BPP,
+        JobJournal, JobQueue, PRIORITY_LANES, estimate_job_cost, ESTIMATE_WAIT_SECONDS,
+        FolderWatcher, WATCH_STABLE_SECONDS, list_profiles, load_profile, save_profile,
+        DEFAULT_EXCLUDES, discover_videos, is_video_file, result_cache, format_size, grab_frame, METRICS_PATH, MetricsRecorder, JobLogSink,
+        NICE_LEVELS, WorkerLayout, MP4_LAYOUTS, AUDIO_MODES, TRANSFERS, WORKER_HEALTH_SECONDS, WORKER_TOKEN_ENV, WORKER_BUSY_RETRIES, WorkerPool, WorkerUnavailable, WorkerBusy)
 import subprocess
-import cv2
 import re
 import datetime
+import threading
+import sqlite3
+import collections
+startup_mark("import engine")
 
 
 
@@ -32,30 +59,16 @@ import datetime
 ###VIDEO_COMPRESSOR!!!#####
 
 
-# Constants
-DEFAULT_CRF_VALUES = {
-    "Low": [18, 19, 20, 21, 22],
-    "Medium": [23, 24, 25, 26],
-    "High": [27, 28, 29, 30, 31]
-}
-
-
-def has_audio_stream(video_path):
-    try:
-        cmd = ["ffprobe", "-v", "error", "-select_streams", "a", "-show_entries", "stream=index", "-of", "compact=p=0:nk=1", video_path]
-        subprocess.run(cmd, capture_output=True, text=True, check=True)
-        return True  # Audio stream found
-    except subprocess.CalledProcessError:
-        return False  # No audio stream found
-
-
 class VideoCompressor(QtCore.QThread):
     progress = pyqtSignal(int)
+    progress_event = pyqtSignal(object) #ProgressEvent with fps, speed and ETA
     finished = pyqtSignal(int, str)
+    result_ready = pyqtSignal(object) #EncodeResult, emitted right before finished
     output_line = pyqtSignal(str) #TERMINAL
+    unavailable = pyqtSignal(bool, str) #busy, error: the remote worker could not take or finish the job, emitted instead of finished
 
     def __init__(self, file_path, output_path="", crf_value=23,
-                video_codec="libx264", watermark_path="", x=0, y=0, preset="medium"):
+                video_codec="libx264", watermark_path="", x=0, y=0, preset="medium", limits=None, worker=None, **options):
         super().__init__()
         self.file_path = file_path
         self.output_path = output_path
@@ -65,57 +78,25 @@ class VideoCompressor(QtCore.QThread):
         self.preset = preset
         self.x = x
         self.y = y
+        self.options = options #Extra EncodeJob settings (segments, ...)
+        self.limits = limits #ProcessLimits of the scheduler slot this job runs in
+        self.worker = worker #RemoteWorker that encodes the job instead of this machine
+        self.last_percent = -1
 
     def run(self):
         try:
-            ffprobe_command = [
-                "ffprobe",
-                "-v", "error",
-                "-select_streams", "v:0",
-                "-show_entries", "stream=nb_frames",
-                "-of", "default=nokey=1:noprint_wrappers=1",
-                self.file_path
-            ]
-            ffprobe_process = subprocess.run(ffprobe_command, capture_output=True, text=True, check=True)
-            total_frames = int(ffprobe_process.stdout.strip())
-
-            ffmpeg_command = ["ffmpeg", "-i", self.file_path]
-
-
-
-            if self.watermark_path and os.path.exists(self.watermark_path):
-                ffmpeg_command.extend([
-                    "-i", self.watermark_path,
-                    "-filter_complex", f"[1:v]scale=45:45[wm];[0:v][wm]overlay={self.x}:{self.y}[out]",
-                    "-map", "[out]"
-                ])
-
-            ffmpeg_command.extend([
-                "-c:v", self.video_codec, "-preset", self.preset,
-                "-crf", str(self.crf_value)
-            ])
-            if has_audio_stream(self.file_path): #Check if has audio stream
-                ffmpeg_command.extend(["-c:a", "aac", "-b:a", "128k"]) #If has audio stream add the options
+            job = EncodeJob(self.file_path, self.output_path, self.crf_value, self.video_codec,
+                            self.watermark_path, self.x, self.y, self.preset, **self.options)
+            if self.worker is not None:
+                try:
+                    result = self.worker.encode(job, self.emit_progress, self.output_line.emit)
+                except WorkerUnavailable as e:
+                    self.unavailable.emit(isinstance(e, WorkerBusy), str(e))
+                    return
             else:
-                ffmpeg_command.extend(["-an"]) #If not has audio stream add the option to remove audio stream
-
-            ffmpeg_command.append(self.output_path)
-            process = subprocess.Popen(ffmpeg_command, stderr=subprocess.PIPE, text=True)
-            for line in iter(process.stderr.readline, ''):
-                self.output_line.emit(line.strip())
-                frame_match = re.search(r"frame=\s*(\d+)", line)
-                if frame_match and total_frames > 0:
-                    processed_frames = int(frame_match.group(1))
-                    progress = int((processed_frames / total_frames) * 100)
-                    self.progress.emit(progress)
-
-            process.wait()
-            return_code = process.returncode
-            self.finished.emit(return_code, "") # Emit empty string for error message if successful
-            if return_code != 0:
-                self.output_line.emit(f"FFmpeg exited with code: {return_code}")
-                full_error = process.stderr.read()
-                self.output_line.emit(f"Full error output:\n{full_error}")
+                result = run_encode_safe(job, self.emit_progress, self.output_line.emit, self.limits) #ffmpeg/probe errors come back as a failed result
+            self.result_ready.emit(result)
+            self.finished.emit(result.return_code, result.error_message) # Empty error message if successful
 
         except (subprocess.CalledProcessError, FileNotFoundError, ValueError, OSError) as e: #Add OSError
             error_message = str(e)
@@ -128,6 +109,517 @@ class VideoCompressor(QtCore.QThread):
             self.output_line.emit(f"Error: {error_message}")
             self.finished.emit(-1, error_message)
 
+    def emit_progress(self, event):
+        self.progress_event.emit(event)
+        if event.percent != self.last_percent:
+            self.last_percent = event.percent
+            self.progress.emit(event.percent)
+
+
+
+ESTIMATE_WAIT_MS = int(ESTIMATE_WAIT_SECONDS * 1000) #longest a batch waits for its cost estimates before the first jobs start
+
+
+class CostEstimator(QtCore.QThread):
+    # Probes queued files off the GUI thread so the scheduler can order them by estimated encode time
+    costEstimated = pyqtSignal(int, float) #job id, cost
+
+    def __init__(self, jobs, parent=None):
+        super().__init__(parent)
+        self.jobs = jobs #(job id, EncodeJob)
+
+    def run(self):
+        for job_id, job in self.jobs:
+            if self.isInterruptionRequested():
+                return
+            self.costEstimated.emit(job_id, estimate_job_cost(job))
+
+
+
+PREVIEW_MAX_SIZE = (960, 540) #preview frames are decoded at most this big, whatever the source resolution
+PREVIEW_CACHE_FRAMES = 48 #decoded preview frames kept, least recently used dropped first (~75 MB at the max size)
+PREVIEW_START = 100 #default scrub position in 1/1000 of the duration, the very first frame is often black
+
+
+class PreviewFrameLoader(QtCore.QThread):
+    # Decodes preview frames off the GUI thread into an LRU cache keyed by file and scrub position.
+    # A new scrub request replaces one that has not started yet; queued files are prefetched when nothing is asked for.
+    frameReady = pyqtSignal(str, int, QImage, int, int, float) #path, position, frame, video width, video height, timestamp
+    frameFailed = pyqtSignal(str, str)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.cache = collections.OrderedDict() #(path, position) -> (QImage, video width, video height, timestamp)
+        self.condition = threading.Condition()
+        self.request = None
+        self.prefetch = collections.deque()
+        self.stopping = False
+
+    def cached(self, path, position):
+        with self.condition:
+            entry = self.cache.get((path, position))
+            if entry is not None:
+                self.cache.move_to_end((path, position))
+            return entry
+
+    def load(self, path, position):
+        with self.condition:
+            self.request = (path, position)
+            self.condition.notify()
+
+    def prefetch_files(self, paths):
+        with self.condition:
+            self.prefetch.extend((path, PREVIEW_START) for path in paths)
+            self.condition.notify()
+
+    def stop(self):
+        with self.condition:
+            self.stopping = True
+            self.condition.notify()
+        self.wait()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.stopping and self.request is None and not self.prefetch:
+                    self.condition.wait()
+                if self.stopping:
+                    return
+                interactive = self.request is not None
+                key = self.request if interactive else self.prefetch.popleft()
+                self.request = None
+                entry = self.cache.get(key)
+            if entry is None:
+                try:
+                    entry = self.decode(*key)
+                except (subprocess.CalledProcessError, FileNotFoundError, ValueError, OSError) as e:
+                    if interactive:
+                        self.frameFailed.emit(key[0], str(e))
+                    continue
+                with self.condition:
+                    self.cache[key] = entry
+                    while len(self.cache) > PREVIEW_CACHE_FRAMES:
+                        self.cache.popitem(last=False)
+            if interactive:
+                self.frameReady.emit(key[0], key[1], *entry)
+
+    def decode(self, path, position):
+        media_info = probe_media(path)
+        timestamp = media_info.duration * min(position, 999) / 1000
+        width, height, rgb = grab_frame(path, timestamp, *PREVIEW_MAX_SIZE)
+        image = QImage(rgb, width, height, 3 * width, QImage.Format_RGB888).copy() #Own the pixels, rgb goes away with this frame
+        video_width, video_height = media_info.width or width, media_info.height or height
+        if (width > height) != (video_width > video_height): #Rotated on display, ffmpeg already turned the frame
+            video_width, video_height = video_height, video_width
+        return image, video_width, video_height, timestamp
+
+
+
+DISCOVERY_BATCH_MS = 250 #found files are handed to the GUI in chunks at most this often
+
+
+class DiscoveryThread(QtCore.QThread):
+    # Walks folders with discover_videos and streams what it finds, so huge trees never block the GUI
+    filesFound = pyqtSignal(list)
+    scanFinished = pyqtSignal(int) #number of files found
+
+    def __init__(self, directories, include=(), exclude=DEFAULT_EXCLUDES, max_depth=None, parent=None):
+        super().__init__(parent)
+        self.directories = directories
+        self.include = include
+        self.exclude = exclude
+        self.max_depth = max_depth
+        self.stop_event = threading.Event()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def run(self):
+        found = []
+        count = 0
+        last_emit = time.monotonic()
+        for path in discover_videos(self.directories, self.include, self.exclude, self.max_depth, self.stop_event):
+            found.append(path)
+            count += 1
+            if time.monotonic() - last_emit >= DISCOVERY_BATCH_MS / 1000:
+                self.filesFound.emit(found)
+                found = []
+                last_emit = time.monotonic()
+        if found:
+            self.filesFound.emit(found)
+        self.scanFinished.emit(count)
+
+
+
+class WorkerPoolThread(QtCore.QThread):
+    # Creating a WorkerPool pings every worker, an unreachable host would freeze the GUI until it times out
+    poolReady = pyqtSignal(object) #WorkerPool
+
+    def __init__(self, addresses, transfer, token, parent=None):
+        super().__init__(parent)
+        self.addresses = addresses
+        self.transfer = transfer
+        self.token = token
+
+    def run(self):
+        self.poolReady.emit(WorkerPool(self.addresses, self.transfer, token=self.token))
+
+
+
+class WatchFolderThread(QtCore.QThread):
+    # Runs the FolderWatcher and reports files that finished arriving and were never compressed before,
+    # as (path, size, mtime_ns) for the scheduler to claim them in the journal along with their jobs
+    filesReady = pyqtSignal(list)
+    watchError = pyqtSignal(str)
+
+    def __init__(self, directories, journal, recursive=False, stable_seconds=WATCH_STABLE_SECONDS, parent=None):
+        super().__init__(parent)
+        self.directories = directories
+        self.journal = journal
+        self.recursive = recursive
+        self.stable_seconds = stable_seconds
+        self.mode = ""
+
+    def run(self):
+        watcher = FolderWatcher(self.directories, self.recursive, self.stable_seconds)
+        self.mode = watcher.mode
+        if watcher.inotify_error:
+            self.watchError.emit(f"inotify unavailable, polling instead: {watcher.inotify_error}")
+        try:
+            while not self.isInterruptionRequested():
+                new_files = []
+                for path in watcher.poll(0.5):
+                    try:
+                        stat = os.stat(path)
+                        if self.journal is None or not self.journal.watched_claimed(path, stat.st_size, stat.st_mtime_ns):
+                            new_files.append((path, stat.st_size, stat.st_mtime_ns))
+                    except (OSError, sqlite3.Error) as e:
+                        self.watchError.emit(f"{path}: {e}")
+                if new_files:
+                    self.filesReady.emit(new_files)
+        finally:
+            watcher.close()
+
+
+
+######################################################
+###COMPRESSION_SCHEDULER!!!#####
+###COMPRESSION_SCHEDULER!!!#####
+
+
+class CompressionScheduler(QtCore.QObject):
+    jobStarted = pyqtSignal(int, str) #job id, file path
+    jobProgress = pyqtSignal(int, int) #job id, percent
+    jobProgressEvent = pyqtSignal(int, object) #job id, ProgressEvent
+    jobFinished = pyqtSignal(int, int, str) #job id, exit code, error message
+    outputLine = pyqtSignal(int, str) #job id, terminal line
+    batchProgress = pyqtSignal(int) #combined percent over the whole batch
+    batchFinished = pyqtSignal(int, str) #failed job count, summary
+
+    def __init__(self, max_jobs=None, parent=None):
+        super().__init__(parent)
+        self.max_jobs = max_jobs or default_max_jobs()
+        self.order = "sjf"
+        self.queue = JobQueue(self.order) #job ids waiting for a free worker
+        self.estimators = [] #CostEstimator threads still probing
+        self.batch_number = 0 #Estimates that arrive after their batch ended are dropped
+        self.batch_settings = {}
+        self.holding = False #True while the first estimates of a batch are still coming in
+        self.running = {} #job id -> VideoCompressor
+        self.job_files = {} #job id -> file path
+        self.job_outputs = {} #job id -> output path
+        self.job_progress = {} #job id -> last reported percent
+        self.job_events = {} #job id -> last ProgressEvent
+        self.failures = [] #(file path, error message)
+        self.job_results = {} #job id -> EncodeResult
+        self.job_settings = {} #job id -> VideoCompressor keyword arguments
+        self.planned_outputs = {} #job id -> output path recorded by an interrupted batch
+        self.job_rows = {} #job id -> journal row id
+        self.watched_files = {} #file path -> (size, mtime_ns) of watched files whose claim goes in with their job
+        self.batch_percent = -1
+        try:
+            self.journal = JobJournal()
+        except (sqlite3.Error, OSError) as e:
+            print(f"Job journal unavailable, batches cannot be resumed: {e}")
+            self.journal = None
+        self.metrics = MetricsRecorder() #Settings tab: Job Metrics
+        self.resources = {} #WorkerLayout settings from the Settings tab: Worker Resources
+        self.layout = WorkerLayout(self.max_jobs)
+        self.job_slots = {} #running job id -> layout slot
+        self.pool = None #WorkerPool from the Settings tab: Remote Workers
+        self.remote_jobs = {} #running job id -> RemoteWorker
+        self.job_attempts = {} #job id -> remote workers that failed it
+        self.job_busy = {} #job id -> "busy" replies it got from remote workers
+        self.job_retries = {} #job id -> retry limit of the pool it was sent to, which may have been replaced since
+
+    def is_busy(self):
+        return bool(self.queue or self.running)
+
+    def set_max_jobs(self, max_jobs):
+        self.max_jobs = max(1, int(max_jobs))
+        self.layout = WorkerLayout(self.max_jobs, **self.resources) #Running jobs keep the limits they started with
+        self.fill_slots() #Growing the pool takes effect mid-batch
+
+    def set_resources(self, **resources):
+        self.resources = resources
+        self.layout = WorkerLayout(self.max_jobs, **resources)
+
+    def set_pool(self, pool):
+        # Jobs already on the old pool's workers finish there
+        if self.pool is not None:
+            self.pool.close()
+        self.pool = pool
+        self.fill_slots()
+
+    def set_order(self, order):
+        self.order = order
+        self.queue.order = order
+
+    def start_batch(self, files, crf_value, compression_level, video_codec, watermark_path, x, y, preset, **options):
+        settings = dict(crf_value=crf_value, compression_level=compression_level, video_codec=video_codec,
+                        watermark_path=watermark_path, x=x, y=y, preset=preset, **options)
+        self.batch_settings = settings
+        self.run_batch([(file_path, dict(settings), "", None) for file_path in files])
+
+    def add_files(self, files, priority, settings=None):
+        # Files dropped or watched while a batch runs join it in the given lane, with the batch's settings unless others are given
+        start = max(self.job_files, default=-1) + 1
+        new_ids = list(range(start, start + len(files)))
+        for job_id, file_path in zip(new_ids, files):
+            self.job_files[job_id] = file_path
+            self.job_settings[job_id] = dict(settings or self.batch_settings, priority=priority)
+            self.job_progress[job_id] = 0
+            self.queue.push(job_id, priority)
+        self.journal_new_jobs()
+        self.estimate_costs(new_ids)
+        self.emit_batch_progress()
+        self.fill_slots()
+
+    def resume_batch(self, entries):
+        # entries are (journal row id, EncodeJob) from JobJournal.interrupted()
+        jobs = []
+        for row_id, job in entries:
+            settings = job.as_dict()
+            file_path = settings.pop("file_path")
+            output_path = settings.pop("output_path")
+            jobs.append((file_path, settings, output_path, row_id))
+        self.batch_settings = jobs[0][1] if jobs else {}
+        self.run_batch(jobs)
+
+    def run_batch(self, jobs):
+        self.batch_number += 1
+        self.queue = JobQueue(self.order)
+        for job_id, (_, settings, _, _) in enumerate(jobs):
+            self.queue.push(job_id, settings.get("priority", PRIORITY_LANES["Normal"]))
+        self.job_files = {job_id: file_path for job_id, (file_path, _, _, _) in enumerate(jobs)}
+        self.job_settings = {job_id: settings for job_id, (_, settings, _, _) in enumerate(jobs)}
+        self.planned_outputs = {job_id: output_path for job_id, (_, _, output_path, _) in enumerate(jobs) if output_path}
+        self.job_rows = {job_id: row_id for job_id, (_, _, _, row_id) in enumerate(jobs) if row_id is not None}
+        self.job_outputs = {}
+        self.job_progress = {job_id: 0 for job_id in self.job_files}
+        self.job_events = {}
+        self.failures = []
+        self.job_results = {}
+        self.job_attempts = {}
+        self.job_busy = {}
+        self.job_retries = {}
+        self.batch_percent = -1
+        self.journal_new_jobs()
+        estimator = self.estimate_costs(list(self.job_files))
+        if estimator is not None:
+            # Give the probes a moment so the first slots go to the shortest files; a huge batch starts anyway and is re-ranked as estimates arrive
+            self.holding = True
+            estimator.finished.connect(lambda batch_number=self.batch_number: self.release_queue(batch_number))
+            QtCore.QTimer.singleShot(ESTIMATE_WAIT_MS, lambda batch_number=self.batch_number: self.release_queue(batch_number))
+        self.fill_slots()
+
+    def release_queue(self, batch_number):
+        if batch_number == self.batch_number and self.holding:
+            self.holding = False
+            self.fill_slots()
+
+    def estimate_costs(self, job_ids):
+        if self.order != "sjf" or not job_ids:
+            return None
+        estimator = CostEstimator([(job_id, EncodeJob(self.job_files[job_id], "", **self.job_settings[job_id])) for job_id in job_ids], self)
+        estimator.costEstimated.connect(lambda job_id, cost, batch_number=self.batch_number: self.on_cost_estimated(batch_number, job_id, cost))
+        estimator.finished.connect(lambda estimator=estimator: self.estimators.remove(estimator))
+        self.estimators.append(estimator)
+        estimator.start()
+        return estimator
+
+    def on_cost_estimated(self, batch_number, job_id, cost):
+        if batch_number == self.batch_number:
+            self.queue.set_cost(job_id, cost)
+
+    def journal_new_jobs(self):
+        # Every job is on disk before the first one starts, so a crash at any point leaves the rest resumable
+        if self.journal is None:
+            return
+        new_ids = [job_id for job_id in self.job_files if job_id not in self.job_rows]
+        watched = [self.watched_files.pop(self.job_files[job_id], None) for job_id in new_ids]
+        if self.journal is None:
+            return
+        jobs = [EncodeJob(self.job_files[job_id], "", **self.job_settings[job_id]) for job_id in new_ids]
+        try:
+            row_ids = self.journal.add_jobs(jobs, watched)
+        except sqlite3.Error as e:
+            print(f"Could not record the batch in the job journal: {e}")
+            return
+        dropped = [job_id for job_id, row_id in zip(new_ids, row_ids) if row_id is None]
+        self.job_rows.update((job_id, row_id) for job_id, row_id in zip(new_ids, row_ids) if row_id is not None)
+        for job_id in dropped:
+            self.drop_job(job_id)
+        if dropped and not self.running and not self.queue: #Every file was taken by another watcher
+            QtCore.QTimer.singleShot(0, self.finish_batch)
+
+    def drop_job(self, job_id):
+        # A watched file that another watcher queued first
+        print(f"{self.job_files[job_id]} was already queued by another watcher")
+        self.queue.remove(job_id)
+        for jobs in (self.job_files, self.job_settings, self.job_progress):
+            jobs.pop(job_id, None)
+
+    def fill_slots(self):
+        if self.holding:
+            return
+        while self.queue:
+            # This machine's slots first, then the free slots of healthy remote workers
+            worker = None
+            if len(self.running) - len(self.remote_jobs) >= self.max_jobs:
+                worker = self.free_worker()
+                if worker is None:
+                    break
+            job_id = self.queue.pop()
+            self.start_job(job_id, self.job_files[job_id], worker)
+
+    def free_worker(self):
+        if self.pool is None:
+            return None
+        for worker in self.pool.workers:
+            if worker.healthy and list(self.remote_jobs.values()).count(worker) < worker.slots:
+                return worker
+        return None
+
+    def start_job(self, job_id, file_path, worker=None):
+        settings = self.job_settings[job_id]
+        output_path = self.planned_outputs.get(job_id)
+        if not output_path or os.path.exists(output_path) or output_path in self.job_outputs.values():
+            output_path = make_output_path(file_path, settings["compression_level"], set(self.job_outputs.values()), settings.get("output_dir", ""))
+        self.job_outputs[job_id] = output_path
+        self.journal_update("mark_running", job_id, output_path)
+
+        if worker is not None:
+            self.remote_jobs[job_id] = worker
+            self.job_retries[job_id] = self.pool.retries
+            compressor = VideoCompressor(file_path, output_path, worker=worker, **settings)
+            compressor.unavailable.connect(lambda busy, error_message, job_id=job_id: self.on_job_unavailable(job_id, busy, error_message))
+        else:
+            slot = min(set(range(len(self.layout.slots))) - set(self.job_slots.values()))
+            self.job_slots[job_id] = slot
+            compressor = VideoCompressor(file_path, output_path, limits=self.layout.limits(slot), **settings)
+        compressor.progress.connect(lambda progress, job_id=job_id: self.on_job_progress(job_id, progress))
+        compressor.progress_event.connect(lambda event, job_id=job_id: self.on_job_progress_event(job_id, event))
+        compressor.output_line.connect(lambda line, job_id=job_id: self.outputLine.emit(job_id, line))
+        compressor.result_ready.connect(lambda result, job_id=job_id: self.job_results.__setitem__(job_id, result))
+        compressor.finished.connect(lambda exit_code, error_message, job_id=job_id: self.on_job_finished(job_id, exit_code, error_message))
+        self.running[job_id] = compressor
+        self.jobStarted.emit(job_id, file_path)
+        if worker is not None:
+            self.outputLine.emit(job_id, f"Sent {os.path.basename(file_path)} to worker {worker.address} ({worker.host})")
+        compressor.start()
+
+    def on_job_progress(self, job_id, progress):
+        if job_id not in self.running:
+            return
+        self.job_progress[job_id] = progress
+        self.jobProgress.emit(job_id, progress)
+        self.emit_batch_progress()
+
+    def on_job_progress_event(self, job_id, event):
+        if job_id not in self.running:
+            return
+        self.job_events[job_id] = event
+        self.jobProgressEvent.emit(job_id, event)
+
+    def on_job_finished(self, job_id, exit_code, error_message):
+        compressor = self.running.pop(job_id, None)
+        if compressor is None:
+            return
+        compressor.wait() #finished is emitted from inside run(), let the thread actually end before dropping it
+        self.job_slots.pop(job_id, None)
+        self.remote_jobs.pop(job_id, None)
+        self.job_progress[job_id] = 100
+        if job_id in self.job_results:
+            self.journal_update("mark_finished", job_id, self.job_results[job_id])
+            try:
+                self.metrics.record(self.job_results[job_id])
+            except OSError as e:
+                print(f"Could not record the job metrics: {e}")
+        else:
+            self.journal_update("mark_failed", job_id, error_message)
+        if exit_code != 0:
+            self.failures.append((self.job_files[job_id], error_message or f"FFmpeg exited with code {exit_code}"))
+        self.jobFinished.emit(job_id, exit_code, error_message)
+        self.emit_batch_progress()
+
+        self.fill_slots()
+        if not self.running and not self.queue:
+            self.finish_batch()
+
+    def on_job_unavailable(self, job_id, busy, error_message):
+        worker = self.remote_jobs.get(job_id)
+        if worker is None:
+            return
+        if busy:
+            self.job_busy[job_id] = self.job_busy.get(job_id, 0) + 1
+            busy = self.job_busy[job_id] <= WORKER_BUSY_RETRIES #A worker that never frees up counts as failed
+        if not busy:
+            worker.mark_down(error_message) #Until the next health check gets an answer again
+            self.job_attempts[job_id] = self.job_attempts.get(job_id, 0) + 1
+        self.outputLine.emit(job_id, f"Worker {worker.address} could not finish {os.path.basename(self.job_files[job_id])}: {error_message}")
+        if not busy and self.job_attempts[job_id] > self.job_retries[job_id]:
+            self.on_job_finished(job_id, -1, f"Gave up after {self.job_attempts[job_id]} failed workers: {error_message}")
+            return
+        self.running.pop(job_id).wait()
+        self.remote_jobs.pop(job_id)
+        self.job_outputs.pop(job_id, None) #start_job picks the output again, wherever the job lands
+        self.job_progress[job_id] = 0
+        self.queue.push(job_id, self.job_settings[job_id].get("priority", PRIORITY_LANES["Normal"])) #Next free slot, this machine's included
+        self.emit_batch_progress()
+        if busy:
+            QtCore.QTimer.singleShot(1000, self.fill_slots) #Someone else is using the worker, give it a moment
+        else:
+            self.fill_slots()
+
+    def journal_update(self, method, job_id, *args):
+        if self.journal is None or job_id not in self.job_rows:
+            return
+        try:
+            getattr(self.journal, method)(self.job_rows[job_id], *args)
+        except sqlite3.Error as e:
+            print(f"Job journal update failed: {e}")
+
+    def emit_batch_progress(self):
+        if not self.job_progress:
+            return
+        percent = sum(self.job_progress.values()) // len(self.job_progress)
+        if percent != self.batch_percent:
+            self.batch_percent = percent
+            self.batchProgress.emit(percent)
+
+    def finish_batch(self):
+        sections = []
+        if self.failures:
+            lines = [f"{os.path.basename(path)}: {message}" for path, message in self.failures]
+            sections.append(f"{len(self.failures)} of {len(self.job_files)} files failed:\n" + "\n".join(lines))
+        for action, title in (("skipped", "Skipped"), ("remuxed", "Remuxed without re-encoding"), ("kept_original", "Kept the original"),
+                              ("cached", "Reused an earlier result")):
+            lines = [f"{os.path.basename(result.job.file_path)}: {result.reason}" for result in self.job_results.values() if result.action == action]
+            if lines:
+                sections.append(f"{title} ({len(lines)}):\n" + "\n".join(lines))
+        self.batchFinished.emit(len(self.failures), "\n\n".join(sections))
+
 
 
 ######################################################
@@ -157,7 +649,11 @@ class DragDropFrame(QFrame):
 
         self.compressing = False
         self.dropped_files = []
-        self.compress_queue = []
+
+        self.scheduler = CompressionScheduler(parent=self)
+        self.scheduler.jobFinished.connect(self.compression_finished_single)
+        self.scheduler.batchProgress.connect(self.update_progress_display)
+        self.scheduler.batchFinished.connect(self.batch_finished)
 
         
         self.setSizePolicy(QSizePolicy.MinimumExpanding, QSizePolicy.Expanding)
@@ -189,7 +685,23 @@ class DragDropFrame(QFrame):
         self.content_layout.setAlignment(Qt.AlignCenter)
         self.main_layout.addWidget(self.initial_widget) #Add the content widget to the main layout
 
-        self.load_image()
+        # Status labels are created once and only get new pixmaps, the pixmaps themselves are cached
+        self.pixmap_cache = {} #(image path, text) -> combined pixmap
+        self.shown_percent = None #Percent currently painted on the compressing label
+        self.loaded_label = QLabel()
+        self.loaded_label.setAlignment(Qt.AlignCenter)
+        self.loaded_label.hide()
+        self.main_layout.addWidget(self.loaded_label)
+        self.compressing_label = QLabel()
+        self.compressing_label.setAlignment(Qt.AlignCenter)
+        self.compressing_label.hide()
+        self.main_layout.addWidget(self.compressing_label)
+
+        placeholder_label = QLabel("Drag and Drop files here") #load_image swaps in the animation after the first paint
+        placeholder_label.setAlignment(Qt.AlignCenter)
+        placeholder_label.setFont(QFont("Arial", 12))
+        placeholder_label.setStyleSheet("color: #333333;")
+        self.content_layout.addWidget(placeholder_label)
 
 
 
@@ -198,19 +710,10 @@ class DragDropFrame(QFrame):
 #####DRAG_DROP_VISUAL#####
 
     def update_progress_display(self, progress, y_offset=-21):
-        if hasattr(self, 'compressing_label'):
-            self.main_layout.removeWidget(self.compressing_label)
-            self.compressing_label.deleteLater()
-            del self.compressing_label
+        if progress == self.shown_percent and self.compressing_label.isVisible():
+            return #Only the percentage text changes, and only when the integer percent does
         self.compressing_icons(progress, y_offset) #Call compressing_icons with progress
 
-
-        self.progress_label.show() #Hide the main label
-        self.progress_label.raise_() #Bring to front
-        
-
-        QApplication.processEvents()
-
     def reset_display(self):
 
         
@@ -218,6 +721,7 @@ class DragDropFrame(QFrame):
         self.initial_widget.show()
         self.compressing_label.hide()
         self.loaded_label.hide()
+        self.shown_percent = None
         self.dropped_files.clear()
         
         self.main_window.progress_bar.hide()
@@ -263,6 +767,12 @@ class DragDropFrame(QFrame):
         except Exception as e:
             print(f"An unexpected error occurred: {e}")
             return None
+
+    def cached_combined_pixmap(self, image_path, text):
+        key = (image_path, text)
+        if key not in self.pixmap_cache: #Failures are cached too, a missing icon is not looked up again
+            self.pixmap_cache[key] = self.create_combined_pixmap(image_path, text)
+        return self.pixmap_cache[key]
         
 
     def load_image(self):
@@ -314,27 +824,19 @@ class DragDropFrame(QFrame):
         self.progress_label.setAlignment(Qt.AlignCenter)
         
 
-        if hasattr(self, 'loaded_label'):
-            self.main_layout.removeWidget(self.loaded_label)
-            self.loaded_label.deleteLater()
-            del self.loaded_label
-        
-        pixmap = self.create_combined_pixmap("Images/Icons/videoready.svg", "Video File is Ready")
-   
+        pixmap = self.cached_combined_pixmap("Images/Icons/videoready.svg", "Video File is Ready")
         if pixmap:
-            label = QLabel()
-            label.setPixmap(pixmap)
-            label.setAlignment(Qt.AlignCenter)
-            self.main_layout.addWidget(label) #add the label to the main layout.
-            self.loaded_label = label
+            self.loaded_label.setPixmap(pixmap)
+            self.loaded_label.show()
 
     def compressing_icons(self, progress=None, y_offset=-21):
         self.initial_widget.hide()
         self.progress_label.hide()
         self.progress_label.setAlignment(Qt.AlignCenter)
 
-        pixmap = self.create_combined_pixmap("Images/Icons/videoready.svg", "Compressing...")
-        if pixmap:
+        base_pixmap = self.cached_combined_pixmap("Images/Icons/videoready.svg", "Compressing...")
+        if base_pixmap:
+            pixmap = QPixmap(base_pixmap) #Paint the percentage on a copy, the cached base stays clean
             if progress is not None:
                 painter = QPainter(pixmap)
                 painter.setRenderHint(QPainter.Antialiasing)
@@ -349,31 +851,34 @@ class DragDropFrame(QFrame):
                 painter.drawText(offset_rect, Qt.AlignCenter, str(progress) + "%")
                 painter.end()
 
-            label = QLabel()
-            label.setPixmap(pixmap)
-            label.setAlignment(Qt.AlignCenter)
-            self.main_layout.addWidget(label)
-            self.compressing_label = label
+            self.compressing_label.setPixmap(pixmap)
+            self.compressing_label.show()
+            self.shown_percent = progress
 
 ######################################################           
 ######################################################       
 
 
     def dragEnterEvent(self, event):
-        if self.compressing:  # Check if compressing
-            event.ignore()  # Reject drops if compressing
-            return
-        if event.mimeData().hasUrls():
+        if event.mimeData().hasUrls(): #While compressing, drops join the running batch
             event.accept()
         else:
             event.ignore()
 
     def dropEvent(self, event):
-        if self.compressing: #Check if compressing
-            return
         event.accept()
         new_files = [url.toLocalFile() for url in event.mimeData().urls()]
+        directories = [path for path in new_files if os.path.isdir(path)]
+        if directories: #Folders are scanned in the background and their videos stream in
+            self.main_window.scan_directories(directories)
+            new_files = [path for path in new_files if path not in directories]
+            if not new_files:
+                return
+        if self.compressing:
+            self.queue_during_batch(new_files)
+            return
         self.dropped_files.extend(new_files)
+        self.main_window.preview_files_added(new_files)
         print(f"Files dropped: {self.dropped_files}")
 
 
@@ -381,95 +886,114 @@ class DragDropFrame(QFrame):
         self.loaded_icons()
 
  
-    def compress_files(self, crf_value, compression_level, video_codec, watermark_path, x, y, preset):
+    def compress_files(self, settings):
+        # settings are the EncodeJob keyword arguments from MainWindow.current_settings() or a profile
         if self.compressing or not self.dropped_files: #Check if compressing
             return 
 
         self.loaded_label.hide()
         self.initial_widget.hide()
-        preset = self.main_window.preset_combo.currentText()
         self.compressing = True #Set the flag
-        self.compress_queue = list(self.dropped_files)
         self.compressionStarted.emit() #Emit signal
 
-        
-        self.process_next_file(crf_value, compression_level, video_codec, watermark_path, x, y, preset)
-
-    def process_next_file(self, crf_value, compression_level, video_codec, watermark_path, x, y, preset):
-        preset = self.main_window.preset_combo.currentText()
-        if not self.compress_queue:  # Queue is empty, all done
-            self.compressing = False
- #Reset display after all compression
-            self.main_window.compression_finished(0,"") # Tell main window compression has finished
-            
-            self.compressionEnded.connect(self.compression_finished_single)
-            self.compressionEnded.emit() #Emit Signal
-            self.compressionFinished.emit(0, "") #Signal the end of all compression
-            self.main_window.processing_label.setText("No file processing")
-            self.reset_display()
+        self.main_window.process_output.show()
+        self.scheduler.set_max_jobs(self.main_window.jobs_spin.value())
+        self.scheduler.set_order(self.main_window.queue_order())
+        self.scheduler.start_batch(list(self.dropped_files), **settings)
+
+    def queue_files(self, files, settings):
+        # Watch-folder entry point: starts a batch, or joins the running one
+        if self.compressing:
+            self.scheduler.add_files(files, settings.get("priority", PRIORITY_LANES["Normal"]), settings)
             return
+        self.dropped_files = list(files)
+        self.main_window.prepare_batch_display(clear_log=False) #Keep the watch history in the terminal, the view is bounded anyway
+        self.compress_files(settings)
 
-        self.main_window.process_output.show()
-        file_path = self.compress_queue.pop(0) #get the first item in the queue
-        filename = os.path.basename(file_path)
-        base_filename = os.path.splitext(os.path.basename(file_path))[0]
-        output_filename = f"{base_filename}_{compression_level}_compressed.mp4"
-        output_path = os.path.join(os.path.dirname(file_path), output_filename)
-        self.main_window.processing_label.setText(f"Processing: {filename}") # Update the label
-
-        counter = 1
-        while os.path.exists(output_path):
-            output_filename = f"{base_filename}_{compression_level}_{counter}_compressed.mp4"
-            output_path = os.path.join(os.path.dirname(file_path), output_filename)
-            counter += 1
-
-        self.video_compressor = VideoCompressor(file_path, output_path, crf_value, video_codec, watermark_path, x, y, preset)
-        self.video_compressor.progress.connect(self.main_window.update_progress)
-        try:
-            self.video_compressor.output_line.disconnect() #Try to disconnect first
-        except TypeError:
-            pass
-        self.video_compressor.output_line.connect(self.main_window.append_process_output)
+    def resume_files(self, entries):
+        if self.compressing or not entries:
+            return
+        self.dropped_files = [job.file_path for _, job in entries]
+        self.loaded_label.hide()
+        self.initial_widget.hide()
+        self.compressing = True
+        self.compressionStarted.emit()
 
-        self.video_compressor.progress.connect(self.update_progress_display)
+        self.main_window.process_output.show()
+        self.scheduler.set_max_jobs(self.main_window.jobs_spin.value())
+        self.scheduler.set_order(self.main_window.queue_order())
+        self.scheduler.resume_batch(entries)
+
+    def queue_during_batch(self, files):
+        queued = set(self.scheduler.job_files.values())
+        files = [path for path in dict.fromkeys(files) if path not in queued and os.path.isfile(path) and is_video_file(path)]
+        if not files:
+            return
+        lane = self.main_window.priority_combo.currentText()
+        self.dropped_files.extend(files)
+        self.scheduler.add_files(files, PRIORITY_LANES[lane])
+        self.main_window.append_process_output(f"Queued {len(files)} more file(s) at {lane} priority: " + ", ".join(os.path.basename(path) for path in files))
+
+    def compression_finished_single(self, job_id, exit_code, error_message):
+        # Failures are collected by the scheduler and reported once the batch ends, a modal box here would stall the other jobs
+        filename = os.path.basename(self.scheduler.job_files[job_id])
+        if exit_code != 0:
+            self.main_window.append_process_output(f"Compression failed for {filename}: {error_message or exit_code}")
+        else:
+            self.main_window.append_process_output(f"Finished: {filename}")
 
-        
-        self.video_compressor.finished.connect(
-            lambda exit_code, error_message: self.compression_finished_single(exit_code, error_message, crf_value, compression_level, video_codec, watermark_path, x, y, preset)
-        )
-        self.video_compressor.start()
+    def batch_finished(self, failed_count, summary):
+        self.compressing = False
+        self.dropped_files.clear()
+        self.main_window.processing_label.setText("No file processing") # Reset the label
+        self.compressionEnded.emit() #Emit Signal
+        self.compressionFinished.emit(1 if failed_count else 0, summary) #Signal that all compression is finished
+    
+########################################################
 
-    def compression_finished_single(self, exit_code, error_message, crf_value, compression_level, video_codec, watermark_path, x, y, preset):
-        if exit_code != 0:
-            QMessageBox.critical(self.main_window, "Compression Error", f"Video compression failed: {error_message}")
-        # Process the next file in the queue
 
-        
-        
-        if not self.compress_queue:
-             #Check if the queue is empty before enabling the button again
-            self.reset_display()
-            self.dropped_files.clear()
-            
-
-            self.compressing = False
-            self.main_window.processing_label.setText("No file processing") # Reset the label
-            self.compressionEnded.emit() #Emit Signal
-            self.compressionFinished.emit(exit_code, error_message) #Signal that all compression is finished
+########################################################
+###PROCESS_LOG_VIEW!!!#####
+###PROCESS_LOG_VIEW!!!#####
+
+LOG_VIEW_MAX_LINES = 5000 #Lines kept in the widget, "Save Logs" keeps the full log of every job on disk
+LOG_VIEW_FLUSH_MS = 200
+
+
+class ProcessLogView(QtWidgets.QPlainTextEdit):
+    # Lines are buffered and painted in one go per timer tick, the widget keeps a capped ring of recent lines
+    def __init__(self, parent=None, max_lines=LOG_VIEW_MAX_LINES, flush_ms=LOG_VIEW_FLUSH_MS):
+        super().__init__(parent)
+        self.setReadOnly(True)
+        self.setMaximumBlockCount(max_lines)
+        self.pending = []
+        self.pending_lock = threading.Lock() #append_line may be called from worker threads
+        self.flush_timer = QtCore.QTimer(self)
+        self.flush_timer.timeout.connect(self.flush)
+        self.flush_timer.start(flush_ms)
+
+    def append_line(self, line):
+        with self.pending_lock:
+            self.pending.append(line)
+
+    append = append_line #Same call as the QTextEdit this replaces
+
+    def flush(self):
+        with self.pending_lock:
+            lines, self.pending = self.pending, []
+        if not lines:
             return
-        
-        
-        if hasattr('compressing_label', "loaded_label"): #Check if the label exists
-            self.main_layout.removeWidget(self.compressing_label, self.loaded_label) #Remove the label from the layout
-            self.compressing_label.deleteLater()
-            self.loaded_label.deleteLater() #Delete the label
-            del (self.compressing_label, self.loaded_label)
-        
-            self.reset_display()
+        text = "\n".join(lines)
+        scroll_bar = self.verticalScrollBar()
+        follow = scroll_bar.value() >= scroll_bar.maximum() - 2 #Only stick to the bottom if the user hasn't scrolled up
+        self.appendPlainText(text)
+        if follow:
+            scroll_bar.setValue(scroll_bar.maximum())
 
-        self.process_next_file(crf_value, compression_level, video_codec, watermark_path, x, y, preset)
-    
-########################################################
+    def clear(self):
+        with self.pending_lock:
+            self.pending = []
+        super().clear()
 
 
 ########################################################
@@ -523,6 +1047,12 @@ class MainWindow(QtWidgets.QMainWindow):
         self.drag_drop_frame.compressionFinished.connect(self.all_compression_finished)
         self.drag_drop_frame.compressionStarted.connect(self.disable_buttons)
         self.drag_drop_frame.compressionEnded.connect(self.enable_buttons)
+        self.drag_drop_frame.scheduler.batchProgress.connect(self.update_progress)
+        self.drag_drop_frame.scheduler.jobStarted.connect(self.job_started)
+        self.drag_drop_frame.scheduler.jobProgressEvent.connect(self.update_processing_label)
+        self.drag_drop_frame.scheduler.jobFinished.connect(self.update_processing_label)
+        self.drag_drop_frame.scheduler.outputLine.connect(self.append_job_output)
+        self.drag_drop_frame.scheduler.jobFinished.connect(self.close_job_log)
         # Browse File?DIrectory Buttons 
         # Connect signals to enable/disable buttons
         self.drag_drop_frame.compressionStarted.connect(self.disable_buttons)
@@ -536,6 +1066,7 @@ class MainWindow(QtWidgets.QMainWindow):
         ###VIDEO_FILE_CURRENT_PROCESSING####
         self.processing_label = QLabel("No file processing", self) # Create the label
         self.processing_label.setAlignment(Qt.AlignCenter) #Center the label
+        self.processing_label.setWordWrap(True) #Parallel jobs each add their own status
 
 
 ###############################################################
@@ -543,8 +1074,7 @@ class MainWindow(QtWidgets.QMainWindow):
         ###PROCESSING_TERMINAL####
         self.terminal_group = QGroupBox("Process Terminal", self)  # Create a QGroupBox
         self.terminal_layout = QVBoxLayout(self.terminal_group) #Layout for the groupbox
-        self.process_output = QTextEdit(self)
-        self.process_output.setReadOnly(True)
+        self.process_output = ProcessLogView(self)
         self.process_output.setFont(QFont("Courier New", 10))
         self.terminal_layout.addWidget(self.process_output) #Add the text edit to the groupbox
         self.terminal_group.setLayout(self.terminal_layout) #Set the layout to the groupbox
@@ -558,11 +1088,15 @@ class MainWindow(QtWidgets.QMainWindow):
         self.log_status_label.setStyleSheet("color: green;") #Set color to green
         self.save_logs_checkbox = QCheckBox("Save Logs", self)
         self.save_logs_checkbox.setChecked(False) # Default unchecked
+        self.save_logs_checkbox.setToolTip("Write each job's ffmpeg output to its own gzipped file in PkLogs as it runs")
 
         ###SAVING_TERMINAL_LOGS_LOCATION####   
         self.logs_directory = "PkLogs" #Set the logs directory
         if not os.path.exists(self.logs_directory): #Create the directory if it doesn't exist
             os.makedirs(self.logs_directory)
+        self.job_logs = JobLogSink(self.logs_directory) #One streamed, gzipped log per job while "Save Logs" is checked
+        self.logged_jobs = set()
+        QApplication.instance().aboutToQuit.connect(self.job_logs.stop) #Flushes and gzips the logs of jobs still running
 
 ####################################################################
 
@@ -585,16 +1119,49 @@ class MainWindow(QtWidgets.QMainWindow):
         self.watermark_path_edit = QLineEdit()
         self.preview_window = PreviewWindow(self)
         self.watermark_position = QPoint(10, 10) #Store the position
+        self.discovery_threads = [] #Folder scans still running
+        self.preview_loader = PreviewFrameLoader(self)
+        self.preview_loader.frameReady.connect(self.show_preview_frame)
+        self.preview_loader.frameFailed.connect(lambda path, message: self.preview_time_label.setText("No frame"))
+        self.preview_loader.start()
+        QApplication.instance().aboutToQuit.connect(self.preview_loader.stop) #Also when the app quits without closeEvent
+        self.watch_thread = None
+        self.watch_settings = {}
         
         self.setup_main_tab()
-        self.setup_other_tabs(self.tools_tab, "Details Content")
-        self.setup_settings_tab()
-        self.setup_other_tabs(self.about_tab, "About Content")
+        self.deferred_tabs_ready = False #Tools/Settings/About are built after the first paint, or when first needed
+        self.first_paint_done = False
+        self.tabs.currentChanged.connect(self.setup_deferred_tabs)
 
         self.central_widget.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
         self.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
         self.setMaximumSize(500, 800)
 
+    def paintEvent(self, event):
+        super().paintEvent(event)
+        if not self.first_paint_done:
+            self.first_paint_done = True
+            startup_mark("first paint")
+            QtCore.QTimer.singleShot(0, self.finish_startup)
+
+    def finish_startup(self):
+        # Everything the first frame does not show
+        self.setup_deferred_tabs()
+        self.load_fonts()
+        startup_mark("fonts")
+        self.drag_drop_frame.load_image()
+        startup_mark("drop animation")
+        self.offer_resume()
+
+    def setup_deferred_tabs(self):
+        if self.deferred_tabs_ready:
+            return
+        self.deferred_tabs_ready = True
+        self.setup_tools_tab()
+        self.setup_settings_tab()
+        self.setup_other_tabs(self.about_tab, "About Content")
+        startup_mark("other tabs")
+
         
 
     def disable_buttons(self):
@@ -617,7 +1184,8 @@ class MainWindow(QtWidgets.QMainWindow):
         options = QtWidgets.QFileDialog.Options()
         options |= QtWidgets.QFileDialog.DontUseNativeDialog
         options |= QtWidgets.QFileDialog.DontUseCustomDirectoryIcons #Optional
-        files, _ = QtWidgets.QFileDialog.getOpenFileNames(self, "Select Video Files", "", "Video Files (*.mp4 *.avi *.mov *.mkv);;All Files (*)", options=options)
+        files, _ = QtWidgets.QFileDialog.getOpenFileNames(self, "Select Video Files", "",
+                                                          "Video Files (*.mp4 *.avi *.mov *.mkv *.m4v *.webm *.mts *.m2ts *.ts *.mpg *.mpeg *.wmv *.flv);;All Files (*)", options=options)
         if files:
             self.handle_input(files)
 
@@ -626,26 +1194,44 @@ class MainWindow(QtWidgets.QMainWindow):
         options |= QtWidgets.QFileDialog.DontUseNativeDialog
         directory = QtWidgets.QFileDialog.getExistingDirectory(self, "Select Input Directory", "", options=options)
         if directory:
-            self.drag_drop_frame.dropped_files = []
-            for filename in os.listdir(directory):
-                if filename.lower().endswith(('.mp4', '.avi', '.mov', '.mkv')):  # Filter video files
-                    filepath = os.path.join(directory, filename)
-                    self.drag_drop_frame.dropped_files.append(filepath)
-            if self.drag_drop_frame.dropped_files:
-                self.handle_input(self.drag_drop_frame.dropped_files)  # Process the list of video files
-            else:
-                QtWidgets.QMessageBox.warning(self, "No Videos Found", "No video files found in the selected directory.")
+            self.scan_directories([directory])
+
+    def scan_directories(self, directories):
+        self.setup_deferred_tabs() #Reads the Folder Scanning settings
+        include = [pattern for pattern in self.discovery_include_edit.text().split(";") if pattern.strip()]
+        exclude = [pattern for pattern in self.discovery_exclude_edit.text().split(";") if pattern.strip()]
+        max_depth = None if self.discovery_depth_spin.value() < 0 else self.discovery_depth_spin.value()
+        scan = DiscoveryThread(directories, [p.strip() for p in include], [p.strip() for p in exclude], max_depth, self)
+        scan.filesFound.connect(self.discovered_files)
+        scan.scanFinished.connect(lambda count, scan=scan: self.discovery_finished(scan, count))
+        self.discovery_threads.append(scan)
+        self.append_process_output(f"Scanning {', '.join(directories)} for videos...")
+        scan.start()
+
+    def discovered_files(self, files):
+        # Files join the running batch straight away, otherwise they wait for Compress like dropped ones
+        if self.drag_drop_frame.compressing:
+            self.drag_drop_frame.queue_during_batch(files)
+        else:
+            self.handle_input(files)
+
+    def discovery_finished(self, scan, count):
+        scan.wait()
+        self.discovery_threads.remove(scan)
+        self.append_process_output(f"Scan of {', '.join(scan.directories)} finished: {count} video file(s)")
+        if count == 0 and not scan.stop_event.is_set():
+            QtWidgets.QMessageBox.warning(self, "No Videos Found", "No video files found in the selected directory.")
 
     def handle_input(self, files):
-        # Convert to sets to remove duplicates efficiently
-        existing_files = set(self.drag_drop_frame.dropped_files)
-        new_files = set(files)
-        unique_files = list(existing_files.union(new_files)) # Get the unique set of files
+        # Remove duplicates but keep the order the files were added in, the scheduler decides what runs first
+        known = set(self.drag_drop_frame.dropped_files)
+        new_files = [path for path in dict.fromkeys(files) if path not in known]
 
-        self.drag_drop_frame.dropped_files = unique_files # Set the new list of unique files
+        self.drag_drop_frame.dropped_files.extend(new_files)
+        self.preview_files_added(new_files)
         self.drag_drop_frame.initial_widget.hide()
         self.drag_drop_frame.loaded_icons()
-        print(f"Files added: {self.drag_drop_frame.dropped_files}")
+        print(f"Files added: {len(new_files)} ({len(self.drag_drop_frame.dropped_files)} in total)")
     
 ####################################################
 ###SETUP_MAIN!!!#####
@@ -671,12 +1257,12 @@ class MainWindow(QtWidgets.QMainWindow):
         compression_label.setAlignment(Qt.AlignCenter)
         self.compression_combo = QComboBox()
         self.compression_combo.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Fixed)
-        self.compression_combo.addItems(["Low", "Medium", "High"])
+        self.compression_combo.addItems(["Low", "Medium", "High", "Auto"]) #Auto searches the CRF per file from quality samples
         self.compression_number_combo = QComboBox()
         self.compression_combo.currentIndexChanged.connect(self.update_number_combo)
         self.video_codec_combo = QComboBox()
-        self.video_codec_combo.addItems(["Codec-264", "Codec-265"]) #Display name
-        self.video_codec_map = {"Codec-264": "libx264", "Codec-265": "libx265"} #Add the items
+        self.video_codec_combo.addItems(list(VIDEO_CODECS)) #Display name
+        self.video_codec_map = VIDEO_CODECS #Add the items
         
 
         compression_layout.addWidget(compression_label)
@@ -688,12 +1274,29 @@ class MainWindow(QtWidgets.QMainWindow):
         preset_layout = QHBoxLayout() #Create a layout for the preset
         preset_label = QLabel("Preset:")
         self.preset_combo = QComboBox()
-        self.preset_combo.addItems(["ultrafast", "superfast", "fast", "medium", "slow", "slower", "veryslow"]) #Add the preset #Set the default preset
+        self.preset_combo.addItems(PRESETS) #Add the preset #Set the default preset
         self.preset_combo.currentText()
         self.preset_combo.setCurrentIndex(3)
         preset_layout.addWidget(preset_label) #Add the label and combobox to the layout
         preset_layout.addWidget(self.preset_combo)
 
+        jobs_label = QLabel("Parallel Jobs:")
+        self.jobs_spin = QSpinBox()
+        self.jobs_spin.setRange(1, max(1, os.cpu_count() or 1))
+        self.jobs_spin.setValue(default_max_jobs())
+        self.jobs_spin.setToolTip("Number of ffmpeg processes running at the same time")
+        self.jobs_spin.valueChanged.connect(self.drag_drop_frame.scheduler.set_max_jobs)
+        preset_layout.addWidget(jobs_label)
+        preset_layout.addWidget(self.jobs_spin)
+
+        priority_label = QLabel("Priority:")
+        self.priority_combo = QComboBox()
+        self.priority_combo.addItems(list(PRIORITY_LANES))
+        self.priority_combo.setCurrentText("Normal")
+        self.priority_combo.setToolTip("Queue lane of the next batch, and of files dropped while a batch is running")
+        preset_layout.addWidget(priority_label)
+        preset_layout.addWidget(self.priority_combo)
+
         
 ################################################################
         # Watermark Section
@@ -712,11 +1315,29 @@ class MainWindow(QtWidgets.QMainWindow):
         watermark_layout.addWidget(self.watermark_clear_button)
         watermark_layout.addWidget(self.show_preview_button)
 
+        preview_layout = QHBoxLayout()
+        self.preview_file_combo = QComboBox()
+        self.preview_file_combo.setSizeAdjustPolicy(QComboBox.AdjustToMinimumContentsLengthWithIcon)
+        self.preview_file_combo.setMinimumContentsLength(16)
+        self.preview_file_combo.currentIndexChanged.connect(self.request_preview_frame)
+        self.preview_slider = QtWidgets.QSlider(Qt.Horizontal)
+        self.preview_slider.setRange(0, 1000)
+        self.preview_slider.setValue(PREVIEW_START)
+        self.preview_slider.setToolTip("Scrub through the previewed file, frames snap to the nearest keyframe before the position")
+        self.preview_slider.valueChanged.connect(self.request_preview_frame)
+        self.preview_time_label = QLabel("")
+        self.preview_time_label.setMinimumWidth(60)
+        preview_layout.addWidget(QLabel("Preview:"))
+        preview_layout.addWidget(self.preview_file_combo)
+        preview_layout.addWidget(self.preview_slider, 1)
+        preview_layout.addWidget(self.preview_time_label)
+
         # Combine Compression and Watermark
         options_layout = QVBoxLayout()
         options_layout.addLayout(compression_layout)
         options_layout.addLayout(preset_layout)
         options_layout.addLayout(watermark_layout)
+        options_layout.addLayout(preview_layout)
    
 
    
@@ -787,29 +1408,59 @@ class MainWindow(QtWidgets.QMainWindow):
 
     def update_progress(self, progress):
         self.progress_bar.setValue(progress)
-        self.progress_bar.setFormat("%p%")
-        self.progress_bar.show()
-        QApplication.processEvents()
+        if not self.progress_bar.isVisible():
+            self.progress_bar.setFormat("%p%")
+            self.progress_bar.show()
 
 
-    def append_process_output(self, line):
+    def job_started(self, job_id, file_path):
         timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        if len(self.drag_drop_frame.scheduler.job_outputs) > 1: # Add separator only if it's NOT the very first file
+            self.process_output.append("\n######################_COMPRESSED_VIDEOFILES_LOGS_####################\n")
+        filename = os.path.basename(file_path)
+        preset = self.drag_drop_frame.scheduler.job_settings[job_id]["preset"]
+        self.process_output.append(f"[{timestamp}] Starting compression for: {filename}  (Preset: {preset})\n")
+        if self.save_logs_checkbox.isChecked():
+            self.job_logs.open(job_id, file_path, f"[{timestamp}] Starting compression for: {file_path}  (Preset: {preset})")
+            self.logged_jobs.add(job_id)
+        self.update_processing_label()
 
-        # Check if it's the start of a new file's log
-        if not hasattr(self, 'last_processed_file') or (self.drag_drop_frame.compress_queue and self.last_processed_file != self.drag_drop_frame.compress_queue[0]):
-            if hasattr(self, 'last_processed_file'):  # Add separator only if it's NOT the very first file
-                self.process_output.append("\n######################_COMPRESSED_VIDEOFILES_LOGS_####################\n")
-            if self.drag_drop_frame.compress_queue:
-                filename = os.path.basename(self.drag_drop_frame.compress_queue[0])
-                preset = self.preset_combo.currentText()
-                self.process_output.append(f"[{timestamp}] Starting compression for: {filename}  (Preset: {preset})\n")
-                self.last_processed_file = self.drag_drop_frame.compress_queue[0]
-        
-        self.process_output.append(f"[{timestamp}] {line}")
-        self.process_output.verticalScrollBar().setValue(self.process_output.verticalScrollBar().maximum())
+    def update_processing_label(self, *args):
+        scheduler = self.drag_drop_frame.scheduler
+        if not scheduler.running:
+            return
+        running = []
+        for job_id in sorted(scheduler.running):
+            filename = os.path.basename(scheduler.job_files[job_id])
+            event = scheduler.job_events.get(job_id)
+            if event is None:
+                running.append(f"{filename} (starting)")
+            else:
+                running.append(f"{filename} ({event.percent}%, {event.fps:.0f} fps, {event.speed:.2f}x, ETA {format_eta(event.eta)})")
+        done = len(scheduler.job_files) - len(scheduler.running) - len(scheduler.queue)
+        self.processing_label.setText(f"Processing [{done}/{len(scheduler.job_files)} done]: " + ", ".join(running))
+
+    def append_job_output(self, job_id, line):
+        scheduler = self.drag_drop_frame.scheduler
+        if job_id in self.logged_jobs:
+            self.job_logs.write(job_id, f"[{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] {line}")
+        if scheduler.max_jobs > 1: #Tag lines so interleaved output from parallel jobs stays readable
+            line = f"[{os.path.basename(scheduler.job_files[job_id])}] {line}"
+        self.append_process_output(line)
+
+    def close_job_log(self, job_id, exit_code, error_message):
+        if job_id not in self.logged_jobs:
+            return
+        self.logged_jobs.discard(job_id)
+        timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        outcome = "Finished" if exit_code == 0 else f"Failed (exit code {exit_code})"
+        self.job_logs.close(job_id, f"[{timestamp}] {outcome}" + (f": {error_message}" if error_message else ""))
+
+    def append_process_output(self, line):
+        timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        self.process_output.append_line(f"[{timestamp}] {line}") #Painted by the view's flush timer, no processEvents per line
         if not self.terminal_group.isChecked():
             self.terminal_group.setChecked(True)
-        QApplication.processEvents()
 
 
 
@@ -822,38 +1473,43 @@ class MainWindow(QtWidgets.QMainWindow):
 
     def all_compression_finished(self, exit_code, error_message): #Handle the signal
         self.drag_drop_frame.reset_display()
+        if self.deferred_tabs_ready:
+            self.refresh_cache_view() #New results and hits
 
 
-        if exit_code == 0:
-            QtWidgets.QMessageBox.information(self, "Success", "Video compressed successfully!")
+        if self.watch_thread is not None: #Unattended, a dialog per batch would just pile up
+            self.append_process_output(("Batch finished" if exit_code == 0 else "Batch finished with errors") + (f":\n{error_message}" if error_message else ""))
+        elif exit_code == 0:
+            QtWidgets.QMessageBox.information(self, "Success", "Video compressed successfully!" + (f"\n\n{error_message}" if error_message else ""))
         else:
             QtWidgets.QMessageBox.critical(self, "Compression Error", f"Video compression failed: {error_message}")
 
 
-        if self.save_logs_checkbox.isChecked():
-            timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-            log_filename = os.path.join(self.logs_directory, f"compression_log_{timestamp}.txt")
-            try:
-                with open(log_filename, "a") as log_file:
-                    log_file.write(self.preset_combo.currentText())
-                    log_file.write("\n###################_PROCESS_TERMINAL_LOGS_######################\n")
-                    log_file.write(self.process_output.toPlainText())
-                self.log_status_label.setStyleSheet("color: green;") #Set to green for success
-                self.log_status_label.setText(f"Logs saved to {log_filename}")
-            except Exception as e:
+        if self.save_logs_checkbox.isChecked(): #Each job's log was streamed to its own file while it ran
+            errors = self.job_logs.take_errors()
+            if errors:
                 self.log_status_label.setStyleSheet("color: red;") #Set to red for error
-                self.log_status_label.setText(f"Error saving logs: {e}")
-                pass
+                self.log_status_label.setText(f"Error saving logs: {errors[-1]}")
+            else:
+                self.log_status_label.setStyleSheet("color: green;") #Set to green for success
+                self.log_status_label.setText(f"Logs saved to {os.path.abspath(self.logs_directory)}")
         QtCore.QTimer.singleShot(5000, self.clear_log_status)
         self.preview_window.close()
 
     def clear_log_status(self): #New method to clear the label
         self.log_status_label.clear()
+        if self.drag_drop_frame.compressing or self.watch_thread is not None: #A newer batch, or the watch history, still uses the terminal
+            return
         self.process_output.clear()
         self.process_output.hide()
         
     def update_number_combo(self, index):
         self.compression_number_combo.clear()
+        if self.compression_combo.currentText() == "Auto":
+            self.compression_number_combo.addItem("Auto")
+            self.compression_number_combo.setEnabled(False)
+            return
+        self.compression_number_combo.setEnabled(True)
         self.compression_number_combo.addItems([str(i) for i in DEFAULT_CRF_VALUES[self.compression_combo.currentText()]])
 
 
@@ -867,28 +1523,50 @@ class MainWindow(QtWidgets.QMainWindow):
                 self.preview_window.setWatermark(pixmap)
 
     def show_preview(self):
-        video_path = self.drag_drop_frame.dropped_files[0] if self.drag_drop_frame.dropped_files else None
-        if not video_path:
+        self.refresh_preview_files()
+        if self.preview_file_combo.count() == 0:
             QMessageBox.warning(self, "No Video", "Please drop a video first.")
             return
         self.preview_window.preview_label.watermark_position = self.watermark_position #Set the position to the preview
         self.preview_window.show()
+        self.request_preview_frame()
 
-        cap = cv2.VideoCapture(video_path)
-        ret, frame = cap.read()
-        if ret:
-            height, width, channel = frame.shape
-            bytesPerLine = 3 * width
-            qImg = QImage(frame.data, width, height, bytesPerLine, QImage.Format_BGR888)
-            pixmap = QPixmap.fromImage(qImg)
-            self.preview_window.setPixmap(pixmap)
-            self.preview_window.video_width = width #Store the video width
-            self.preview_window.video_height = height #Store the video height
-            self.preview_window.show()
-        else:
-            QMessageBox.warning(self, "Error", "Could not load video frame for preview.")
+    def preview_files_added(self, files):
+        self.refresh_preview_files()
+        self.preview_loader.prefetch_files(files) #Switching to them in the preview is then instant
+
+    def refresh_preview_files(self):
+        # Mirrors the queued files, keeping the current choice when it is still queued
+        files = self.drag_drop_frame.dropped_files
+        current = self.preview_file_combo.currentData()
+        if [self.preview_file_combo.itemData(i) for i in range(self.preview_file_combo.count())] == files:
+            return
+        self.preview_file_combo.blockSignals(True)
+        self.preview_file_combo.clear()
+        for path in files:
+            self.preview_file_combo.addItem(os.path.basename(path), path)
+        if current in files:
+            self.preview_file_combo.setCurrentIndex(files.index(current))
+        self.preview_file_combo.blockSignals(False)
+
+    def request_preview_frame(self):
+        video_path = self.preview_file_combo.currentData()
+        if not video_path or not self.preview_window.isVisible():
             return
-        cap.release()
+        position = self.preview_slider.value()
+        entry = self.preview_loader.cached(video_path, position)
+        if entry is not None:
+            self.show_preview_frame(video_path, position, *entry)
+        else:
+            self.preview_loader.load(video_path, position)
+
+    def show_preview_frame(self, video_path, position, image, video_width, video_height, timestamp):
+        if video_path != self.preview_file_combo.currentData():
+            return #Switched to another file in the meantime; older positions of this one are still shown while scrubbing
+        self.preview_window.setPixmap(QPixmap.fromImage(image))
+        self.preview_window.video_width = video_width #Full resolution, watermark positions are mapped onto it
+        self.preview_window.video_height = video_height
+        self.preview_time_label.setText(format_eta(timestamp))
 
 
     def clear_watermark(self): #Clear function
@@ -906,30 +1584,62 @@ class MainWindow(QtWidgets.QMainWindow):
 ###START_COMPRESSOR!!!#####
 
 
+    def offer_resume(self):
+        # Jobs left pending/running by a batch that crashed or was quit: clean up their partial outputs and offer to finish them
+        journal = self.drag_drop_frame.scheduler.journal
+        if journal is None or self.drag_drop_frame.compressing:
+            return
+        try:
+            entries = journal.interrupted()
+            removed = journal.clean_partial_outputs(entries)
+        except (sqlite3.Error, OSError) as e:
+            print(f"Could not read the job journal: {e}")
+            return
+        for path in removed:
+            self.append_process_output(f"Removed partial output: {path}")
+        if not entries:
+            return
+
+        names = [os.path.basename(job.file_path) for _, job in entries[:10]]
+        if len(entries) > 10:
+            names.append(f"... and {len(entries) - 10} more")
+        reply = QMessageBox.question(self, "Resume Compression",
+                                     f"{len(entries)} file(s) from an interrupted batch were not compressed:\n" + "\n".join(names) + "\n\nResume them now?",
+                                     QMessageBox.Yes | QMessageBox.No, QMessageBox.Yes)
+        if reply != QMessageBox.Yes:
+            journal.cancel([row_id for row_id, _ in entries])
+            return
+
+        self.prepare_batch_display(clear_log=False)
+        self.drag_drop_frame.resume_files(entries)
+
     def start_compression(self):
-        preset = self.preset_combo.currentText()
         if not self.drag_drop_frame.dropped_files:
             QMessageBox.warning(self, "No Files", "Please drop video files first.")
             return 
-        
 
-        self.process_output.clear()  # Clear the QTextEdit HERE!
+        settings = self.current_settings()
+        self.prepare_batch_display()
+        self.drag_drop_frame.compress_files(settings)
+        self.watermark_position = QPoint(10, 10) #Reset the position
+
+    def prepare_batch_display(self, clear_log=True):
+        if clear_log:
+            self.process_output.clear()  # Clear the log view HERE!
         if not self.terminal_group.isChecked():
             self.terminal_group.setChecked(True)
-
-
-        
-        crf_value = int(self.compression_number_combo.currentText())
-        compression_level = self.compression_combo.currentText()
-        video_codec = self.video_codec_map[self.video_codec_combo.currentText()] #Get the real codec name
-        watermark_path = self.watermark_path_edit.text()
-
-
         self.drag_drop_frame.compressing_icons()
         self.progress_bar.setValue(0)
         self.progress_bar.setFormat("%p%")
         self.progress_bar.show()
 
+    def current_settings(self):
+        # EncodeJob keyword arguments for the main and settings tabs, the same shape a saved profile has
+        compression_level = self.compression_combo.currentText()
+        crf_value = DEFAULT_CRF_VALUES["Medium"][0] if compression_level == "Auto" else int(self.compression_number_combo.currentText()) #Auto replaces it per file
+        video_codec = self.video_codec_map[self.video_codec_combo.currentText()] #Get the real codec name
+        watermark_path = self.watermark_path_edit.text()
+
         preview_width = self.preview_window.preview_label.width()
         preview_height = self.preview_window.preview_label.height()
         video_width = self.preview_window.video_width
@@ -940,10 +1650,8 @@ class MainWindow(QtWidgets.QMainWindow):
 
         x = int(x_preview * (video_width / preview_width))
         y = int(y_preview * (video_height / preview_height))
-
-
-        self.drag_drop_frame.compress_files(crf_value, compression_level, video_codec, watermark_path, x, y, preset)
-        self.watermark_position = QPoint(10, 10) #Reset the position
+        return dict(crf_value=crf_value, compression_level=compression_level, video_codec=video_codec, watermark_path=watermark_path,
+                    x=x, y=y, preset=self.preset_combo.currentText(), **self.encode_options())
 
 #######################_SETINGS_TAB_#########################
     ####_SETINGS_TAB_####
@@ -959,9 +1667,304 @@ class MainWindow(QtWidgets.QMainWindow):
         font_layout = QtWidgets.QHBoxLayout(font_group)
 
         self.font_combo = QtWidgets.QComboBox()
-        font_layout.addWidget(self.font_combo)
+        font_layout.addWidget(self.font_combo) #Filled by load_fonts after the first paint
+
+        # Example usage: apply selected font to a label
+        self.test_label = QtWidgets.QLabel("Test Text")
+        settings_tab_layout.addWidget(self.test_label)
 
+        self.font_combo.currentIndexChanged.connect(self.apply_selected_font)
+
+        settings_tab_layout.addWidget(font_group)
+
+        # Encoding options
+        encoding_group = QtWidgets.QGroupBox("Encoding")
+        encoding_layout = QtWidgets.QVBoxLayout(encoding_group)
+
+        segments_layout = QtWidgets.QHBoxLayout()
+        self.segments_spin = QSpinBox()
+        self.segments_spin.setRange(1, max(1, os.cpu_count() or 1))
+        self.segments_spin.setValue(1) #1 == no splitting
+        self.segments_spin.setToolTip("Long videos are cut at keyframes into this many segments that are encoded at the same time")
+        self.segment_min_spin = QSpinBox()
+        self.segment_min_spin.setRange(1, 24 * 60)
+        self.segment_min_spin.setValue(SEGMENT_MIN_DURATION // 60)
+        self.segment_min_spin.setSuffix(" min")
+        segments_layout.addWidget(QLabel("Split videos longer than"))
+        segments_layout.addWidget(self.segment_min_spin)
+        segments_layout.addWidget(QLabel("into segments:"))
+        segments_layout.addWidget(self.segments_spin)
+        encoding_layout.addLayout(segments_layout)
+
+        rate_layout = QtWidgets.QHBoxLayout()
+        self.rate_mode_combo = QComboBox()
+        self.rate_mode_combo.addItems(["CRF (Compression Level)", "Target Size (MB)", "Target Bitrate (kbit/s)"])
+        self.rate_value_spin = QSpinBox()
+        self.rate_value_spin.setRange(1, 1000000)
+        self.rate_value_spin.setValue(100)
+        self.rate_value_spin.setEnabled(False)
+        self.rate_mode_combo.currentIndexChanged.connect(lambda index: self.rate_value_spin.setEnabled(index != 0))
+        self.rate_mode_combo.setToolTip("Target modes run a two-pass encode sized from the video duration, audio included")
+        rate_layout.addWidget(QLabel("Rate Control:"))
+        rate_layout.addWidget(self.rate_mode_combo)
+        rate_layout.addWidget(self.rate_value_spin)
+        encoding_layout.addLayout(rate_layout)
+
+        quality_layout = QtWidgets.QHBoxLayout()
+        self.quality_metric_combo = QComboBox()
+        self.quality_metric_combo.addItems([metric.upper() for metric in QUALITY_FLOORS])
+        self.quality_floor_spin = QtWidgets.QDoubleSpinBox()
+        self.quality_floor_spin.setDecimals(3)
+        self.quality_floor_spin.setRange(0.0, 100.0)
+        self.quality_metric_combo.currentTextChanged.connect(self.update_quality_floor)
+        self.update_quality_floor(self.quality_metric_combo.currentText())
+        self.quality_metric_combo.setToolTip("Used by the Auto compression level, VMAF needs an ffmpeg built with libvmaf")
+        quality_layout.addWidget(QLabel("Auto Quality Floor:"))
+        quality_layout.addWidget(self.quality_metric_combo)
+        quality_layout.addWidget(self.quality_floor_spin)
+        encoding_layout.addLayout(quality_layout)
+
+        preflight_layout = QtWidgets.QHBoxLayout()
+        self.preflight_checkbox = QCheckBox("Skip/remux efficient files")
+        self.preflight_checkbox.setToolTip("H.264/H.265 inputs at or below the bits/pixel threshold are skipped (MP4) or remuxed (other containers), "
+                                           "and an encode that comes out larger than its input is discarded")
+        self.preflight_bpp_spin = QtWidgets.QDoubleSpinBox()
+        self.preflight_bpp_spin.setDecimals(3)
+        self.preflight_bpp_spin.setRange(0.001, 1.0)
+        self.preflight_bpp_spin.setSingleStep(0.005)
+        self.preflight_bpp_spin.setValue(PREFLIGHT_MAX_BPP)
+        self.preflight_bpp_spin.setSuffix(" bpp")
+        self.preflight_min_size_spin = QSpinBox()
+        self.preflight_min_size_spin.setRange(0, 100000)
+        self.preflight_min_size_spin.setSuffix(" MB")
+        self.preflight_min_size_spin.setToolTip("Files smaller than this are skipped, 0 turns the check off")
+        preflight_layout.addWidget(self.preflight_checkbox)
+        preflight_layout.addWidget(self.preflight_bpp_spin)
+        preflight_layout.addWidget(QLabel("Min size:"))
+        preflight_layout.addWidget(self.preflight_min_size_spin)
+        encoding_layout.addLayout(preflight_layout)
+
+        container_layout = QtWidgets.QHBoxLayout()
+        self.mp4_layout_combo = QComboBox()
+        self.mp4_layout_combo.addItems(["Standard", "Faststart (web)", "Fragmented (streaming)"]) #MP4_LAYOUTS order
+        self.mp4_layout_combo.setToolTip("Faststart moves the MP4 index to the front after the encode, so browsers and CDNs can start playback "
+                                         "before the whole file is downloaded; fragmented MP4 suits progressive streaming")
+        self.keyframe_interval_spin = QtWidgets.QDoubleSpinBox()
+        self.keyframe_interval_spin.setDecimals(1)
+        self.keyframe_interval_spin.setRange(0.0, 60.0)
+        self.keyframe_interval_spin.setSingleStep(0.5)
+        self.keyframe_interval_spin.setSuffix(" s")
+        self.keyframe_interval_spin.setSpecialValueText("Auto") #0: left to the encoder
+        self.keyframe_interval_spin.setToolTip("Time between keyframes (GOP length), e.g. 2 s for streaming")
+        container_layout.addWidget(QLabel("MP4 Layout:"))
+        container_layout.addWidget(self.mp4_layout_combo)
+        container_layout.addWidget(QLabel("Keyframe every:"))
+        container_layout.addWidget(self.keyframe_interval_spin)
+        encoding_layout.addLayout(container_layout)
+
+        audio_layout = QtWidgets.QHBoxLayout()
+        self.audio_mode_combo = QComboBox()
+        self.audio_mode_combo.addItems(["Copy when compatible", "Always re-encode (AAC)"]) #AUDIO_MODES order
+        self.audio_mode_combo.setToolTip("Every audio and subtitle track is kept. Compatible audio at a modest bitrate (AAC, Opus, MP3, AC-3) "
+                                         "is copied untouched, anything else is re-encoded to AAC")
+        audio_layout.addWidget(QLabel("Audio Tracks:"))
+        audio_layout.addWidget(self.audio_mode_combo)
+        encoding_layout.addLayout(audio_layout)
+
+        order_layout = QtWidgets.QHBoxLayout()
+        self.queue_order_combo = QComboBox()
+        self.queue_order_combo.addItems(["Shortest First", "As Added"])
+        self.queue_order_combo.setToolTip("Shortest First starts the files with the lowest estimated encode time (duration x resolution x preset) first; "
+                                          "files that waited long enough move up a priority lane either way")
+        order_layout.addWidget(QLabel("Queue Order:"))
+        order_layout.addWidget(self.queue_order_combo)
+        encoding_layout.addLayout(order_layout)
+
+        settings_tab_layout.addWidget(encoding_group)
+
+        # Folder scanning
+        discovery_group = QtWidgets.QGroupBox("Folder Scanning")
+        discovery_layout = QtWidgets.QVBoxLayout(discovery_group)
+        self.discovery_include_edit = QLineEdit()
+        self.discovery_include_edit.setPlaceholderText("All video files")
+        self.discovery_include_edit.setToolTip("Only take files matching one of these patterns, separated by ';' (e.g. *.mts; day1/*)")
+        self.discovery_exclude_edit = QLineEdit("; ".join(DEFAULT_EXCLUDES))
+        self.discovery_exclude_edit.setToolTip("Skip files and folders matching one of these patterns, separated by ';'")
+        self.discovery_depth_spin = QSpinBox()
+        self.discovery_depth_spin.setRange(-1, 100)
+        self.discovery_depth_spin.setValue(-1)
+        self.discovery_depth_spin.setSpecialValueText("Unlimited") #-1
+        self.discovery_depth_spin.setToolTip("How many subfolder levels to scan, 0 only looks at the folder itself")
+        for label, widget in (("Include:", self.discovery_include_edit), ("Exclude:", self.discovery_exclude_edit),
+                              ("Subfolder depth:", self.discovery_depth_spin)):
+            row = QtWidgets.QHBoxLayout()
+            row.addWidget(QLabel(label))
+            row.addWidget(widget)
+            discovery_layout.addLayout(row)
+        settings_tab_layout.addWidget(discovery_group)
+
+        metrics_group = QtWidgets.QGroupBox("Job Metrics")
+        metrics_layout = QtWidgets.QVBoxLayout(metrics_group)
+        self.metrics_checkbox = QCheckBox("Record every job")
+        self.metrics_checkbox.setChecked(True)
+        self.metrics_checkbox.setToolTip(f"Appends sizes, timings, CPU time, peak memory and the outcome of each job to {METRICS_PATH}")
+        self.metrics_checkbox.toggled.connect(self.apply_metrics_settings)
+        self.metrics_textfile_edit = QLineEdit()
+        self.metrics_textfile_edit.setPlaceholderText("Off, e.g. /var/lib/node_exporter/textfile/pkumpress_gui.prom")
+        self.metrics_textfile_edit.setToolTip("Job counters and histograms in node-exporter textfile format, rewritten after every job")
+        self.metrics_textfile_edit.editingFinished.connect(self.apply_metrics_settings)
+        textfile_row = QtWidgets.QHBoxLayout()
+        textfile_row.addWidget(QLabel("Textfile:"))
+        textfile_row.addWidget(self.metrics_textfile_edit)
+        metrics_layout.addWidget(self.metrics_checkbox)
+        metrics_layout.addLayout(textfile_row)
+        settings_tab_layout.addWidget(metrics_group)
+
+        resources_group = QtWidgets.QGroupBox("Worker Resources")
+        resources_layout = QtWidgets.QVBoxLayout(resources_group)
+        self.threads_spin = QSpinBox()
+        self.threads_spin.setRange(0, max(1, os.cpu_count() or 1))
+        self.threads_spin.setSpecialValueText("Auto") #0: the cores divided among the parallel jobs
+        self.threads_spin.setToolTip("Encoder threads per job, Auto splits the cores evenly among the parallel jobs")
+        self.pin_cpus_checkbox = QCheckBox("Pin jobs to cores")
+        self.pin_cpus_checkbox.setToolTip("Keeps each job on its own block of cores instead of letting the jobs compete for all of them")
+        self.pin_cpus_checkbox.setEnabled(hasattr(os, "sched_setaffinity"))
+        self.nice_combo = QComboBox()
+        self.nice_combo.addItems(list(NICE_LEVELS))
+        self.nice_combo.setToolTip("CPU priority of ffmpeg, lower leaves more room for other programs")
+        self.io_class_combo = QComboBox()
+        self.io_class_combo.addItems(["Normal", "Low", "Idle"]) #"", best-effort 7, idle
+        self.io_class_combo.setToolTip("Disk priority of ffmpeg (Linux, needs ionice)")
+        self.memory_limit_spin = QSpinBox()
+        self.memory_limit_spin.setRange(0, 1024 * 1024)
+        self.memory_limit_spin.setSingleStep(512)
+        self.memory_limit_spin.setSuffix(" MB")
+        self.memory_limit_spin.setSpecialValueText("Off")
+        self.memory_limit_spin.setToolTip("Address space limit per ffmpeg process, an encode that needs more fails instead of swapping the machine")
+        for label, widget in (("Threads per job:", self.threads_spin), ("CPU priority:", self.nice_combo),
+                              ("Disk priority:", self.io_class_combo), ("Memory limit:", self.memory_limit_spin)):
+            row = QtWidgets.QHBoxLayout()
+            row.addWidget(QLabel(label))
+            row.addWidget(widget)
+            resources_layout.addLayout(row)
+        resources_layout.addWidget(self.pin_cpus_checkbox)
+        self.layout_label = QLabel()
+        self.layout_label.setWordWrap(True)
+        resources_layout.addWidget(self.layout_label)
+        self.threads_spin.valueChanged.connect(self.apply_resource_settings)
+        self.pin_cpus_checkbox.toggled.connect(self.apply_resource_settings)
+        self.nice_combo.currentIndexChanged.connect(self.apply_resource_settings)
+        self.io_class_combo.currentIndexChanged.connect(self.apply_resource_settings)
+        self.memory_limit_spin.valueChanged.connect(self.apply_resource_settings)
+        self.jobs_spin.valueChanged.connect(self.apply_resource_settings) #After the scheduler's own slot, so the label shows the new layout
+        settings_tab_layout.addWidget(resources_group)
+        self.apply_resource_settings()
+
+        workers_group = QtWidgets.QGroupBox("Remote Workers")
+        workers_layout = QtWidgets.QVBoxLayout(workers_group)
+        self.workers_edit = QLineEdit()
+        self.workers_edit.setPlaceholderText("Off, e.g. render1:8765, unix:/run/pkumpress.sock")
+        self.workers_edit.setToolTip("Machines running 'pkumpress.py worker', jobs go to their free slots once this machine's are full")
+        self.transfer_combo = QComboBox()
+        self.transfer_combo.addItems(["Shared storage", "Stream files"]) #TRANSFERS
+        self.transfer_combo.setToolTip("Shared storage: the workers see the same paths as this machine. Stream files: inputs and outputs go over the connection")
+        self.worker_token_edit = QLineEdit(os.environ.get(WORKER_TOKEN_ENV, ""))
+        self.worker_token_edit.setEchoMode(QLineEdit.Password)
+        self.worker_token_edit.setToolTip("The --token the workers were started with")
+        self.workers_button = QPushButton("Connect")
+        self.workers_button.clicked.connect(self.apply_worker_settings)
+        workers_row = QtWidgets.QHBoxLayout()
+        workers_row.addWidget(QLabel("Workers:"))
+        workers_row.addWidget(self.workers_edit)
+        workers_row.addWidget(self.workers_button)
+        transfer_row = QtWidgets.QHBoxLayout()
+        transfer_row.addWidget(QLabel("Files:"))
+        transfer_row.addWidget(self.transfer_combo)
+        transfer_row.addWidget(QLabel("Token:"))
+        transfer_row.addWidget(self.worker_token_edit)
+        self.workers_label = QLabel("No remote workers")
+        self.workers_label.setWordWrap(True)
+        workers_layout.addLayout(workers_row)
+        workers_layout.addLayout(transfer_row)
+        workers_layout.addWidget(self.workers_label)
+        self.worker_pool_thread = None
+        self.workers_timer = QtCore.QTimer(self)
+        self.workers_timer.timeout.connect(self.update_workers_label)
+        self.workers_timer.start(WORKER_HEALTH_SECONDS * 1000)
+        settings_tab_layout.addWidget(workers_group)
+        settings_tab_layout.addStretch(1) # Add stretch to push content to the top
+
+    def apply_resource_settings(self, *args):
+        scheduler = self.drag_drop_frame.scheduler
+        scheduler.set_resources(threads=self.threads_spin.value(), pin=self.pin_cpus_checkbox.isChecked(),
+                                nice=NICE_LEVELS[self.nice_combo.currentText()],
+                                io_class=("", "best-effort", "idle")[self.io_class_combo.currentIndex()],
+                                memory_limit_mb=self.memory_limit_spin.value())
+        self.layout_label.setText("\n".join(scheduler.layout.describe()))
+
+    def apply_worker_settings(self):
+        addresses = [address for address in re.split(r"[,\s]+", self.workers_edit.text()) if address]
+        if not addresses:
+            self.drag_drop_frame.scheduler.set_pool(None)
+            self.update_workers_label()
+            return
+        self.workers_button.setEnabled(False)
+        self.workers_label.setText("Checking workers...")
+        self.worker_pool_thread = WorkerPoolThread(addresses, TRANSFERS[self.transfer_combo.currentIndex()], self.worker_token_edit.text(), self)
+        self.worker_pool_thread.poolReady.connect(self.worker_pool_ready)
+        self.worker_pool_thread.start()
+
+    def worker_pool_ready(self, pool):
+        self.worker_pool_thread.wait()
+        self.worker_pool_thread = None
+        self.workers_button.setEnabled(True)
+        self.drag_drop_frame.scheduler.set_pool(pool)
+        self.update_workers_label()
+
+    def update_workers_label(self):
+        scheduler = self.drag_drop_frame.scheduler
+        if scheduler.pool is None:
+            self.workers_label.setText("No remote workers")
+            return
+        self.workers_label.setText("\n".join(worker.status() for worker in scheduler.pool.workers))
+        scheduler.fill_slots() #A worker that came back can take queued jobs right away
+
+    def apply_metrics_settings(self):
+        metrics = self.drag_drop_frame.scheduler.metrics
+        metrics.path = METRICS_PATH if self.metrics_checkbox.isChecked() else ""
+        metrics.textfile_path = self.metrics_textfile_edit.text().strip()
+
+    def encode_options(self):
+        # Settings tab options forwarded to every EncodeJob of the next batch
+        self.setup_deferred_tabs()
+        rate_mode = self.rate_mode_combo.currentIndex()
+        return dict(segments=self.segments_spin.value(), segment_min_duration=self.segment_min_spin.value() * 60,
+                    target_size_mb=self.rate_value_spin.value() if rate_mode == 1 else 0,
+                    target_bitrate_kbps=self.rate_value_spin.value() if rate_mode == 2 else 0,
+                    auto_crf=self.compression_combo.currentText() == "Auto",
+                    quality_metric=self.quality_metric_combo.currentText().lower(),
+                    quality_floor=self.quality_floor_spin.value(),
+                    preflight=self.preflight_checkbox.isChecked(),
+                    preflight_max_bpp=self.preflight_bpp_spin.value(),
+                    preflight_min_size_mb=self.preflight_min_size_spin.value(),
+                    priority=PRIORITY_LANES[self.priority_combo.currentText()],
+                    use_cache=self.use_cache_checkbox.isChecked(),
+                    mp4_layout=MP4_LAYOUTS[self.mp4_layout_combo.currentIndex()],
+                    keyframe_interval=self.keyframe_interval_spin.value(),
+                    audio_mode=AUDIO_MODES[self.audio_mode_combo.currentIndex()])
+
+    def queue_order(self):
+        self.setup_deferred_tabs()
+        return "sjf" if self.queue_order_combo.currentIndex() == 0 else "fifo"
+
+    def update_quality_floor(self, metric):
+        floor = QUALITY_FLOORS[metric.lower()]
+        self.quality_floor_spin.setSingleStep(0.005 if floor < 1 else 0.5)
+        self.quality_floor_spin.setValue(floor)
+
+    def load_fonts(self):
         # Load custom fonts from directory
+        self.font_combo.blockSignals(True) #Listing them must not apply the first one to the whole window
         fonts_dir = "Fonts"  # Your fonts directory
         if os.path.exists(fonts_dir):
             for filename in os.listdir(fonts_dir):
@@ -976,15 +1979,7 @@ class MainWindow(QtWidgets.QMainWindow):
                         print(f"Failed to load font: {font_path}")
         else:
             print(f"Fonts directory not found: {fonts_dir}")
-
-        # Example usage: apply selected font to a label
-        self.test_label = QtWidgets.QLabel("Test Text")
-        settings_tab_layout.addWidget(self.test_label)
-
-        self.font_combo.currentIndexChanged.connect(self.apply_selected_font)
-
-        settings_tab_layout.addWidget(font_group)
-        settings_tab_layout.addStretch(1) # Add stretch to push content to the top
+        self.font_combo.blockSignals(False)
 
     def apply_selected_font(self):
         selected_font_family = self.font_combo.currentText()
@@ -1038,6 +2033,239 @@ class MainWindow(QtWidgets.QMainWindow):
 
 
 
+####################_TOOLS_TAB_#########################
+    def setup_tools_tab(self):
+        tools_tab_layout = QtWidgets.QVBoxLayout(self.tools_tab)
+
+        watch_group = QtWidgets.QGroupBox("Watch Folders")
+        watch_layout = QtWidgets.QVBoxLayout(watch_group)
+
+        self.watch_folder_list = QtWidgets.QListWidget()
+        self.watch_folder_list.setToolTip("New video files in these folders are compressed once they stop growing")
+        watch_layout.addWidget(self.watch_folder_list)
+
+        folder_buttons_layout = QHBoxLayout()
+        self.watch_add_button = QPushButton("Add Folder")
+        self.watch_add_button.clicked.connect(self.add_watch_folder)
+        self.watch_remove_button = QPushButton("Remove")
+        self.watch_remove_button.clicked.connect(lambda: self.watch_folder_list.takeItem(self.watch_folder_list.currentRow()))
+        self.watch_recursive_checkbox = QCheckBox("Include subfolders")
+        folder_buttons_layout.addWidget(self.watch_add_button)
+        folder_buttons_layout.addWidget(self.watch_remove_button)
+        folder_buttons_layout.addWidget(self.watch_recursive_checkbox)
+        watch_layout.addLayout(folder_buttons_layout)
+
+        output_layout = QHBoxLayout()
+        self.watch_output_edit = QLineEdit()
+        self.watch_output_edit.setPlaceholderText("Next to the source file")
+        self.watch_output_button = QPushButton("Browse")
+        self.watch_output_button.clicked.connect(self.browse_watch_output)
+        output_layout.addWidget(QLabel("Output Folder:"))
+        output_layout.addWidget(self.watch_output_edit)
+        output_layout.addWidget(self.watch_output_button)
+        watch_layout.addLayout(output_layout)
+
+        profile_layout = QHBoxLayout()
+        self.watch_profile_combo = QComboBox()
+        self.refresh_profiles()
+        self.save_profile_button = QPushButton("Save Current as Profile")
+        self.save_profile_button.clicked.connect(self.save_current_profile)
+        profile_layout.addWidget(QLabel("Profile:"))
+        profile_layout.addWidget(self.watch_profile_combo)
+        profile_layout.addWidget(self.save_profile_button)
+        watch_layout.addLayout(profile_layout)
+
+        stable_layout = QHBoxLayout()
+        self.watch_stable_spin = QSpinBox()
+        self.watch_stable_spin.setRange(1, 3600)
+        self.watch_stable_spin.setValue(WATCH_STABLE_SECONDS)
+        self.watch_stable_spin.setSuffix(" s")
+        self.watch_stable_spin.setToolTip("A file counts as complete once its size has not changed for this long")
+        stable_layout.addWidget(QLabel("Wait for stable size:"))
+        stable_layout.addWidget(self.watch_stable_spin)
+        watch_layout.addLayout(stable_layout)
+
+        self.watch_button = QPushButton("Start Watching")
+        self.watch_button.clicked.connect(self.toggle_watching)
+        self.watch_status_label = QLabel("Not watching")
+        self.watch_status_label.setWordWrap(True)
+        watch_layout.addWidget(self.watch_button)
+        watch_layout.addWidget(self.watch_status_label)
+
+        tools_tab_layout.addWidget(watch_group)
+
+        cache_group = QtWidgets.QGroupBox("Result Cache")
+        cache_layout = QtWidgets.QVBoxLayout(cache_group)
+        cache_options_layout = QHBoxLayout()
+        self.use_cache_checkbox = QCheckBox("Reuse earlier results")
+        self.use_cache_checkbox.setChecked(True)
+        self.use_cache_checkbox.setToolTip("A file already compressed with the same settings (even under another name) is copied from the cache instead of encoded again")
+        self.cache_limit_spin = QSpinBox()
+        self.cache_limit_spin.setRange(0, 1024 * 1024)
+        self.cache_limit_spin.setSuffix(" GB")
+        self.cache_limit_spin.setToolTip("Least recently used results are dropped once the cache grows past this")
+        self.cache_limit_spin.editingFinished.connect(self.apply_cache_limit)
+        cache_options_layout.addWidget(self.use_cache_checkbox)
+        cache_options_layout.addStretch(1)
+        cache_options_layout.addWidget(QLabel("Size limit:"))
+        cache_options_layout.addWidget(self.cache_limit_spin)
+        cache_layout.addLayout(cache_options_layout)
+
+        self.cache_table = QtWidgets.QTableWidget(0, 5)
+        self.cache_table.setHorizontalHeaderLabels(["Source", "Settings", "Size", "Last Used", "Hits"])
+        self.cache_table.horizontalHeader().setSectionResizeMode(0, QtWidgets.QHeaderView.Stretch)
+        self.cache_table.setSelectionBehavior(QtWidgets.QAbstractItemView.SelectRows)
+        self.cache_table.setEditTriggers(QtWidgets.QAbstractItemView.NoEditTriggers)
+        self.cache_table.verticalHeader().setVisible(False)
+        cache_layout.addWidget(self.cache_table)
+
+        cache_buttons_layout = QHBoxLayout()
+        self.cache_status_label = QLabel()
+        self.cache_refresh_button = QPushButton("Refresh")
+        self.cache_refresh_button.clicked.connect(self.refresh_cache_view)
+        self.cache_purge_button = QPushButton("Purge Selected")
+        self.cache_purge_button.clicked.connect(lambda: self.purge_cache(selected_only=True))
+        self.cache_purge_all_button = QPushButton("Purge All")
+        self.cache_purge_all_button.clicked.connect(lambda: self.purge_cache(selected_only=False))
+        cache_buttons_layout.addWidget(self.cache_status_label, 1)
+        cache_buttons_layout.addWidget(self.cache_refresh_button)
+        cache_buttons_layout.addWidget(self.cache_purge_button)
+        cache_buttons_layout.addWidget(self.cache_purge_all_button)
+        cache_layout.addLayout(cache_buttons_layout)
+        tools_tab_layout.addWidget(cache_group)
+        self.refresh_cache_view()
+        tools_tab_layout.addStretch(1)
+
+    def refresh_cache_view(self):
+        try:
+            cache = result_cache()
+            stats = cache.stats()
+            entries = cache.entries()
+        except (OSError, sqlite3.Error) as e:
+            self.cache_status_label.setText(f"Cache unavailable: {e}")
+            return
+        self.cache_limit_spin.blockSignals(True)
+        self.cache_limit_spin.setValue(stats["max_bytes"] // 1024 ** 3)
+        self.cache_limit_spin.blockSignals(False)
+        self.cache_status_label.setText(f"{stats['entries']} result(s), {format_size(stats['size'])}, {stats['hits']} reuse(s)")
+        self.cache_table.setRowCount(len(entries))
+        for row, (key, size, source, settings, created_at, last_used, hits) in enumerate(entries):
+            description = f"{settings.get('video_codec')} CRF {settings.get('crf_value')} {settings.get('preset')}"
+            if settings.get("watermark_path"):
+                description += ", watermark"
+            cells = (os.path.basename(source), description, format_size(size),
+                     datetime.datetime.fromtimestamp(last_used).strftime("%Y-%m-%d %H:%M"), str(hits))
+            for column, text in enumerate(cells):
+                item = QtWidgets.QTableWidgetItem(text)
+                item.setData(Qt.UserRole, key)
+                if column == 0:
+                    item.setToolTip(source)
+                self.cache_table.setItem(row, column, item)
+
+    def apply_cache_limit(self):
+        try:
+            evicted = result_cache().set_limit(self.cache_limit_spin.value() * 1024 ** 3)
+        except (OSError, sqlite3.Error) as e:
+            QMessageBox.critical(self, "Result Cache", f"Could not change the limit: {e}")
+            return
+        if evicted:
+            self.append_process_output(f"Result cache: dropped {evicted} old result(s) to fit the new limit")
+        self.refresh_cache_view()
+
+    def purge_cache(self, selected_only):
+        keys = list(dict.fromkeys(item.data(Qt.UserRole) for item in self.cache_table.selectedItems()))
+        if selected_only and not keys:
+            return
+        try:
+            removed = result_cache().purge(keys if selected_only else None)
+        except (OSError, sqlite3.Error) as e:
+            QMessageBox.critical(self, "Result Cache", f"Could not purge the cache: {e}")
+            return
+        self.append_process_output(f"Result cache: removed {removed} result(s)")
+        self.refresh_cache_view()
+
+    def add_watch_folder(self):
+        directory = QFileDialog.getExistingDirectory(self, "Select Folder to Watch")
+        if directory and not self.watch_folder_list.findItems(directory, Qt.MatchExactly):
+            self.watch_folder_list.addItem(directory)
+
+    def browse_watch_output(self):
+        directory = QFileDialog.getExistingDirectory(self, "Select Output Folder")
+        if directory:
+            self.watch_output_edit.setText(directory)
+
+    def refresh_profiles(self, selected="Current Settings"):
+        self.watch_profile_combo.clear()
+        self.watch_profile_combo.addItem("Current Settings")
+        self.watch_profile_combo.addItems(list_profiles())
+        self.watch_profile_combo.setCurrentText(selected)
+
+    def save_current_profile(self):
+        name, ok = QtWidgets.QInputDialog.getText(self, "Save Profile", "Profile name:")
+        name = name.strip()
+        if not ok or not name:
+            return
+        if not re.fullmatch(r"[\w .-]+", name):
+            QMessageBox.warning(self, "Save Profile", "Use letters, digits, spaces, dots, dashes and underscores only.")
+            return
+        try:
+            save_profile(name, self.current_settings())
+        except OSError as e:
+            QMessageBox.critical(self, "Save Profile", f"Could not save the profile: {e}")
+            return
+        self.refresh_profiles(name)
+
+    def toggle_watching(self):
+        if self.watch_thread is not None:
+            self.stop_watching()
+            return
+        directories = [self.watch_folder_list.item(i).text() for i in range(self.watch_folder_list.count())]
+        if not directories:
+            QMessageBox.warning(self, "Watch Folders", "Add at least one folder to watch.")
+            return
+        profile = self.watch_profile_combo.currentText()
+        try:
+            settings = self.current_settings() if profile == "Current Settings" else load_profile(profile)
+        except (OSError, ValueError) as e:
+            QMessageBox.critical(self, "Watch Folders", f"Could not load the profile: {e}")
+            return
+        output_dir = self.watch_output_edit.text().strip()
+        if output_dir:
+            try:
+                os.makedirs(output_dir, exist_ok=True)
+            except OSError as e:
+                QMessageBox.critical(self, "Watch Folders", f"Cannot use the output folder: {e}")
+                return
+        settings["output_dir"] = output_dir
+        self.watch_settings = settings
+
+        self.watch_thread = WatchFolderThread(directories, self.drag_drop_frame.scheduler.journal,
+                                              self.watch_recursive_checkbox.isChecked(), self.watch_stable_spin.value(), self)
+        self.watch_thread.filesReady.connect(self.watch_files_ready)
+        self.watch_thread.watchError.connect(lambda message: self.append_process_output(f"Watch: {message}"))
+        self.watch_thread.started.connect(lambda: self.watch_status_label.setText(f"Watching {len(directories)} folder(s), profile: {profile}"))
+        self.watch_thread.start()
+        self.watch_button.setText("Stop Watching")
+        for widget in (self.watch_add_button, self.watch_remove_button, self.watch_recursive_checkbox, self.watch_output_edit,
+                       self.watch_output_button, self.watch_profile_combo, self.watch_stable_spin):
+            widget.setEnabled(False)
+
+    def stop_watching(self):
+        # The running batch keeps going, only new arrivals stop being picked up
+        self.watch_thread.requestInterruption()
+        self.watch_thread.wait()
+        self.watch_thread = None
+        self.watch_button.setText("Start Watching")
+        self.watch_status_label.setText("Not watching")
+        for widget in (self.watch_add_button, self.watch_remove_button, self.watch_recursive_checkbox, self.watch_output_edit,
+                       self.watch_output_button, self.watch_profile_combo, self.watch_stable_spin):
+            widget.setEnabled(True)
+
+    def watch_files_ready(self, files):
+        self.append_process_output(f"Watch: queued {len(files)} new file(s): " + ", ".join(os.path.basename(path) for path, _, _ in files))
+        self.drag_drop_frame.scheduler.watched_files.update((path, (size, mtime_ns)) for path, size, mtime_ns in files)
+        self.drag_drop_frame.queue_files([path for path, _, _ in files], dict(self.watch_settings))
+
     def setup_other_tabs(self, tab, text):
         layout = QVBoxLayout()
         tab.setLayout(layout)
@@ -1048,6 +2276,12 @@ class MainWindow(QtWidgets.QMainWindow):
     def closeEvent(self, event):
         reply = QMessageBox.question(self, 'Quit', 'Do you want to quit?', QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
         if reply == QMessageBox.Yes:
+            if self.watch_thread is not None:
+                self.stop_watching()
+            for scan in self.discovery_threads:
+                scan.stop()
+                scan.wait()
+            self.preview_loader.stop()
             event.accept()
         else:
             event.ignore()
@@ -1056,9 +2290,12 @@ class MainWindow(QtWidgets.QMainWindow):
 
 if __name__ == "__main__":
     app = QApplication(sys.argv)
+    startup_mark("QApplication")
     auth_window = AuthWindow(MainWindow)
     if auth_window.run() == QtWidgets.QDialog.Accepted:
+        startup_mark("login") #Includes the time spent typing
         window = MainWindow()
+        startup_mark("construct MainWindow")
         window.show()
         sys.exit(app.exec_())
     else:
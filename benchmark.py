@@ -0,0 +1,245 @@
+# Encoder benchmark on deterministic clips rendered by ffmpeg's lavfi sources, runs offline on a CPU-only box, e.g.
+#   python benchmark.py run --codecs libx264,libx265 --presets ultrafast,medium --crfs 23,28 -o before.json
+#   python benchmark.py compare before.json after.json
+# Every encode goes through the engine's own command builder (build_ffmpeg_command), the same one the GUI and CLI use.
+# Results are written as versioned JSON; compare flags encodes that got slower, heavier, bigger or worse looking.
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from engine import (PRESETS, VIDEO_CODECS, EncodeJob, build_ffmpeg_command, probe_media, score_sample)
+
+
+RESULTS_VERSION = 1 #bump when a field changes meaning, compare refuses to mix versions
+BENCH_DIR = os.path.join(os.path.expanduser("~"), ".pkumpress", "bench")
+SOURCES = { #lavfi graph per source, {size} and {rate} are filled in; all of them render the same frames on every run
+    "testsrc2": "testsrc2=size={size}:rate={rate}",
+    "mandelbrot": "mandelbrot=size={size}:rate={rate}",
+    "noise": "color=c=gray:size={size}:rate={rate},noise=alls=40:allf=t+u:all_seed=1234",
+}
+CLIP_RATE = 30
+REGRESSION_THRESHOLDS = { #metric -> (worse direction, relative change that counts as a regression)
+    "fps": (-1, 0.05),
+    "cpu_time": (1, 0.05),
+    "peak_rss_kb": (1, 0.10),
+    "output_size": (1, 0.02),
+}
+SSIM_TOLERANCE = 0.002 #absolute drop in SSIM that counts as a regression
+
+
+def emit(event, **fields):
+    sys.stdout.write(json.dumps(dict(event=event, time=round(time.time(), 3), **fields)) + "\n")
+    sys.stdout.flush()
+
+
+def csv_list(value):
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+def ffmpeg_version():
+    try:
+        return subprocess.run(["ffmpeg", "-version"], capture_output=True, text=True, check=True).stdout.splitlines()[0]
+    except (OSError, subprocess.CalledProcessError, IndexError):
+        return ""
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def make_clip(source, size, duration, clips_dir):
+    # Rendered once and kept: near-lossless x264 with a 440 Hz tone, so the audio path is part of every encode too
+    path = os.path.join(clips_dir, f"{source}_{size}_{duration:g}s.mp4")
+    if os.path.exists(path):
+        return path
+    os.makedirs(clips_dir, exist_ok=True)
+    temp_path = path + ".tmp.mp4"
+    graph = SOURCES[source].format(size=size, rate=CLIP_RATE)
+    subprocess.run(["ffmpeg", "-nostats", "-v", "error", "-y", "-f", "lavfi", "-i", graph,
+                    "-f", "lavfi", "-i", "sine=frequency=440:sample_rate=48000",
+                    "-t", f"{duration:g}", "-c:v", "libx264", "-preset", "ultrafast", "-crf", "8", "-pix_fmt", "yuv420p",
+                    "-c:a", "aac", "-shortest", temp_path], capture_output=True, text=True, check=True)
+    os.replace(temp_path, path)
+    return path
+
+
+def measure_encode(command):
+    # Runs one ffmpeg command and returns (return code, wall seconds, CPU seconds, peak RSS in KiB, stderr tail).
+    # wait4 gives the rusage of exactly this process; ru_maxrss is in KiB on Linux.
+    with tempfile.TemporaryFile() as stderr_file:
+        started = time.perf_counter()
+        process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=stderr_file)
+        _, status, usage = os.wait4(process.pid, 0)
+        wall_time = time.perf_counter() - started
+        process.returncode = os.waitstatus_to_exitcode(status)
+        stderr_file.seek(0)
+        error_tail = stderr_file.read().decode(errors="replace").strip().splitlines()[-1:]
+    return process.returncode, wall_time, usage.ru_utime + usage.ru_stime, usage.ru_maxrss, (error_tail[0] if error_tail else "")
+
+
+def run_case(clip, media_info, codec, preset, crf, repeat, work_dir):
+    output_path = os.path.join(work_dir, "encoded.mp4")
+    job = EncodeJob(clip, output_path, crf, codec, preset=preset, use_cache=False)
+    command = build_ffmpeg_command(job, media_info)
+    runs = []
+    for _ in range(repeat):
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        return_code, wall_time, cpu_time, peak_rss, error = measure_encode(command)
+        if return_code != 0:
+            raise RuntimeError(f"ffmpeg exited with code {return_code}: {error}")
+        runs.append((wall_time, cpu_time, peak_rss))
+    wall_time = statistics.median(run[0] for run in runs) #Median of the repeats, one slow outlier does not move it
+    result = dict(wall_time=round(wall_time, 4),
+                  fps=round(media_info.frame_count / wall_time, 2) if wall_time else 0.0,
+                  cpu_time=round(statistics.median(run[1] for run in runs), 4),
+                  peak_rss_kb=max(run[2] for run in runs),
+                  output_size=os.path.getsize(output_path),
+                  ssim=round(score_sample(output_path, clip, "ssim"), 6))
+    os.remove(output_path)
+    return result
+
+
+def case_key(result):
+    return (result["source"], result["size"], result["duration"], result["codec"], result["preset"], result["crf"])
+
+
+def run_command(args):
+    codecs = [VIDEO_CODECS.get(codec, codec) for codec in args.codecs]
+    for codec in codecs:
+        if codec not in VIDEO_CODECS.values():
+            emit("error", message=f"unknown codec {codec!r}")
+            return 2
+    for name, values, known in (("source", args.sources, SOURCES), ("preset", args.presets, PRESETS)):
+        unknown = [value for value in values if value not in known]
+        if unknown:
+            emit("error", message=f"unknown {name} {', '.join(unknown)}")
+            return 2
+
+    report = dict(version=RESULTS_VERSION, label=args.label, created=datetime.datetime.now().isoformat(timespec="seconds"),
+                  revision=git_revision(), ffmpeg=ffmpeg_version(), repeat=args.repeat,
+                  host=dict(platform=platform.platform(), machine=platform.machine(), cpu_count=os.cpu_count(), python=platform.python_version()),
+                  results=[])
+    cases = [(source, size, duration, codec, preset, crf) for source in args.sources for size in args.sizes for duration in args.durations
+             for codec in codecs for preset in args.presets for crf in args.crfs]
+    emit("bench_start", cases=len(cases), revision=report["revision"], ffmpeg=report["ffmpeg"])
+    work_dir = tempfile.mkdtemp(prefix="pkumpress_bench_")
+    failed = 0
+    try:
+        for index, (source, size, duration, codec, preset, crf) in enumerate(cases):
+            case = dict(source=source, size=size, duration=duration, codec=codec, preset=preset, crf=crf)
+            try:
+                clip = make_clip(source, size, duration, args.clips_dir)
+                case.update(run_case(clip, probe_media(clip), codec, preset, crf, args.repeat, work_dir))
+            except (OSError, RuntimeError, ValueError, subprocess.CalledProcessError) as e:
+                failed += 1
+                emit("case_failed", index=index, error=str(e), **case)
+                continue
+            report["results"].append(case)
+            emit("case_finished", index=index, **case)
+    finally:
+        for filename in os.listdir(work_dir):
+            os.remove(os.path.join(work_dir, filename))
+        os.rmdir(work_dir)
+
+    output_path = args.output or os.path.join(BENCH_DIR, f"bench_{datetime.datetime.now():%Y%m%d_%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    with open(output_path, "w") as f:
+        json.dump(report, f, indent=2)
+    emit("bench_finished", cases=len(report["results"]), failed=failed, output=output_path)
+    return 1 if failed else 0
+
+
+def compare_reports(baseline, candidate, threshold_scale=1.0):
+    # Returns (rows, regression count); a row is (case key, metric, baseline value, candidate value, relative change, regressed)
+    baseline_results = {case_key(result): result for result in baseline["results"]}
+    rows = []
+    regressions = 0
+    for result in candidate["results"]:
+        old = baseline_results.get(case_key(result))
+        if old is None:
+            continue
+        for metric, (direction, limit) in REGRESSION_THRESHOLDS.items():
+            change = (result[metric] - old[metric]) / old[metric] if old[metric] else 0.0
+            regressed = change * direction > limit * threshold_scale
+            regressions += regressed
+            rows.append((case_key(result), metric, old[metric], result[metric], change, regressed))
+        ssim_drop = old["ssim"] - result["ssim"]
+        regressed = ssim_drop > SSIM_TOLERANCE * threshold_scale
+        regressions += regressed
+        rows.append((case_key(result), "ssim", old["ssim"], result["ssim"], -ssim_drop, regressed))
+    return rows, regressions
+
+
+def compare_command(args):
+    reports = []
+    for path in (args.baseline, args.candidate):
+        with open(path) as f:
+            reports.append(json.load(f))
+    versions = {report.get("version") for report in reports}
+    if versions != {RESULTS_VERSION}:
+        print(f"Cannot compare results of version(s) {sorted(versions, key=str)}, this benchmark writes version {RESULTS_VERSION}", file=sys.stderr)
+        return 2
+    baseline, candidate = reports
+    for label, report in (("baseline", baseline), ("candidate", candidate)):
+        print(f"{label:<9} {report['created']}  rev {report['revision'] or '?'}  {report['ffmpeg']}  ({report['host']['cpu_count']} CPUs)")
+    if baseline["host"] != candidate["host"] or baseline["ffmpeg"] != candidate["ffmpeg"]:
+        print("warning: the runs used different hosts or ffmpeg builds, timings are not directly comparable")
+
+    rows, regressions = compare_reports(baseline, candidate, args.threshold_scale)
+    if not rows:
+        print("No cases in common")
+        return 2
+    for key, metric, old, new, change, regressed in rows:
+        if regressed or args.all:
+            print(f"{'REGRESSION' if regressed else 'ok':<10} {' '.join(str(part) for part in key):<48} {metric:<12} {old:>12} -> {new:<12} {change:+.1%}")
+    print(f"{regressions} regression(s) in {len({row[0] for row in rows})} common case(s)")
+    return 1 if regressions else 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="benchmark", description="Encoder throughput/quality benchmark on generated test clips")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="encode the test matrix and write the results as JSON")
+    run.add_argument("--sources", type=csv_list, default=list(SOURCES), help=f"comma separated lavfi sources ({', '.join(SOURCES)})")
+    run.add_argument("--sizes", type=csv_list, default=["640x360", "1280x720"], help="comma separated WxH clip sizes")
+    run.add_argument("--durations", type=lambda value: [float(item) for item in csv_list(value)], default=[5.0],
+                     help="comma separated clip durations in seconds")
+    run.add_argument("--codecs", type=csv_list, default=list(VIDEO_CODECS.values()), help="comma separated encoders")
+    run.add_argument("--presets", type=csv_list, default=["ultrafast", "medium"], help="comma separated x264/x265 presets")
+    run.add_argument("--crfs", type=lambda value: [int(item) for item in csv_list(value)], default=[23, 28], help="comma separated CRF values")
+    run.add_argument("--repeat", type=int, default=1, help="encode every case this many times and keep the median timings")
+    run.add_argument("--clips-dir", default=os.path.join(BENCH_DIR, "clips"), help="where the generated clips are kept between runs")
+    run.add_argument("--label", default="", help="free text stored with the results, e.g. the change being measured")
+    run.add_argument("-o", "--output", help=f"results file (default: a timestamped file in {BENCH_DIR})")
+    run.set_defaults(func=run_command)
+
+    compare = commands.add_parser("compare", help="flag regressions of a run against a baseline run")
+    compare.add_argument("baseline")
+    compare.add_argument("candidate")
+    compare.add_argument("--threshold-scale", type=float, default=1.0,
+                         help="multiply every regression threshold, e.g. 2 on a noisy shared machine")
+    compare.add_argument("--all", action="store_true", help="also list the metrics that did not regress")
+    compare.set_defaults(func=compare_command)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
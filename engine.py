@@ -0,0 +1,2874 @@
+# Qt-free compression engine shared by the GUI (Main.py) and the command line (pkumpress.py).
+# Only the standard library is imported here so headless boxes start fast without PyQt5 or cv2.
+import os
+import subprocess
+import threading
+import collections
+import datetime
+import json
+import re
+import time
+import shutil
+import tempfile
+import sqlite3
+import select
+import struct
+import sys
+import fnmatch
+import hashlib
+import contextvars
+import bisect
+import socket
+import queue
+import gzip
+import hmac
+import inspect
+
+try:
+    import resource #Unix only, memory limits are skipped elsewhere
+except ImportError:
+    resource = None
+try:
+    import fcntl #Unix only, cache files are plain copies elsewhere
+except ImportError:
+    fcntl = None
+
+
+# Constants
+DEFAULT_CRF_VALUES = {
+    "Low": [18, 19, 20, 21, 22],
+    "Medium": [23, 24, 25, 26],
+    "High": [27, 28, 29, 30, 31]
+}
+PRESETS = ["ultrafast", "superfast", "fast", "medium", "slow", "slower", "veryslow"]
+VIDEO_CODECS = {"Codec-264": "libx264", "Codec-265": "libx265"} #Display name -> ffmpeg encoder
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mkv')
+NON_VIDEO_EXTENSIONS = frozenset(( #Never sniffed: pictures, documents, audio, subtitles, archives, project files
+    ".jpg", ".jpeg", ".png", ".gif", ".bmp", ".tif", ".tiff", ".heic", ".raw", ".cr2", ".nef", ".dng", ".svg", ".psd",
+    ".txt", ".pdf", ".doc", ".docx", ".xls", ".xlsx", ".ppt", ".pptx", ".csv", ".json", ".xml", ".html", ".htm", ".md", ".log", ".ini",
+    ".mp3", ".wav", ".flac", ".aac", ".m4a", ".ogg", ".opus", ".wma", ".srt", ".ass", ".vtt", ".sub", ".idx", ".lrf", ".thm",
+    ".zip", ".rar", ".7z", ".gz", ".tar", ".iso", ".exe", ".dll", ".py", ".lnk", ".db", ".sqlite3", ".xmp", ".cpi", ".bdm", ".mpl"))
+DEFAULT_EXCLUDES = ("*_compressed.mp4", "*.partial.*", ".*") #Our own outputs, and hidden files/folders (work dirs included)
+SNIFF_BYTES = 4 + 188 * 3 #enough for three MPEG-TS packets behind an M2TS timestamp
+WATERMARK_SIZE = 45 #pixels, used when the frame height is unknown
+WATERMARK_SCALE = 0.0625 #watermark height as a share of the frame height: 45 px at 720p, 135 px at 2160p
+WATERMARK_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".pkumpress", "watermarks")
+SEGMENT_MIN_DURATION = 600 #seconds, shorter inputs are not worth splitting
+AUDIO_BITRATE_KBPS = 128
+MUX_OVERHEAD = 0.02 #share of a target size eaten by the mp4 container
+MIN_VIDEO_BITRATE_KBPS = 32
+AUTO_CRF_RANGE = (18, 36) #lowest/highest CRF the automatic search may pick
+QUALITY_FLOORS = {"ssim": 0.98, "psnr": 38.0, "vmaf": 93.0} #default minimum score per metric
+PREFLIGHT_CODECS = ("h264", "hevc") #sources in these codecs may be skipped/remuxed instead of re-encoded
+PREFLIGHT_MAX_BPP = 0.07 #bits per pixel per frame, at or below this re-encoding rarely saves anything
+MP4_FORMATS = ("mov", "mp4", "m4a", "3gp", "3g2", "mj2")
+MP4_AUDIO_CODECS = ("aac", "mp3", "ac3", "eac3", "alac", "opus", "flac")
+LOSSLESS_AUDIO_CODECS = ("alac", "flac") #fit in mp4, but are re-encoded all the same: copying them would keep most of the file size
+AUDIO_COPY_MAX_KBPS = 192 #compatible tracks above this are still re-encoded to AUDIO_BITRATE_KBPS AAC
+AUDIO_MODES = ("auto", "transcode") #copy compatible audio tracks and re-encode the rest, or re-encode every track
+MP4_TEXT_SUBTITLES = ("mov_text", "subrip", "ass", "ssa", "webvtt", "text") #converted to mov_text; bitmap subtitles cannot go into mp4 and are dropped
+MP4_LAYOUTS = ("standard", "faststart", "fragmented") #moov at the end, moved to the front after the encode, or fragments for progressive streaming
+FRAGMENTED_MOVFLAGS = "+frag_keyframe+empty_moov+default_base_moof"
+RELOCATE_BUFFER_BYTES = 4 * 1024 * 1024
+JOURNAL_PATH = os.path.join(os.path.expanduser("~"), ".pkumpress", "journal.sqlite3")
+PRIORITY_LANES = {"High": 0, "Normal": 1, "Low": 2} #lower lanes are started first
+QUEUE_ORDERS = ("sjf", "fifo") #shortest estimated job first, or the order the files were added
+AGING_SECONDS = 1800 #every this long in the queue moves a job up one lane, so big/low priority jobs are never starved
+ESTIMATE_WAIT_SECONDS = 2.0 #longest a JobRunner holds newly submitted jobs back for their cost estimates ("sjf")
+PRESET_COST = {"ultrafast": 0.15, "superfast": 0.25, "fast": 0.6, "medium": 1.0, "slow": 2.0, "slower": 4.5, "veryslow": 9.0} #relative encode time
+CODEC_COST = {"libx264": 1.0, "libx265": 3.0}
+PROFILES_DIR = os.path.join(os.path.expanduser("~"), ".pkumpress", "profiles")
+WATCH_STABLE_SECONDS = 10 #a new file must keep its size and mtime this long before it is treated as complete
+WATCH_POLL_SECONDS = 5 #stat/scan interval without inotify
+WATCH_RESCAN_SECONDS = 300 #full rescan with inotify, catches events lost to a queue overflow or a remount
+JOURNAL_KEEP_DAYS = 30 #finished/failed/cancelled rows older than this are dropped when the journal is opened
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".pkumpress", "cache")
+CACHE_MAX_BYTES = 20 * 1024 ** 3 #default size limit of the result cache, changed with ResultCache.set_limit
+FICLONE = 0x40049409 #Linux ioctl that reflinks a whole file (Btrfs, XFS, bcachefs)
+CACHE_IGNORED_SETTINGS = ("file_path", "output_path", "compression_level", "priority", "output_dir", "use_cache", "partial_tag") #do not change the encoded bytes
+HASH_SAMPLES = 8 #chunks read by content_hash, spread evenly over the file
+HASH_SAMPLE_BYTES = 256 * 1024
+METRICS_PATH = os.path.join(os.path.expanduser("~"), ".pkumpress", "metrics.jsonl")
+METRICS_WALL_BUCKETS = (1, 5, 15, 60, 300, 900, 3600) #seconds, job duration histogram in the textfile
+METRICS_FPS_BUCKETS = (1, 5, 10, 25, 50, 100, 250) #average encode fps histogram in the textfile
+LOG_MAX_BYTES = 512 * 1024 ** 2 #job logs kept in the log directory, oldest are deleted first
+LOG_MAX_AGE_DAYS = 30
+LOG_BUFFER_BYTES = 64 * 1024 #write buffer per open job log
+LOG_FLUSH_SECONDS = 1.0 #open logs are flushed at least this often, so they can be followed with tail -f
+NICE_LEVELS = {"Normal": 0, "Low": 10, "Lowest": 19} #CPU priority of the ffmpeg processes
+IO_CLASSES = {"": [], "best-effort": ["-c", "2", "-n", "7"], "idle": ["-c", "3"]} #ionice arguments, "" leaves the disk priority alone
+WORKER_PORT = 8765 #default TCP port of the worker daemon
+WORKER_PROTOCOL = 1 #bumped when the messages change, dispatchers refuse workers speaking another version
+WORKER_TIMEOUT = 10 #seconds to connect to a worker or get its answer to a health check
+WORKER_HEALTH_SECONDS = 15 #health check interval of a WorkerPool
+WORKER_RETRIES = 2 #times a job is sent to another worker after its worker went away, before it fails
+WORKER_BUSY_RETRIES = 30 #"busy" replies a job takes (about a second apart) before that worker counts as failed for it
+TRANSFERS = ("shared", "stream") #worker opens the paths itself (same mounts), or files travel over the connection
+WORKER_TOKEN_ENV = "PKUMPRESS_WORKER_TOKEN" #environment variable with the shared secret of the worker daemons
+
+
+###MEDIA_PROBE####
+_probe_cache = {} #(path, size, mtime) -> MediaInfo
+_probe_cache_lock = threading.Lock()
+
+
+def _parse_rate(rate):
+    try:
+        num, _, den = str(rate).partition("/")
+        value = float(num) / float(den or 1)
+        return value if value > 0 else 0.0
+    except (ValueError, ZeroDivisionError):
+        return 0.0
+
+
+def _parse_duration(value):
+    # Matroska stores per-stream durations as "HH:MM:SS.nnnnnnnnn" tags
+    if value in (None, "", "N/A"):
+        return 0.0
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        hours, minutes, seconds = str(value).split(":")
+        return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+    except ValueError:
+        return 0.0
+
+
+def _parse_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+class MediaInfo:
+    def __init__(self, path, probe):
+        self.path = path
+        self.format = probe.get("format", {})
+        self.streams = probe.get("streams", [])
+        self.video_streams = [s for s in self.streams if s.get("codec_type") == "video" and not s.get("disposition", {}).get("attached_pic")]
+        self.audio_streams = [s for s in self.streams if s.get("codec_type") == "audio"]
+        self.subtitle_streams = [s for s in self.streams if s.get("codec_type") == "subtitle"]
+
+        video = self.video_streams[0] if self.video_streams else {}
+        tags = video.get("tags", {})
+        self.format_name = self.format.get("format_name", "")
+        self.size = _parse_int(self.format.get("size"))
+        self.bit_rate = _parse_int(self.format.get("bit_rate"))
+        self.video_codec = video.get("codec_name", "")
+        self.video_bit_rate = _parse_int(video.get("bit_rate")) or _parse_int(tags.get("BPS"))
+        self.width = _parse_int(video.get("width"))
+        self.height = _parse_int(video.get("height"))
+        self.pix_fmt = video.get("pix_fmt", "")
+        self.fps = _parse_rate(video.get("avg_frame_rate")) or _parse_rate(video.get("r_frame_rate"))
+        self.duration = (_parse_duration(self.format.get("duration")) or _parse_duration(video.get("duration"))
+                         or _parse_duration(tags.get("DURATION")))
+
+        frame_count = _parse_int(video.get("nb_frames")) or _parse_int(tags.get("NUMBER_OF_FRAMES"))
+        self.frame_count_estimated = not frame_count #MKV/WebM usually have no frame count, derive it from duration
+        if not frame_count and self.duration and self.fps:
+            frame_count = int(round(self.duration * self.fps))
+        self.frame_count = frame_count
+
+    @property
+    def has_audio(self):
+        return bool(self.audio_streams)
+
+    @property
+    def audio_codecs(self):
+        return [s.get("codec_name", "") for s in self.audio_streams]
+
+    def __repr__(self):
+        return (f"MediaInfo({os.path.basename(self.path)!r}, {self.video_codec} {self.width}x{self.height} "
+                f"@ {self.fps:.3f} fps, {self.duration:.2f}s, {self.frame_count} frames, audio={self.audio_codecs})")
+
+
+def probe_media(video_path):
+    # One ffprobe per file version: re-queued files and the preview reuse the cached result
+    stat = os.stat(video_path)
+    key = (os.path.abspath(video_path), stat.st_size, stat.st_mtime_ns)
+    with _probe_cache_lock:
+        info = _probe_cache.get(key)
+    if info is not None:
+        return info
+
+    cmd = ["ffprobe", "-v", "error", "-show_format", "-show_streams", "-of", "json", video_path]
+    result = subprocess.run(cmd, capture_output=True, text=True, check=True)
+    info = MediaInfo(video_path, json.loads(result.stdout or "{}"))
+    with _probe_cache_lock:
+        _probe_cache[key] = info
+    return info
+
+
+def has_audio_stream(video_path):
+    try:
+        return probe_media(video_path).has_audio
+    except (subprocess.CalledProcessError, OSError, ValueError):
+        return False  # No audio stream found
+
+
+###PREVIEW_FRAMES####
+def grab_frame(video_path, timestamp, max_width, max_height):
+    # One RGB frame from the keyframe at or before timestamp, scaled down inside ffmpeg so a 4K source costs no more than a thumbnail.
+    # Only the data around that keyframe is read, which keeps network mounted files quick. Returns (width, height, RGB bytes).
+    result = subprocess.run(["ffmpeg", "-nostats", "-v", "error", "-noaccurate_seek", "-ss", f"{max(0.0, timestamp):.3f}", "-i", video_path,
+                             "-an", "-sn", "-frames:v", "1",
+                             "-vf", f"scale='min({max_width},iw)':'min({max_height},ih)':force_original_aspect_ratio=decrease",
+                             "-f", "image2pipe", "-c:v", "ppm", "pipe:1"], capture_output=True, check=True)
+    match = re.match(rb"P6\s+(\d+)\s+(\d+)\s+255\s", result.stdout)
+    if not match:
+        raise ValueError(f"No frame at {timestamp:.1f}s in {os.path.basename(video_path)}")
+    width, height = int(match.group(1)), int(match.group(2))
+    return width, height, result.stdout[match.end():match.end() + width * height * 3]
+
+
+###FFMPEG_PROGRESS####
+class ProgressEvent:
+    def __init__(self, out_time=0.0, frame=0, fps=0.0, speed=0.0, bitrate=0.0, total_size=0,
+                 percent=0, eta=None, done=False):
+        self.out_time = out_time #seconds of output written
+        self.frame = frame
+        self.fps = fps
+        self.speed = speed #realtime multiple, 1.0 == realtime
+        self.bitrate = bitrate #kbit/s
+        self.total_size = total_size #bytes
+        self.percent = percent
+        self.eta = eta #seconds left, None until ffmpeg reports a speed
+        self.done = done
+
+    def as_dict(self):
+        return dict(self.__dict__)
+
+    def __repr__(self):
+        eta = "?" if self.eta is None else f"{self.eta:.0f}s"
+        return f"ProgressEvent({self.percent}% frame={self.frame} fps={self.fps:.1f} speed={self.speed:.2f}x eta={eta})"
+
+
+def format_eta(seconds):
+    if seconds is None:
+        return "--:--"
+    return str(datetime.timedelta(seconds=int(seconds)))
+
+
+class FFmpegProgressParser:
+    # Reads the key=value blocks written by "ffmpeg -progress pipe:1", each block ends with a progress=continue|end line
+    def __init__(self, duration=0.0, total_frames=0):
+        self.duration = duration
+        self.total_frames = total_frames
+        self.values = {}
+
+    def feed(self, line):
+        key, sep, value = line.strip().partition("=")
+        if not sep:
+            return None
+        self.values[key.strip()] = value.strip()
+        if key.strip() != "progress":
+            return None
+        event = self.build_event(self.values)
+        self.values = {}
+        return event
+
+    def build_event(self, values):
+        out_time_us = _parse_int(values.get("out_time_us")) or _parse_int(values.get("out_time_ms")) #out_time_ms is in microseconds too
+        out_time = max(0.0, out_time_us / 1000000.0)
+        frame = _parse_int(values.get("frame"))
+        fps = _parse_duration(values.get("fps"))
+        speed = _parse_duration(values.get("speed", "").rstrip("x"))
+        bitrate = _parse_duration(values.get("bitrate", "").replace("kbits/s", ""))
+        total_size = _parse_int(values.get("total_size"))
+        done = values.get("progress") == "end"
+
+        if self.duration > 0:
+            fraction = out_time / self.duration
+        elif self.total_frames > 0:
+            fraction = frame / self.total_frames
+        else:
+            fraction = 0.0
+        fraction = 1.0 if done else min(max(fraction, 0.0), 1.0)
+
+        eta = None
+        if done:
+            eta = 0.0
+        elif speed > 0 and self.duration > 0:
+            eta = max(0.0, (self.duration - out_time) / speed)
+        elif fps > 0 and self.total_frames > 0:
+            eta = max(0.0, (self.total_frames - frame) / fps)
+        return ProgressEvent(out_time, frame, fps, speed, bitrate, total_size, int(fraction * 100), eta, done)
+
+
+###OUTPUT_NAMING####
+def default_max_jobs():
+    # libx264/libx265 already spread one encode over several cores, so a quarter of the cores as parallel jobs keeps the box busy without oversubscribing it
+    return max(1, (os.cpu_count() or 1) // 4)
+
+
+def make_output_path(file_path, compression_level, reserved=(), output_dir=""):
+    # Next to the source unless an output directory is given
+    base_filename = os.path.splitext(os.path.basename(file_path))[0]
+    output_dir = output_dir or os.path.dirname(file_path)
+    output_path = os.path.join(output_dir, f"{base_filename}_{compression_level}_compressed.mp4")
+    counter = 1
+    while os.path.exists(output_path) or output_path in reserved: #Also skip names claimed by jobs that are still running
+        output_path = os.path.join(output_dir, f"{base_filename}_{compression_level}_{counter}_compressed.mp4")
+        counter += 1
+    return output_path
+
+
+def partial_output_path(output_path, tag=""):
+    # ffmpeg writes here and the file only takes the real name once it is complete, so a crash never leaves a truncated *_compressed.mp4.
+    # tag keeps attempts apart that may run at the same time, e.g. a job retried on another worker while the first one still runs.
+    root, ext = os.path.splitext(output_path)
+    return f"{root}.partial.{tag}{ext}" if tag else f"{root}.partial{ext}"
+
+
+def commit_output(partial_path, output_path):
+    with open(partial_path, "rb") as f: #Make sure the data is on disk before the name says the file is complete
+        os.fsync(f.fileno())
+    os.replace(partial_path, output_path)
+
+
+def remove_partial_output(output_path, tag=""):
+    partial_path = partial_output_path(output_path, tag)
+    if os.path.exists(partial_path):
+        os.remove(partial_path)
+        return True
+    return False
+
+
+###ENCODE_JOB####
+class EncodeJob:
+    def __init__(self, file_path, output_path="", crf_value=23, video_codec="libx264",
+                 watermark_path="", x=0, y=0, preset="medium", compression_level="Medium",
+                 segments=0, segment_min_duration=SEGMENT_MIN_DURATION, target_size_mb=0, target_bitrate_kbps=0,
+                 auto_crf=False, quality_metric="ssim", quality_floor=None, samples=3, sample_duration=4.0,
+                 preflight=False, preflight_codecs=PREFLIGHT_CODECS, preflight_max_bpp=PREFLIGHT_MAX_BPP, preflight_min_size_mb=0,
+                 priority=PRIORITY_LANES["Normal"], output_dir="", use_cache=True, mp4_layout="standard", keyframe_interval=0.0,
+                 audio_mode="auto", partial_tag=""):
+        self.file_path = file_path
+        self.output_path = output_path
+        self.crf_value = crf_value
+        self.video_codec = video_codec
+        self.watermark_path = watermark_path
+        self.x = x
+        self.y = y
+        self.preset = preset
+        self.compression_level = compression_level
+        self.segments = segments #>1 splits long inputs into that many chunks encoded side by side
+        self.segment_min_duration = segment_min_duration
+        self.target_size_mb = target_size_mb #Either of these switches CRF off for a two-pass average bitrate encode
+        self.target_bitrate_kbps = target_bitrate_kbps
+        self.auto_crf = auto_crf #Search the highest CRF whose sample encodes still meet quality_floor
+        self.quality_metric = quality_metric
+        self.quality_floor = QUALITY_FLOORS[quality_metric] if quality_floor is None else quality_floor
+        self.samples = samples
+        self.sample_duration = sample_duration
+        self.preflight = preflight #Skip/remux inputs that would not shrink, and keep the original if the encode grew
+        self.preflight_codecs = tuple(preflight_codecs)
+        self.preflight_max_bpp = preflight_max_bpp
+        self.preflight_min_size_mb = preflight_min_size_mb
+        self.priority = priority #Queue lane, see PRIORITY_LANES
+        self.output_dir = output_dir #Where make_output_path puts the result, empty for next to the source
+        self.use_cache = use_cache #Reuse the output of an earlier identical encode, see ResultCache
+        self.mp4_layout = mp4_layout #See MP4_LAYOUTS
+        self.keyframe_interval = keyframe_interval #Seconds between keyframes (GOP length), 0 leaves it to the encoder
+        self.audio_mode = audio_mode #See AUDIO_MODES and plan_audio
+        self.partial_tag = partial_tag #See partial_output_path, set per attempt by RemoteWorker
+
+    @property
+    def two_pass(self):
+        return bool(self.target_size_mb or self.target_bitrate_kbps)
+
+    def as_dict(self):
+        return dict(self.__dict__)
+
+
+class EncodeResult:
+    def __init__(self, job, return_code, error_message="", wall_time=0.0, action="encoded", reason="", usage=None, relocate_time=0.0):
+        self.job = job
+        self.return_code = return_code
+        self.error_message = error_message
+        self.wall_time = wall_time
+        self.action = action #encoded, remuxed, skipped, kept_original or cached
+        self.reason = reason #why preflight (or the cache) did not simply encode
+        self.usage = usage #ResourceUsage of the ffmpeg processes, None when the job failed before starting any
+        self.relocate_time = relocate_time #seconds spent moving the moov atom to the front (faststart), part of wall_time
+
+    @property
+    def ok(self):
+        return self.return_code == 0
+
+
+def build_ffmpeg_command(job, media_info, input_path=None, output_path=None, include_audio=True, rate_args=None):
+    # input_path/output_path/include_audio are overridden when encoding a single segment or pass of the job.
+    # include_audio maps every audio and subtitle track of the source, see audio_stream_args.
+    ffmpeg_command = ["ffmpeg", "-nostats", "-progress", "pipe:1"] + decoder_thread_args() + ["-i", input_path or job.file_path] #Machine readable progress on stdout, stderr stays the human log
+
+    if job.watermark_path and os.path.exists(job.watermark_path):
+        ffmpeg_command.extend([ #Already scaled and premultiplied, and kept inside frames smaller than the one it was placed on
+            "-i", prepare_watermark(job.watermark_path, media_info.height),
+            "-filter_complex", f"[0:v][1:v]overlay=x='min({job.x},W-w)':y='min({job.y},H-h)':alpha=premultiplied[out]",
+            "-map", "[out]"
+        ])
+    elif include_audio: #Once one stream is mapped, nothing is picked automatically any more
+        ffmpeg_command.extend(["-map", "0:V:0"]) #The first real video stream, not cover art
+
+    ffmpeg_command.extend(["-c:v", job.video_codec, "-preset", job.preset])
+    ffmpeg_command.extend(encoder_thread_args(job.video_codec, rate_args if rate_args is not None else ["-crf", str(job.crf_value)]))
+    if job.keyframe_interval and media_info.fps:
+        ffmpeg_command.extend(["-g", str(max(1, round(job.keyframe_interval * media_info.fps)))])
+    if include_audio:
+        ffmpeg_command.extend(audio_stream_args(job, media_info))
+    else:
+        ffmpeg_command.extend(["-an"]) #Segments and first passes are video only
+
+    ffmpeg_command.extend(mp4_muxer_args(job, output_path or job.output_path))
+    ffmpeg_command.append(output_path or job.output_path)
+    return ffmpeg_command
+
+
+def run_ffmpeg(ffmpeg_command, parser, on_progress=None, on_line=None, cwd=None):
+    # Runs one ffmpeg process, returns (return code, last stderr line)
+    process = start_process(ffmpeg_command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, cwd=cwd)
+    error_tail = collections.deque(maxlen=20) #Last stderr lines, reported if ffmpeg fails
+
+    def read_stderr():
+        for line in iter(process.stderr.readline, ''):
+            line = line.strip()
+            if line:
+                error_tail.append(line)
+                if on_line:
+                    on_line(line)
+
+    stderr_reader = threading.Thread(target=read_stderr, daemon=True)
+    stderr_reader.start()
+
+    for line in iter(process.stdout.readline, ''):
+        event = parser.feed(line)
+        if event is not None and on_progress:
+            on_progress(event)
+
+    wait_process(process)
+    stderr_reader.join()
+    return process.returncode, (error_tail[-1] if error_tail else "")
+
+
+def run_encode(job, on_progress=None, on_line=None, limits=None, cancel=None):
+    # Probe and encode one file; probe/OS errors are raised, ffmpeg failures come back in the result.
+    # result.usage sums the CPU time and peak memory of every ffmpeg process the job started, on any thread.
+    # limits (ProcessLimits of the job slot, see WorkerLayout) applies to all of those processes the same way.
+    # cancel (JobCancel) kills them and keeps the output from being committed.
+    usage = ResourceUsage()
+    token = _current_usage.set(usage)
+    limits_token = _current_limits.set(limits)
+    cancel_token = _current_cancel.set(cancel)
+    try:
+        result = _run_encode(job, on_progress, on_line)
+    finally:
+        _current_cancel.reset(cancel_token)
+        _current_limits.reset(limits_token)
+        _current_usage.reset(token)
+    result.usage = usage
+    return result
+
+
+def _run_encode(job, on_progress, on_line):
+    started = time.monotonic()
+    media_info = probe_media(job.file_path)
+    action, reason = classify_input(job, media_info) if job.preflight else ("encode", "")
+    if action == "skip":
+        if on_line:
+            on_line(f"Skipped {os.path.basename(job.file_path)}: {reason}")
+        return EncodeResult(job, 0, "", time.monotonic() - started, "skipped", reason)
+
+    cache, cache_key = None, ""
+    if job.use_cache and action == "encode":
+        try:
+            cache = result_cache()
+            cache_key = result_cache_key(job, media_info) #Before search_crf changes crf_value, so a hit also skips the search
+            cached_path = cache.lookup(cache_key)
+        except (OSError, sqlite3.Error, subprocess.CalledProcessError, ValueError) as e: #The watermark probe fails the encode too, let it say why
+            if on_line:
+                on_line(f"Result cache unavailable: {e}")
+            cache, cached_path = None, None
+        if cached_path:
+            existing_path = find_identical_output(job, cached_path)
+            if existing_path:
+                job.output_path = existing_path #Dropped again: keep the earlier output instead of adding a _1 copy
+                reason = f"identical to the existing {os.path.basename(existing_path)}"
+            else:
+                partial_path = partial_output_path(job.output_path, job.partial_tag)
+                try:
+                    clone_or_copy(cached_path, partial_path)
+                    commit_output(partial_path, job.output_path)
+                finally:
+                    remove_partial_output(job.output_path, job.partial_tag)
+                reason = "same input and settings as an earlier encode"
+            if on_line:
+                on_line(f"Reused the cached result for {os.path.basename(job.file_path)}: {reason}")
+            return EncodeResult(job, 0, "", time.monotonic() - started, "cached", reason)
+
+    partial_path = partial_output_path(job.output_path, job.partial_tag)
+    remove_partial_output(job.output_path, job.partial_tag) #Left over from a crash, ffmpeg would stop and ask before overwriting it
+    relocate_time = 0.0
+    if on_line and (media_info.audio_streams or media_info.subtitle_streams):
+        on_line(f"{os.path.basename(job.file_path)}: {describe_audio(job, media_info)}")
+    try:
+        if action == "remux":
+            if on_line:
+                on_line(f"Remuxing {os.path.basename(job.file_path)} without re-encoding: {reason}")
+            parser = FFmpegProgressParser(media_info.duration, media_info.frame_count)
+            return_code, error_message = run_ffmpeg(build_remux_command(job, media_info, partial_path), parser, on_progress, on_line)
+            action = "remuxed"
+        else:
+            if job.auto_crf and not job.two_pass:
+                job.crf_value = search_crf(job, media_info, on_line)
+            if job.segments > 1 and media_info.duration >= job.segment_min_duration:
+                return_code, error_message = run_segmented_encode(job, media_info, on_progress, on_line, partial_path)
+            else:
+                return_code, error_message = encode_video(job, media_info, job.file_path, partial_path, True,
+                                                          media_info.duration, media_info.frame_count, on_progress, on_line)
+            action = "encoded"
+
+        if return_code != 0:
+            if on_line:
+                on_line(f"FFmpeg exited with code: {return_code}")
+            return EncodeResult(job, return_code, error_message, time.monotonic() - started, action, reason)
+
+        if job.preflight and action == "encoded" and os.path.getsize(partial_path) >= os.path.getsize(job.file_path):
+            reason = f"output ({format_size(os.path.getsize(partial_path))}) was not smaller than the input ({format_size(os.path.getsize(job.file_path))})"
+            if on_line:
+                on_line(f"Kept the original {os.path.basename(job.file_path)}: {reason}")
+            action = "kept_original"
+        else:
+            if job.mp4_layout == "faststart":
+                relocate_time = relocate_moov(partial_path, on_line)
+            cancel = _current_cancel.get()
+            if cancel is not None and cancel.cancelled: #Nobody is waiting for this output any more, and a retry may be writing it
+                return EncodeResult(job, -1, "cancelled", time.monotonic() - started, action, reason)
+            commit_output(partial_path, job.output_path)
+            if cache and action == "encoded":
+                try:
+                    cache.store(cache_key, job.output_path, job)
+                except (OSError, sqlite3.Error) as e: #The encode itself is fine
+                    if on_line:
+                        on_line(f"Could not add {os.path.basename(job.output_path)} to the result cache: {e}")
+        return EncodeResult(job, return_code, "", time.monotonic() - started, action, reason, relocate_time=relocate_time)
+    finally:
+        remove_partial_output(job.output_path, job.partial_tag) #Failed, cancelled or not kept
+
+
+def encode_video(job, media_info, input_path, output_path, include_audio, duration, frame_count=0, on_progress=None, on_line=None):
+    # One CRF pass, or two average-bitrate passes when the job has a size/bitrate target
+    if not job.two_pass:
+        parser = FFmpegProgressParser(duration, frame_count)
+        return run_ffmpeg(build_ffmpeg_command(job, media_info, input_path, output_path, include_audio), parser, on_progress, on_line)
+
+    bitrate = target_video_bitrate(job, media_info)
+    if on_line:
+        on_line(f"Two-pass encode of {os.path.basename(input_path)} at {bitrate} kbit/s video")
+    input_path, output_path = os.path.abspath(input_path), os.path.abspath(output_path) #ffmpeg runs inside the pass dir
+    # Pass logs go in a private dir so parallel jobs and segments never share x264/x265 stats files
+    pass_dir = tempfile.mkdtemp(prefix=".pkumpress_2pass_", dir=os.path.dirname(output_path))
+    try:
+        return_code, error_message = 0, ""
+        for pass_number in (1, 2):
+            rate_args = two_pass_args(job.video_codec, bitrate, pass_number)
+            if pass_number == 1: #Analysis only, nothing is muxed
+                command = build_ffmpeg_command(job, media_info, input_path, os.devnull, False, rate_args + ["-f", "null", "-y"])
+            else:
+                command = build_ffmpeg_command(job, media_info, input_path, output_path, include_audio, rate_args)
+            pass_progress = PassProgress(pass_number, 2, duration, on_progress) if on_progress else None
+            return_code, error_message = run_ffmpeg(command, FFmpegProgressParser(duration, frame_count), pass_progress, on_line, cwd=pass_dir)
+            if return_code != 0:
+                return return_code, f"Pass {pass_number} failed: {error_message}"
+        return return_code, error_message
+    finally:
+        shutil.rmtree(pass_dir, ignore_errors=True)
+
+
+def run_encode_safe(job, on_progress=None, on_line=None, limits=None, cancel=None):
+    try:
+        return run_encode(job, on_progress, on_line, limits, cancel)
+    except (subprocess.CalledProcessError, FileNotFoundError, ValueError, OSError) as e:
+        error_message = str(e)
+        if on_line:
+            on_line(f"Error: {error_message}")
+        return EncodeResult(job, -1, error_message)
+
+
+###PREFLIGHT####
+def format_size(size):
+    return f"{size / 1048576:.1f} MB"
+
+
+def bits_per_pixel(media_info):
+    video_bit_rate = media_info.video_bit_rate
+    if not video_bit_rate and media_info.bit_rate: #MKV rarely has a per-stream bitrate, take the container's minus audio
+        audio_bit_rate = sum(_parse_int(s.get("bit_rate")) or AUDIO_BITRATE_KBPS * 1000 for s in media_info.audio_streams)
+        video_bit_rate = max(0, media_info.bit_rate - audio_bit_rate)
+    pixels_per_second = media_info.width * media_info.height * media_info.fps
+    if not video_bit_rate or not pixels_per_second:
+        return None
+    return video_bit_rate / pixels_per_second
+
+
+def classify_input(job, media_info):
+    # Returns ("skip" | "remux" | "encode", reason)
+    if not media_info.video_streams:
+        return "skip", "no video stream"
+    if job.preflight_min_size_mb and media_info.size < job.preflight_min_size_mb * 1048576:
+        return "skip", f"smaller than {job.preflight_min_size_mb} MB"
+    if job.watermark_path and os.path.exists(job.watermark_path):
+        return "encode", "" #The watermark has to be burned in, whatever the source looks like
+    if job.two_pass:
+        if job.target_size_mb and media_info.size <= job.target_size_mb * 1048576:
+            return "skip", f"already within the {job.target_size_mb} MB target ({format_size(media_info.size)})"
+        return "encode", ""
+
+    bpp = bits_per_pixel(media_info)
+    if media_info.video_codec not in job.preflight_codecs or bpp is None or bpp > job.preflight_max_bpp:
+        return "encode", ""
+    reason = f"already {media_info.video_codec} at {bpp:.3f} bits/pixel (threshold {job.preflight_max_bpp})"
+    is_mp4 = any(name in MP4_FORMATS for name in media_info.format_name.split(","))
+    if is_mp4:
+        return "skip", reason
+    return "remux", reason + f", only the {media_info.format_name.split(',')[0]} container changes"
+
+
+def build_remux_command(job, media_info, output_path=None):
+    # Stream copy into mp4, audio follows plan_audio
+    command = ["ffmpeg", "-nostats", "-progress", "pipe:1", "-i", job.file_path, "-map", "0:V:0", "-c:v", "copy"]
+    if media_info.video_codec == "hevc":
+        command.extend(["-tag:v", "hvc1"]) #Lets Apple players open the file
+    command.extend(audio_stream_args(job, media_info))
+    command.extend(mp4_muxer_args(job, output_path or job.output_path))
+    command.append(output_path or job.output_path)
+    return command
+
+
+###MP4_LAYOUT####
+def mp4_muxer_args(job, output_path):
+    # Fragmented files are laid out by the muxer itself. faststart is not left to ffmpeg's +faststart, which rewrites
+    # the finished file in place; relocate_moov does it in one sequential copy instead (see _run_encode).
+    if job.mp4_layout == "fragmented" and output_path.lower().endswith(".mp4"): #Not for segment/pass files
+        return ["-movflags", FRAGMENTED_MOVFLAGS]
+    return []
+
+
+def read_atoms(data, start, end):
+    # (type, offset, size, header size) of the boxes between start and end of a bytes-like object or an open file
+    atoms = []
+    offset = start
+    while offset + 8 <= end:
+        if isinstance(data, (bytes, bytearray)):
+            header = bytes(data[offset:offset + 16])
+        else:
+            data.seek(offset)
+            header = data.read(16)
+        size, kind = struct.unpack(">I4s", header[:8])
+        header_size = 8
+        if size == 1: #64-bit size follows the type
+            size, header_size = struct.unpack(">Q", header[8:16])[0], 16
+        elif size == 0: #Runs to the end
+            size = end - offset
+        if size < header_size or offset + size > end:
+            raise ValueError(f"Corrupt MP4: bad {kind.decode(errors='replace')} box at offset {offset}")
+        atoms.append((kind, offset, size, header_size))
+        offset += size
+    return atoms
+
+
+def shift_chunk_offsets(moov, moved_start, moved_end, shift):
+    # Chunk offsets (stco/co64) of every track in the moov bytearray that point into [moved_start, moved_end) are moved by shift bytes
+    def walk(start, end):
+        for kind, offset, size, header_size in read_atoms(moov, start, end):
+            body = offset + header_size
+            if kind in (b"trak", b"mdia", b"minf", b"stbl"):
+                walk(body, offset + size)
+            elif kind in (b"stco", b"co64"):
+                count = struct.unpack_from(">I", moov, body + 4)[0]
+                entry_format = ">%d%s" % (count, "I" if kind == b"stco" else "Q")
+                offsets = [value + shift if moved_start <= value < moved_end else value
+                           for value in struct.unpack_from(entry_format, moov, body + 8)]
+                if kind == b"stco" and offsets and max(offsets) > 0xFFFFFFFF:
+                    raise ValueError("moving the moov atom would overflow 32-bit chunk offsets")
+                struct.pack_into(entry_format, moov, body + 8, *offsets)
+
+    kind, offset, size, header_size = read_atoms(moov, 0, len(moov))[0]
+    walk(header_size, size)
+
+
+def copy_range(source, target, offset, length):
+    source.seek(offset)
+    while length > 0:
+        chunk = source.read(min(length, RELOCATE_BUFFER_BYTES))
+        if not chunk:
+            raise ValueError("MP4 ended early")
+        target.write(chunk)
+        length -= len(chunk)
+
+
+def relocate_moov(path, on_line=None):
+    # Puts the moov atom in front of the media data so players can start before the whole file is downloaded.
+    # The file is written once, in order, to a scratch directory next to it (same filesystem, so the result is renamed
+    # into place, not copied again). Returns the seconds spent, 0.0 when nothing had to move or the file is left as it was.
+    started = time.monotonic()
+    with open(path, "rb") as source:
+        atoms = read_atoms(source, 0, os.fstat(source.fileno()).st_size)
+        kinds = [kind for kind, _, _, _ in atoms]
+        if b"moov" not in kinds or b"mdat" not in kinds or kinds.index(b"moov") < kinds.index(b"mdat"):
+            return 0.0
+        moov_index, mdat_index = kinds.index(b"moov"), kinds.index(b"mdat")
+        _, moov_offset, moov_size, _ = atoms[moov_index]
+        source.seek(moov_offset)
+        moov = bytearray(source.read(moov_size))
+        try:
+            shift_chunk_offsets(moov, atoms[mdat_index][1], moov_offset, moov_size) #Everything between the first mdat and the moov moves back by its size
+        except (ValueError, struct.error) as e:
+            if on_line:
+                on_line(f"Could not move the moov atom of {os.path.basename(path)}, left at the end: {e}")
+            return 0.0
+
+        scratch_dir = tempfile.mkdtemp(prefix=".pkumpress_faststart_", dir=os.path.dirname(os.path.abspath(path)))
+        try:
+            scratch_path = os.path.join(scratch_dir, os.path.basename(path))
+            with open(scratch_path, "wb") as target:
+                for index, (kind, offset, size, _) in enumerate(atoms):
+                    if index == mdat_index:
+                        target.write(moov)
+                    if index != moov_index:
+                        copy_range(source, target, offset, size)
+            os.replace(scratch_path, path)
+        finally:
+            shutil.rmtree(scratch_dir, ignore_errors=True)
+    elapsed = time.monotonic() - started
+    if on_line:
+        on_line(f"Moved the moov atom of {os.path.basename(path)} to the front in {elapsed:.2f}s")
+    return elapsed
+
+
+###AUDIO_TRACKS####
+def plan_audio(job, media_info):
+    # (stream, "copy" or "aac", kbit/s in the output) for every audio track of the source
+    plan = []
+    for stream in media_info.audio_streams:
+        codec = stream.get("codec_name", "")
+        kbps = (_parse_int(stream.get("bit_rate")) or _parse_int(stream.get("tags", {}).get("BPS"))) // 1000 #0 if the container does not say
+        if (job.audio_mode == "auto" and codec in MP4_AUDIO_CODECS and codec not in LOSSLESS_AUDIO_CODECS
+                and kbps <= AUDIO_COPY_MAX_KBPS):
+            plan.append((stream, "copy", kbps or AUDIO_BITRATE_KBPS))
+        else:
+            plan.append((stream, "aac", AUDIO_BITRATE_KBPS))
+    return plan
+
+
+def audio_stream_args(job, media_info, input_index=0):
+    # Maps every audio track and every text subtitle of input input_index (the source file), by stream index so the order is kept.
+    # Each audio track is copied or re-encoded on its own; language and title tags come along with the mapping.
+    args = []
+    for output_index, (stream, action, _) in enumerate(plan_audio(job, media_info)):
+        args.extend(["-map", f"{input_index}:{stream['index']}"])
+        if action == "copy":
+            args.extend([f"-c:a:{output_index}", "copy"])
+        else:
+            args.extend([f"-c:a:{output_index}", "aac", f"-b:a:{output_index}", f"{AUDIO_BITRATE_KBPS}k"])
+    if not media_info.audio_streams:
+        args.append("-an")
+    subtitles = [stream for stream in media_info.subtitle_streams if stream.get("codec_name") in MP4_TEXT_SUBTITLES]
+    for stream in subtitles:
+        args.extend(["-map", f"{input_index}:{stream['index']}"])
+    if subtitles:
+        args.extend(["-c:s", "mov_text"])
+    return args
+
+
+def describe_audio(job, media_info):
+    # For the job log: "2 audio tracks: aac copied, flac -> aac; 1 subtitle track"
+    parts = [f"{stream.get('codec_name', '?')} copied" if action == "copy" else f"{stream.get('codec_name', '?')} -> aac"
+             for stream, action, _ in plan_audio(job, media_info)]
+    text = f"{len(parts)} audio track(s)" + (": " + ", ".join(parts) if parts else "")
+    subtitles = sum(1 for stream in media_info.subtitle_streams if stream.get("codec_name") in MP4_TEXT_SUBTITLES)
+    dropped = len(media_info.subtitle_streams) - subtitles
+    if subtitles:
+        text += f"; {subtitles} subtitle track(s)"
+    if dropped:
+        text += f"; {dropped} bitmap subtitle track(s) dropped, mp4 cannot hold them"
+    return text
+
+
+###TWO_PASS####
+def target_video_bitrate(job, media_info):
+    # kbit/s left for video once the audio track and container overhead are reserved
+    audio_kbps = sum(kbps for _, _, kbps in plan_audio(job, media_info))
+    if job.target_bitrate_kbps:
+        total_kbps = job.target_bitrate_kbps
+    else:
+        if media_info.duration <= 0:
+            raise ValueError(f"Cannot size {os.path.basename(job.file_path)} to {job.target_size_mb} MB: duration unknown")
+        total_kbps = job.target_size_mb * 8 * 1024 * 1024 / 1000 / media_info.duration * (1 - MUX_OVERHEAD)
+    video_kbps = int(total_kbps - audio_kbps)
+    if video_kbps < MIN_VIDEO_BITRATE_KBPS:
+        raise ValueError(f"Target for {os.path.basename(job.file_path)} leaves only {video_kbps} kbit/s for video")
+    return video_kbps
+
+
+def two_pass_args(video_codec, bitrate, pass_number):
+    # Stats file names are relative, ffmpeg runs with the job's pass dir as working directory
+    if video_codec == "libx265": #x265 takes its pass settings through x265-params (':' separated, hence no absolute Windows paths)
+        return ["-b:v", f"{bitrate}k", "-x265-params", f"pass={pass_number}:stats=x265_2pass.log"]
+    return ["-b:v", f"{bitrate}k", "-pass", str(pass_number), "-passlogfile", "ffmpeg2pass"]
+
+
+class PassProgress:
+    # Maps the progress of one pass onto its share of the whole job
+    def __init__(self, pass_number, pass_count, duration, on_progress):
+        self.pass_number = pass_number
+        self.pass_count = pass_count
+        self.duration = duration
+        self.on_progress = on_progress
+
+    def __call__(self, event):
+        passes_done = self.pass_number - 1
+        passes_left = self.pass_count - self.pass_number
+        eta = event.eta
+        if eta is not None and passes_left and event.speed > 0 and self.duration > 0:
+            eta += passes_left * self.duration / event.speed #Assume the remaining passes run at this pass's speed
+        self.on_progress(ProgressEvent((passes_done * self.duration + event.out_time) / self.pass_count, event.frame, event.fps,
+                                       event.speed, event.bitrate, event.total_size,
+                                       (passes_done * 100 + event.percent) // self.pass_count, eta,
+                                       event.done and not passes_left))
+
+
+###AUTO_CRF####
+_has_libvmaf = None
+
+
+def has_libvmaf():
+    global _has_libvmaf
+    if _has_libvmaf is None:
+        try:
+            filters = subprocess.run(["ffmpeg", "-hide_banner", "-filters"], capture_output=True, text=True).stdout
+            _has_libvmaf = bool(re.search(r"\slibvmaf\s", filters))
+        except OSError:
+            _has_libvmaf = False
+    return _has_libvmaf
+
+
+def run_threads(target, count):
+    # target(index) for every index on its own thread, returns once all are done.
+    # The first exception a thread raises is raised again here, after the others have finished.
+    # The threads keep the job's ResourceUsage, and the processes they start split the job's thread budget.
+    limits = _current_limits.get()
+    errors = []
+
+    def run(index):
+        if limits is not None:
+            _current_limits.set(limits.share(count))
+        try:
+            target(index)
+        except BaseException as e:
+            errors.append(e)
+
+    workers = [threading.Thread(target=contextvars.copy_context().run, args=(run, i), daemon=True) for i in range(count)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    if errors:
+        raise errors[0]
+
+
+def process_error(error):
+    # What ffmpeg said about a failed run_process, the exception's own text if it said nothing
+    lines = (error.stderr or "").strip().splitlines()
+    return lines[-1] if lines else str(error)
+
+
+def sample_positions(duration, samples, sample_duration):
+    # Evenly spread sample starts, short inputs become a single sample covering the whole file
+    if duration <= samples * sample_duration * 1.5:
+        return [(0.0, duration or sample_duration)]
+    step = duration / (samples + 1)
+    return [(max(0.0, step * (i + 1) - sample_duration / 2), sample_duration) for i in range(samples)]
+
+
+def extract_reference_samples(job, media_info, work_dir):
+    # Lossless cuts, so candidate encodes and the reference line up frame for frame
+    positions = sample_positions(media_info.duration, job.samples, job.sample_duration)
+    references = [os.path.join(work_dir, f"reference_{i}.mkv") for i in range(len(positions))]
+
+    def extract(index):
+        start, length = positions[index]
+        run_process(["ffmpeg", "-nostats", "-v", "error", "-ss", f"{start:.3f}", "-i", job.file_path, "-t", f"{length:.3f}",
+                     "-map", "0:v:0", "-c:v", "ffv1", "-an", references[index]])
+
+    try:
+        run_threads(extract, len(references))
+    except subprocess.CalledProcessError as e:
+        raise ValueError(f"Could not cut quality samples from {os.path.basename(job.file_path)}: {process_error(e)}") from e
+    return [path for path in references if os.path.exists(path)]
+
+
+def score_sample(distorted, reference, metric):
+    graph = {"ssim": "[0:v][1:v]ssim", "psnr": "[0:v][1:v]psnr", "vmaf": "[0:v][1:v]libvmaf"}[metric]
+    result = run_process(["ffmpeg", "-nostats", "-i", distorted, "-i", reference, "-lavfi", graph, "-f", "null", "-"])
+    pattern = {"ssim": r"SSIM .*All:([\d.]+)", "psnr": r"PSNR .*average:([\d.]+|inf)", "vmaf": r"VMAF score: ([\d.]+)"}[metric]
+    match = re.search(pattern, result.stderr)
+    if not match:
+        raise ValueError(f"Could not read the {metric.upper()} score from ffmpeg")
+    return float(match.group(1))
+
+
+def search_crf(job, media_info, on_line=None):
+    # Binary search for the highest CRF whose worst sample still meets the quality floor
+    metric = job.quality_metric
+    if metric == "vmaf" and not has_libvmaf():
+        metric = "ssim"
+        if on_line:
+            on_line("Auto CRF: ffmpeg has no libvmaf, scoring with SSIM instead")
+    floor = job.quality_floor if metric == job.quality_metric else QUALITY_FLOORS[metric]
+
+    work_dir = tempfile.mkdtemp(prefix=".pkumpress_autocrf_", dir=os.path.dirname(os.path.abspath(job.output_path)))
+    try:
+        references = extract_reference_samples(job, media_info, work_dir)
+        if not references:
+            raise ValueError(f"Could not cut quality samples from {os.path.basename(job.file_path)}")
+        scores = {}
+
+        def evaluate(crf):
+            sample_scores = [None] * len(references)
+
+            def encode_and_score(index): #Sample encodes run in parallel
+                distorted = os.path.join(work_dir, f"crf{crf}_{index}.mkv")
+                run_process(["ffmpeg", "-nostats", "-v", "error"] + decoder_thread_args() + ["-i", references[index], "-c:v", job.video_codec,
+                             "-preset", job.preset] + encoder_thread_args(job.video_codec, ["-crf", str(crf)]) + ["-an", distorted])
+                sample_scores[index] = score_sample(distorted, references[index], metric)
+                os.remove(distorted)
+
+            try:
+                run_threads(encode_and_score, len(references))
+            except subprocess.CalledProcessError as e:
+                raise ValueError(f"Quality sample encode at CRF {crf} failed: {process_error(e)}") from e
+            scores[crf] = min(sample_scores)
+            if on_line:
+                on_line(f"Auto CRF: CRF {crf} -> {metric.upper()} {scores[crf]:.4f} (floor {floor})")
+            return scores[crf] >= floor
+
+        low, high = AUTO_CRF_RANGE
+        best = low
+        while low <= high:
+            crf = (low + high) // 2
+            if evaluate(crf):
+                best, low = crf, crf + 1
+            else:
+                high = crf - 1
+        if best not in scores:
+            evaluate(best) #Even the lowest CRF misses the floor, still report its score
+        if on_line:
+            on_line(f"Auto CRF: chose CRF {best} for {os.path.basename(job.file_path)} ({metric.upper()} {scores[best]:.4f}, floor {floor})")
+        return best
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+###SEGMENTED_ENCODE####
+def split_at_keyframes(file_path, segment_count, duration, work_dir):
+    # Stream copy through the segment muxer, which only cuts on keyframes, so the split is lossless and cheap
+    segment_length = duration / segment_count
+    split_times = ",".join(f"{segment_length * i:.3f}" for i in range(1, segment_count))
+    segment_list = os.path.join(work_dir, "segments.csv")
+    split_command = ["ffmpeg", "-nostats", "-v", "error", "-i", file_path, "-map", "0:v:0", "-c", "copy",
+                     "-f", "segment", "-segment_times", split_times, "-reset_timestamps", "1",
+                     "-segment_list", segment_list, "-segment_list_type", "csv",
+                     os.path.join(work_dir, "source_%03d.mkv")]
+    run_process(split_command)
+
+    segments = [] #(segment path, segment duration)
+    with open(segment_list) as f:
+        for row in f:
+            name, start, end = row.strip().rsplit(",", 2)
+            segments.append((os.path.join(work_dir, name.strip('"')), max(0.0, float(end) - float(start))))
+    return segments
+
+
+class SegmentProgress:
+    # Folds the progress of segments encoding side by side into one event for the whole file
+    def __init__(self, duration, on_progress=None):
+        self.duration = duration
+        self.on_progress = on_progress
+        self.events = {}
+        self.lock = threading.Lock()
+
+    def update(self, index, event):
+        if not self.on_progress:
+            return
+        with self.lock:
+            self.events[index] = event
+            events = list(self.events.values())
+        out_time = sum(e.out_time for e in events)
+        speed = sum(e.speed for e in events) #Segments run at the same time, so their speeds add up
+        fraction = min(out_time / self.duration, 1.0) if self.duration > 0 else 0.0
+        eta = max(0.0, (self.duration - out_time) / speed) if speed > 0 else None
+        self.on_progress(ProgressEvent(out_time, sum(e.frame for e in events), sum(e.fps for e in events), speed,
+                                       sum(e.bitrate for e in events), sum(e.total_size for e in events),
+                                       min(int(fraction * 100), 99), eta)) #100% is reported once the segments are joined
+
+
+def run_segmented_encode(job, media_info, on_progress=None, on_line=None, output_path=None):
+    # Split at keyframes, encode the segments side by side with the same settings (watermark included), then join them losslessly
+    output_path = output_path or job.output_path
+    work_dir = tempfile.mkdtemp(prefix=".pkumpress_segments_", dir=os.path.dirname(os.path.abspath(output_path)))
+    try:
+        segments = split_at_keyframes(job.file_path, job.segments, media_info.duration, work_dir)
+        if on_line:
+            on_line(f"Split {os.path.basename(job.file_path)} into {len(segments)} segments")
+
+        progress = SegmentProgress(media_info.duration, on_progress)
+        results = [None] * len(segments)
+        encoded = [os.path.join(work_dir, f"encoded_{i:03d}.mkv") for i in range(len(segments))]
+
+        def encode_segment(index):
+            segment_path, segment_duration = segments[index]
+            try:
+                results[index] = encode_video(job, media_info, segment_path, encoded[index], False, segment_duration, 0,
+                                              lambda event: progress.update(index, event),
+                                              (lambda line: on_line(f"[segment {index}] {line}")) if on_line else None)
+            except (ValueError, OSError) as e:
+                results[index] = (-1, str(e))
+
+        run_threads(encode_segment, len(segments))
+        for index, (return_code, error_message) in enumerate(results):
+            if return_code != 0:
+                return return_code, f"Segment {index} failed: {error_message}"
+
+        concat_list = os.path.join(work_dir, "concat.txt")
+        with open(concat_list, "w") as f:
+            for path in encoded:
+                escaped = path.replace("'", "'\\''")
+                f.write(f"file '{escaped}'\n")
+
+        # Audio and subtitles are taken once from the original so there are no gaps at the segment joins
+        concat_command = ["ffmpeg", "-nostats", "-progress", "pipe:1", "-f", "concat", "-safe", "0", "-i", concat_list,
+                          "-i", job.file_path, "-map", "0:v:0", "-c:v", "copy"]
+        concat_command.extend(audio_stream_args(job, media_info, 1))
+        concat_command.extend(mp4_muxer_args(job, output_path))
+        concat_command.append(output_path)
+        return_code, error_message = run_ffmpeg(concat_command, FFmpegProgressParser(media_info.duration), None, on_line)
+        if return_code == 0 and on_progress:
+            on_progress(ProgressEvent(out_time=media_info.duration, percent=100, eta=0.0, done=True))
+        return return_code, error_message
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+###JOB_ORDERING####
+def estimate_cost(job, media_info):
+    # Rough encode time in "1080p medium x264 seconds": duration x pixels x preset x codec, plus the extra passes
+    pixels = (media_info.width * media_info.height) / (1920 * 1080) if media_info.width and media_info.height else 1.0
+    cost = media_info.duration * pixels * PRESET_COST.get(job.preset, 1.0) * CODEC_COST.get(job.video_codec, 1.0)
+    if job.two_pass:
+        cost *= 1.5 #The analysis pass runs much faster than the real one
+    elif job.auto_crf:
+        cost += job.samples * job.sample_duration * pixels * PRESET_COST.get(job.preset, 1.0) * CODEC_COST.get(job.video_codec, 1.0) * 5 #About five trial encodes per sample
+    return cost
+
+
+def estimate_job_cost(job):
+    # Unreadable inputs cost nothing, they fail straight away
+    try:
+        return estimate_cost(job, probe_media(job.file_path))
+    except (subprocess.CalledProcessError, OSError, ValueError):
+        return 0.0
+
+
+class JobQueue:
+    # Picks the next job to start: lowest lane first, then the cheapest estimate ("sjf") or the oldest ("fifo").
+    # Each AGING_SECONDS a job has waited moves it up one lane, so a big file still starts while short clips keep arriving.
+    # Jobs whose cost is not known yet (None) go after the estimated ones of their lane, in arrival order.
+    def __init__(self, order="sjf", aging_seconds=AGING_SECONDS):
+        self.order = order
+        self.aging_seconds = aging_seconds
+        self.entries = {} #key -> [lane, cost, sequence, queued at]
+        self.sequence = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def push(self, key, lane=PRIORITY_LANES["Normal"], cost=None):
+        self.entries[key] = [lane, cost, self.sequence, time.monotonic()]
+        self.sequence += 1
+
+    def set_cost(self, key, cost):
+        if key in self.entries:
+            self.entries[key][1] = cost
+
+    def remove(self, key):
+        self.entries.pop(key, None)
+
+    def rank(self, key, now):
+        lane, cost, sequence, queued_at = self.entries[key]
+        if self.aging_seconds:
+            lane -= int((now - queued_at) // self.aging_seconds)
+        if self.order == "fifo":
+            return (lane, sequence)
+        return (lane, cost is None, cost or 0.0, sequence)
+
+    def pop(self):
+        now = time.monotonic()
+        key = min(self.entries, key=lambda k: self.rank(k, now)) #A batch is at most a few thousand files, a scan beats keeping a heap re-keyed as jobs age
+        del self.entries[key]
+        return key
+
+    def keys(self):
+        # In the order they would be started right now
+        now = time.monotonic()
+        return sorted(self.entries, key=lambda k: self.rank(k, now))
+
+
+###DISCOVERY####
+def sniff_container(path):
+    # Container name from the first bytes of the file, None for anything that is not a video container we know
+    try:
+        with open(path, "rb") as f:
+            head = f.read(SNIFF_BYTES)
+    except OSError:
+        return None
+    if len(head) < 12:
+        return None
+    if head[4:8] in (b"ftyp", b"moov", b"mdat", b"wide", b"free", b"skip", b"pnot"):
+        return "mp4" #ISO BMFF / QuickTime: mp4, mov, m4v, 3gp
+    if head[:4] == b"\x1a\x45\xdf\xa3":
+        return "matroska" #mkv and webm
+    if head[:4] == b"RIFF" and head[8:12] == b"AVI ":
+        return "avi"
+    if head[:4] == b"\x00\x00\x01\xba":
+        return "mpeg" #Program stream: .mpg, .vob
+    if head[:3] == b"FLV":
+        return "flv"
+    if head[:8] == b"\x30\x26\xb2\x75\x8e\x66\xcf\x11":
+        return "asf" #wmv
+    for start, packet in ((0, 188), (4, 192)): #Transport stream: plain .ts, or .m2ts/.MTS with a 4-byte timestamp per packet
+        if all(len(head) > start + i * packet and head[start + i * packet] == 0x47 for i in range(3)):
+            return "mpegts"
+    return None
+
+
+def is_video_file(path):
+    return os.path.splitext(path)[1].lower() not in NON_VIDEO_EXTENSIONS and sniff_container(path) is not None
+
+
+def _matches(patterns, name, relative_path):
+    # Patterns without a slash match the name, the others the path below the scanned folder; case-insensitive
+    name, relative_path = name.lower(), relative_path.replace(os.sep, "/").lower()
+    return any(fnmatch.fnmatchcase(relative_path if "/" in pattern else name, pattern.lower()) for pattern in patterns)
+
+
+def discover_videos(paths, include=(), exclude=DEFAULT_EXCLUDES, max_depth=None, stop=None):
+    # Yields video files below the given folders as they are found (depth-first, directory order, no full listing first).
+    # include/exclude are glob patterns, max_depth 0 only looks at the folders themselves, None is unlimited.
+    # Symlinked folders are not followed; stop is an optional threading.Event checked between entries.
+    for top in paths:
+        top = os.path.abspath(top)
+        stack = [(top, 0)]
+        while stack:
+            directory, depth = stack.pop()
+            prefix = "" if directory == top else os.path.relpath(directory, top) + "/" #Once per folder, not per entry
+            try:
+                with os.scandir(directory) as entries:
+                    subdirectories = []
+                    for entry in entries:
+                        if stop is not None and stop.is_set():
+                            return
+                        relative_path = prefix + entry.name
+                        if exclude and _matches(exclude, entry.name, relative_path):
+                            continue
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                if max_depth is None or depth < max_depth:
+                                    subdirectories.append(entry.path)
+                                continue
+                            if not entry.is_file():
+                                continue
+                        except OSError:
+                            continue
+                        if include and not _matches(include, entry.name, relative_path):
+                            continue
+                        if is_video_file(entry.path):
+                            yield entry.path
+            except OSError: #Unreadable folder, or it vanished while scanning
+                continue
+            stack.extend((path, depth + 1) for path in reversed(subdirectories))
+
+
+###BATCH_RUNNER####
+def find_videos(paths, recursive=False, include=(), exclude=DEFAULT_EXCLUDES, max_depth=None):
+    # Files are taken as given, directories contribute the video files discover_videos finds in them (sorted)
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            depth = max_depth if recursive else 0
+            files.extend(sorted(discover_videos([path], include, exclude, depth)))
+        else:
+            files.append(path)
+    return files
+
+
+def plan_jobs(files, crf_value, compression_level, video_codec, watermark_path="", x=0, y=0, preset="medium", reserved=None, **options):
+    # reserved collects the planned output names, pass the same set to keep later plans from reusing them
+    jobs = []
+    reserved = set() if reserved is None else reserved
+    for file_path in dict.fromkeys(files): #Drop duplicates, keep order
+        output_path = make_output_path(file_path, compression_level, reserved, options.get("output_dir", ""))
+        reserved.add(output_path)
+        jobs.append(EncodeJob(file_path, output_path, crf_value, video_codec, watermark_path, x, y, preset, compression_level, **options))
+    return jobs
+
+
+class JobRunner:
+    # Thread pool counterpart of the GUI scheduler that stays open for more work (watch mode).
+    # Callbacks get the job id first and are called from worker threads.
+    # Each worker owns one slot of layout (a WorkerLayout, which then also sets the number of workers).
+    # With a WorkerPool, every slot of its remote workers also takes jobs from the queue; max_jobs=0 then encodes nothing locally.
+    def __init__(self, max_jobs=None, order="fifo", on_start=None, on_progress=None, on_line=None, on_finished=None, layout=None, pool=None):
+        self.order = order
+        self.on_start = on_start
+        self.on_progress = on_progress
+        self.on_line = on_line
+        self.on_finished = on_finished
+        self.jobs = [] #job id -> EncodeJob
+        self.results = {} #job id -> EncodeResult
+        self.queue = JobQueue(order)
+        self.condition = threading.Condition()
+        self.active = 0
+        self.closed = False
+        self.hold_until = 0.0 #monotonic time until which workers wait for the cost estimates of the latest submit
+        self.estimating = 0 #submits whose costs are still being probed
+        self.pool = pool
+        self.attempts = collections.Counter() #job id -> times its remote worker went away
+        self.busy_replies = collections.Counter() #job id -> times a remote worker had no free slot for it
+        self.layout = layout or WorkerLayout(max_jobs or default_max_jobs())
+        self.local_workers = 0 if max_jobs == 0 and pool is not None else len(self.layout.slots)
+        self.workers = [threading.Thread(target=self.worker, args=(slot,), daemon=True) for slot in range(self.local_workers)]
+        if pool is not None:
+            self.workers += [threading.Thread(target=self.remote_worker, args=(remote,), daemon=True)
+                             for remote in pool.workers for _ in range(max(1, remote.slots))]
+        for thread in self.workers:
+            thread.start()
+
+    def submit(self, jobs):
+        # Queued together, so the ordering sees the whole group before a worker picks from it; returns the job ids.
+        # With "sjf" the costs are probed in the background and re-rank the queue as they arrive. Like the GUI scheduler,
+        # the workers give the probes up to ESTIMATE_WAIT_SECONDS so the first slots go to the shortest files.
+        with self.condition:
+            job_ids = list(range(len(self.jobs), len(self.jobs) + len(jobs)))
+            self.jobs.extend(jobs)
+            for job_id, job in zip(job_ids, jobs):
+                self.queue.push(job_id, job.priority)
+            if self.order == "sjf" and jobs:
+                self.estimating += 1
+                self.hold_until = time.monotonic() + ESTIMATE_WAIT_SECONDS
+            self.condition.notify_all()
+        if self.order == "sjf" and jobs:
+            threading.Thread(target=self.estimate_costs, args=(job_ids,), daemon=True).start()
+        return job_ids
+
+    def estimate_costs(self, job_ids):
+        try:
+            for job_id in job_ids:
+                cost = estimate_job_cost(self.jobs[job_id]) #Probed outside the lock
+                with self.condition:
+                    self.queue.set_cost(job_id, cost)
+        finally:
+            with self.condition:
+                self.estimating -= 1
+                if not self.estimating:
+                    self.hold_until = 0.0
+                self.condition.notify_all()
+
+    def held(self):
+        # Seconds workers should still wait for cost estimates before picking from the queue, called with the lock held
+        return max(0.0, self.hold_until - time.monotonic()) if self.queue else 0.0
+
+    def worker(self, slot):
+        while True:
+            with self.condition:
+                while not self.queue and not (self.closed and self.active == 0) or self.held(): #A running remote job may still come back
+                    self.condition.wait(self.held() or None)
+                if not self.queue:
+                    return
+                job_id = self.queue.pop()
+                job = self.jobs[job_id]
+                self.active += 1
+            try:
+                if self.on_start:
+                    self.on_start(job_id, job)
+                result = run_encode_safe(
+                    job,
+                    (lambda event: self.on_progress(job_id, event)) if self.on_progress else None,
+                    (lambda line: self.on_line(job_id, line)) if self.on_line else None,
+                    self.layout.limits(slot))
+                self.results[job_id] = result
+                if self.on_finished:
+                    self.on_finished(job_id, result)
+            finally:
+                with self.condition:
+                    self.active -= 1
+                    self.condition.notify_all()
+
+    def remote_worker(self, remote):
+        while True:
+            with self.condition:
+                while self.queue or not (self.closed and self.active == 0):
+                    if self.held():
+                        self.condition.wait(self.held())
+                        continue
+                    if self.queue and remote.healthy:
+                        break
+                    if self.queue and not self.local_workers and not any(other.healthy for other in self.pool.workers):
+                        break #Nobody could take it, fail it below rather than wait forever
+                    self.condition.wait(1.0) #Health changes are not notified
+                if not self.queue:
+                    return
+                job_id = self.queue.pop()
+                job = self.jobs[job_id]
+                self.active += 1
+            try:
+                if not remote.healthy:
+                    result = EncodeResult(job, -1, f"No worker available: {remote.last_error}")
+                else:
+                    if self.on_start:
+                        self.on_start(job_id, job)
+                    if self.on_line:
+                        self.on_line(job_id, f"Sent {os.path.basename(job.file_path)} to worker {remote.address} ({remote.host})")
+                    try:
+                        result = remote.encode(
+                            job,
+                            (lambda event: self.on_progress(job_id, event)) if self.on_progress else None,
+                            (lambda line: self.on_line(job_id, line)) if self.on_line else None)
+                    except WorkerUnavailable as e:
+                        busy = isinstance(e, WorkerBusy)
+                        if busy:
+                            self.busy_replies[job_id] += 1
+                            busy = self.busy_replies[job_id] <= WORKER_BUSY_RETRIES #A worker that never frees up counts as failed
+                        if not busy:
+                            remote.mark_down(str(e))
+                            self.attempts[job_id] += 1
+                        if self.on_line:
+                            self.on_line(job_id, f"Worker {remote.address} could not finish {os.path.basename(job.file_path)}: {e}")
+                        if busy or self.attempts[job_id] <= self.pool.retries:
+                            with self.condition:
+                                self.queue.push(job_id, job.priority) #Goes to the next free worker, local ones included
+                            if busy:
+                                time.sleep(1.0)
+                            continue
+                        result = EncodeResult(job, -1, f"Gave up after {self.attempts[job_id]} failed workers: {e}")
+                self.results[job_id] = result
+                if self.on_finished:
+                    self.on_finished(job_id, result)
+            finally:
+                with self.condition:
+                    self.active -= 1
+                    self.condition.notify_all()
+
+    def busy(self):
+        with self.condition:
+            return bool(self.queue) or self.active > 0
+
+    def close(self):
+        # Lets the queued jobs finish, then stops the workers
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        for thread in self.workers:
+            thread.join()
+
+
+def run_batch(jobs, max_jobs=None, on_start=None, on_progress=None, on_line=None, on_finished=None, order="fifo", layout=None, pool=None):
+    # Runs a fixed list of jobs, returns the results in the same order
+    if not jobs:
+        return []
+    max_jobs = 0 if max_jobs == 0 and pool is not None else min(max_jobs or default_max_jobs(), len(jobs))
+    runner = JobRunner(max_jobs, order, on_start, on_progress, on_line, on_finished, layout, pool)
+    runner.submit(jobs)
+    runner.close()
+    return [runner.results.get(job_id) for job_id in range(len(jobs))]
+
+
+
+###JOB_JOURNAL####
+JOB_STATES = ("pending", "running", "done", "failed", "cancelled")
+
+
+def process_start_id(pid):
+    # Boot id and start time of pid (Linux), "" where they cannot be read. Stored next to a pid, it tells the process
+    # that recorded it from one that got the same pid later, e.g. after the reboot the journal is there for.
+    try:
+        with open("/proc/sys/kernel/random/boot_id") as f:
+            boot_id = f.read().strip()
+        with open(f"/proc/{pid}/stat") as f:
+            start_time = f.read().rpartition(")")[2].split()[19] #Field 22, after the command name that may contain spaces
+    except (OSError, IndexError):
+        return ""
+    return f"{boot_id}:{start_time}"
+
+
+def process_alive(pid, start_id=""):
+    # start_id is the process_start_id recorded with pid, a pid now running under another one was reused
+    if start_id and process_start_id(pid) not in (start_id, ""):
+        return False
+    if pid == os.getpid():
+        return True
+    if os.name == "nt": #os.kill(pid, 0) would terminate the process on Windows
+        import ctypes
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(0x00100000, False, pid) #SYNCHRONIZE
+        if not handle:
+            return False
+        try:
+            return kernel32.WaitForSingleObject(handle, 0) == 0x00000102 #WAIT_TIMEOUT, still running
+        finally:
+            kernel32.CloseHandle(handle)
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class JobJournal:
+    # SQLite record of every queued job and its state, so a batch cut short by a crash or reboot can be resumed.
+    # Safe to share between worker threads; each state change is its own committed transaction.
+    def __init__(self, path=JOURNAL_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=FULL")
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            batch TEXT NOT NULL,
+            pid INTEGER NOT NULL,
+            file_path TEXT NOT NULL,
+            output_path TEXT NOT NULL DEFAULT '',
+            settings TEXT NOT NULL,
+            state TEXT NOT NULL DEFAULT 'pending',
+            action TEXT NOT NULL DEFAULT '',
+            return_code INTEGER,
+            error TEXT NOT NULL DEFAULT '',
+            queued_at REAL NOT NULL,
+            updated_at REAL NOT NULL)""")
+        if "pid_start" not in [row[1] for row in self.connection.execute("PRAGMA table_info(jobs)")]: #Journals written before it existed
+            self.connection.execute("ALTER TABLE jobs ADD COLUMN pid_start TEXT NOT NULL DEFAULT ''")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state)")
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS watched_files (
+            path TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            seen_at REAL NOT NULL,
+            PRIMARY KEY (path, size, mtime_ns))""")
+        if "job_id" not in [row[1] for row in self.connection.execute("PRAGMA table_info(watched_files)")]:
+            self.connection.execute("ALTER TABLE watched_files ADD COLUMN job_id INTEGER")
+        cutoff = time.time() - JOURNAL_KEEP_DAYS * 86400
+        self.connection.execute("DELETE FROM jobs WHERE state IN ('done', 'failed', 'cancelled') AND updated_at < ?", (cutoff,))
+        for path, size, mtime_ns in self.connection.execute( #Old claims go once the file is gone or replaced, a file still sitting in the inbox keeps its claim
+                "SELECT path, size, mtime_ns FROM watched_files WHERE seen_at < ? AND COALESCE(job_id, 0) NOT IN (SELECT id FROM jobs WHERE state IN ('pending', 'running'))",
+                (cutoff,)).fetchall():
+            try:
+                stat = os.stat(path)
+                if (stat.st_size, stat.st_mtime_ns) == (size, mtime_ns):
+                    continue
+            except OSError:
+                pass
+            self.connection.execute("DELETE FROM watched_files WHERE path = ? AND size = ? AND mtime_ns = ?", (path, size, mtime_ns))
+        self.pid_start = process_start_id(os.getpid()) #Recorded with our pid, see process_alive
+
+    def execute(self, sql, parameters=()):
+        with self.lock:
+            return self.connection.execute(sql, parameters).fetchall()
+
+    def add_jobs(self, jobs, watched=None):
+        # Returns the row id of every job, in order.
+        # watched holds a (size, mtime_ns) per job for files picked up by a folder watcher, None for the others: those jobs
+        # claim their file in the same transaction, and get None instead of a row when another watcher already has it.
+        batch = datetime.datetime.now().strftime("%Y%m%d-%H%M%S") + f"-{os.getpid()}"
+        now = time.time()
+        row_ids = []
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                for job, stat in zip(jobs, watched or [None] * len(jobs)):
+                    if stat and self._watched_claimed(job.file_path, *stat):
+                        row_ids.append(None)
+                        continue
+                    cursor = self.connection.execute(
+                        "INSERT INTO jobs (batch, pid, pid_start, file_path, output_path, settings, queued_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        (batch, os.getpid(), self.pid_start, job.file_path, job.output_path, json.dumps(job.as_dict()), now, now))
+                    row_ids.append(cursor.lastrowid)
+                    if stat:
+                        self.connection.execute("INSERT OR REPLACE INTO watched_files (path, size, mtime_ns, seen_at, job_id) VALUES (?, ?, ?, ?, ?)",
+                                                (os.path.abspath(job.file_path), *stat, now, cursor.lastrowid))
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+            self.connection.execute("COMMIT")
+        return row_ids
+
+    def mark_running(self, row_id, output_path):
+        self.execute("UPDATE jobs SET state = 'running', pid = ?, pid_start = ?, output_path = ?, updated_at = ? WHERE id = ?",
+                     (os.getpid(), self.pid_start, output_path, time.time(), row_id))
+
+    def mark_finished(self, row_id, result):
+        self.execute("UPDATE jobs SET state = ?, action = ?, return_code = ?, error = ?, updated_at = ? WHERE id = ?",
+                     ("done" if result.ok else "failed", result.action, result.return_code, result.error_message, time.time(), row_id))
+
+    def mark_failed(self, row_id, error_message):
+        self.execute("UPDATE jobs SET state = 'failed', return_code = -1, error = ?, updated_at = ? WHERE id = ?",
+                     (error_message, time.time(), row_id))
+
+    def cancel(self, row_ids):
+        with self.lock:
+            self.connection.executemany("UPDATE jobs SET state = 'cancelled', updated_at = ? WHERE id = ? AND state IN ('pending', 'running')",
+                                        [(time.time(), row_id) for row_id in row_ids])
+
+    def interrupted(self, watched_only=False):
+        # Pending/running jobs whose process is gone, as (row id, EncodeJob) in queue order.
+        # A job whose output already has its final name was renamed just before the crash and is marked done instead.
+        # watched_only keeps the jobs a folder watcher queued, which it takes back on its next start.
+        entries = []
+        for row_id, pid, pid_start, state, output_path, settings in self.execute(
+                "SELECT id, pid, pid_start, state, output_path, settings FROM jobs WHERE state IN ('pending', 'running')"
+                + (" AND id IN (SELECT job_id FROM watched_files)" if watched_only else "") + " ORDER BY id"):
+            if process_alive(pid, pid_start):
+                continue
+            if state == "running" and output_path and os.path.exists(output_path) and not os.path.exists(partial_output_path(output_path)):
+                self.execute("UPDATE jobs SET state = 'done', return_code = 0, updated_at = ? WHERE id = ?", (time.time(), row_id))
+                continue
+            job = EncodeJob(**json.loads(settings))
+            job.output_path = output_path
+            entries.append((row_id, job))
+        return entries
+
+    def clean_partial_outputs(self, entries):
+        # Removes what interrupted encodes left behind, returns the removed paths
+        removed = []
+        for _, job in entries:
+            if job.output_path and remove_partial_output(job.output_path):
+                removed.append(partial_output_path(job.output_path))
+        return removed
+
+    def watched_claimed(self, path, size, mtime_ns):
+        # True once this version of a watched file has a job that is queued, running or done, across restarts and
+        # concurrent watchers. A failed or cancelled job gives the file back. The claim itself is taken by add_jobs.
+        with self.lock:
+            return self._watched_claimed(path, size, mtime_ns)
+
+    def _watched_claimed(self, path, size, mtime_ns):
+        row = self.connection.execute("""SELECT watched_files.job_id, jobs.state FROM watched_files LEFT JOIN jobs ON jobs.id = watched_files.job_id
+            WHERE path = ? AND size = ? AND mtime_ns = ?""", (os.path.abspath(path), size, mtime_ns)).fetchone()
+        if row is None:
+            return False
+        job_id, state = row
+        return job_id is None or state not in ("failed", "cancelled") #Claims from older journals, or whose job was pruned, stay taken
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+###WATERMARK####
+_watermark_lock = threading.Lock()
+
+
+def watermark_size(watermark_path, frame_height):
+    # WATERMARK_SCALE of the frame height, the width follows the image's aspect ratio
+    image = probe_media(watermark_path)
+    height = max(1, int(round(frame_height * WATERMARK_SCALE))) if frame_height else WATERMARK_SIZE
+    width = max(1, int(round(height * image.width / image.height))) if image.width and image.height else height
+    return width, height
+
+
+def prepare_watermark(watermark_path, frame_height):
+    # Renders the watermark once per image and size (scaled, RGBA, alpha premultiplied) so encodes overlay it without a scale filter.
+    # Kept in WATERMARK_CACHE_DIR under the image's content hash, shared by every job, segment and later batch.
+    width, height = watermark_size(watermark_path, frame_height)
+    path = os.path.join(WATERMARK_CACHE_DIR, f"{content_hash(watermark_path)}_{width}x{height}.png")
+    if os.path.exists(path):
+        return path
+    with _watermark_lock:
+        if not os.path.exists(path):
+            os.makedirs(WATERMARK_CACHE_DIR, exist_ok=True)
+            temp_path = os.path.join(WATERMARK_CACHE_DIR, f"{os.getpid()}.{threading.get_ident()}.tmp.png") #Other processes may render the same one
+            run_process(["ffmpeg", "-v", "error", "-y", "-i", os.path.abspath(watermark_path),
+                         "-vf", f"scale={width}:{height}:flags=lanczos,format=rgba,premultiply=inplace=1",
+                         "-frames:v", "1", temp_path])
+            os.replace(temp_path, path)
+    return path
+
+
+###RESULT_CACHE####
+_content_hash_cache = {} #(path, size, mtime_ns) -> hex digest
+_content_hash_lock = threading.Lock()
+_result_cache = None
+_result_cache_lock = threading.Lock()
+
+
+def content_hash(path):
+    # blake2b of the size and HASH_SAMPLES chunks spread over the file (all of it when small), so a 50 GB input costs a few MB of reads.
+    # Renamed or copied files hash the same; an edit that changes neither the size nor a sampled chunk would go unnoticed.
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    with _content_hash_lock:
+        if key in _content_hash_cache:
+            return _content_hash_cache[key]
+    digest = hashlib.blake2b(str(stat.st_size).encode(), digest_size=20)
+    with open(path, "rb") as f:
+        if stat.st_size <= HASH_SAMPLES * HASH_SAMPLE_BYTES:
+            digest.update(f.read())
+        else:
+            step = (stat.st_size - HASH_SAMPLE_BYTES) // (HASH_SAMPLES - 1) #First chunk at the start, last one ends at the end
+            for index in range(HASH_SAMPLES):
+                f.seek(index * step)
+                digest.update(f.read(HASH_SAMPLE_BYTES))
+    value = digest.hexdigest()
+    with _content_hash_lock:
+        _content_hash_cache[key] = value
+    return value
+
+
+def result_cache_key(job, media_info):
+    # Input content plus every setting that changes the encoded bytes; the watermark counts by content, not by name,
+    # and its position as build_ffmpeg_command keeps it inside the frame. Without one the preview position does not matter.
+    settings = {key: value for key, value in job.as_dict().items() if key not in CACHE_IGNORED_SETTINGS}
+    if job.watermark_path and os.path.exists(job.watermark_path):
+        width, height = watermark_size(job.watermark_path, media_info.height)
+        settings["watermark_path"] = [content_hash(job.watermark_path), WATERMARK_SCALE]
+        settings["x"], settings["y"] = min(job.x, media_info.width - width), min(job.y, media_info.height - height)
+    else:
+        for key in ("watermark_path", "x", "y"):
+            settings.pop(key, None)
+    payload = json.dumps([content_hash(job.file_path), settings], sort_keys=True)
+    return hashlib.blake2b(payload.encode(), digest_size=20).hexdigest()
+
+
+def clone_or_copy(source, destination):
+    # A reflink shares the data blocks until one side is written, a copy is needed across drives and on other filesystems.
+    # Never a hard link: a tagger editing the user's output in place would change the cached result with it.
+    if fcntl is not None and sys.platform.startswith("linux"):
+        try:
+            with open(source, "rb") as source_file, open(destination, "wb") as destination_file:
+                fcntl.ioctl(destination_file.fileno(), FICLONE, source_file.fileno())
+            return
+        except OSError:
+            pass
+    shutil.copyfile(source, destination)
+
+
+def same_content(path, other_path):
+    try:
+        if os.path.samefile(path, other_path):
+            return True
+        return os.path.getsize(path) == os.path.getsize(other_path) and content_hash(path) == content_hash(other_path)
+    except OSError:
+        return False
+
+
+def find_identical_output(job, cached_path):
+    # The names make_output_path skipped to reach job.output_path, first one holding the cached result
+    output_dir = os.path.dirname(job.output_path)
+    base_filename = os.path.splitext(os.path.basename(job.file_path))[0]
+    candidate = os.path.join(output_dir, f"{base_filename}_{job.compression_level}_compressed.mp4")
+    counter = 1
+    while candidate != job.output_path and os.path.exists(candidate):
+        if same_content(candidate, cached_path):
+            return candidate
+        candidate = os.path.join(output_dir, f"{base_filename}_{job.compression_level}_{counter}_compressed.mp4")
+        counter += 1
+    return None
+
+
+class ResultCache:
+    # Content addressed store of finished encodes, so the same input with the same settings is never encoded twice.
+    # Outputs are reflinked (or copied) into objects/ and indexed in SQLite; past the size limit the least recently used go first.
+    def __init__(self, directory=CACHE_DIR):
+        self.directory = directory
+        self.objects_dir = os.path.join(directory, "objects")
+        os.makedirs(self.objects_dir, exist_ok=True)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(os.path.join(directory, "index.sqlite3"), timeout=30, check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS entries (
+            key TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            source TEXT NOT NULL,
+            settings TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            last_used REAL NOT NULL,
+            hits INTEGER NOT NULL DEFAULT 0)""")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS options (name TEXT PRIMARY KEY, value TEXT NOT NULL)")
+
+    def execute(self, sql, parameters=()):
+        with self.lock:
+            return self.connection.execute(sql, parameters).fetchall()
+
+    def object_path(self, key):
+        return os.path.join(self.objects_dir, key[:2], f"{key}.mp4")
+
+    @property
+    def max_bytes(self):
+        rows = self.execute("SELECT value FROM options WHERE name = 'max_bytes'")
+        return int(rows[0][0]) if rows else CACHE_MAX_BYTES
+
+    def set_limit(self, max_bytes):
+        # Returns how many entries had to go to fit the new limit
+        self.execute("INSERT OR REPLACE INTO options (name, value) VALUES ('max_bytes', ?)", (str(int(max_bytes)),))
+        return self.evict()
+
+    def lookup(self, key):
+        # Path of the stored output, or None; an entry whose file was deleted or changed behind our back is dropped
+        rows = self.execute("SELECT size FROM entries WHERE key = ?", (key,))
+        if not rows:
+            return None
+        path = self.object_path(key)
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            size = None
+        if size != rows[0][0]:
+            self.purge([key])
+            return None
+        self.execute("UPDATE entries SET last_used = ?, hits = hits + 1 WHERE key = ?", (time.time(), key))
+        return path
+
+    def store(self, key, output_path, job):
+        path = self.object_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp" #Two jobs may finish the same key at once
+        clone_or_copy(output_path, temp_path)
+        os.replace(temp_path, path)
+        now = time.time()
+        settings = {name: value for name, value in job.as_dict().items() if name not in CACHE_IGNORED_SETTINGS}
+        self.execute("INSERT OR REPLACE INTO entries (key, size, source, settings, created_at, last_used) VALUES (?, ?, ?, ?, ?, ?)",
+                     (key, os.path.getsize(path), job.file_path, json.dumps(settings), now, now))
+        self.evict()
+
+    def evict(self):
+        # Drops least recently used entries until the store fits max_bytes, returns how many were dropped
+        max_bytes = self.max_bytes
+        total = self.execute("SELECT COALESCE(SUM(size), 0) FROM entries")[0][0]
+        victims = []
+        for key, size in self.execute("SELECT key, size FROM entries ORDER BY last_used"):
+            if total <= max_bytes:
+                break
+            victims.append(key)
+            total -= size
+        return self.purge(victims)
+
+    def purge(self, keys=None, older_than_days=None):
+        # Removes the given entries, those unused for older_than_days, or everything; returns how many were removed
+        if keys is None:
+            cutoff = time.time() - older_than_days * 86400 if older_than_days is not None else float("inf")
+            keys = [key for key, in self.execute("SELECT key FROM entries WHERE last_used < ?", (cutoff,))]
+        for key in keys:
+            try:
+                os.remove(self.object_path(key))
+            except FileNotFoundError:
+                pass
+            self.execute("DELETE FROM entries WHERE key = ?", (key,))
+        return len(keys)
+
+    def entries(self):
+        # (key, size, source, settings dict, created_at, last_used, hits), most recently used first
+        return [(key, size, source, json.loads(settings), created_at, last_used, hits) for key, size, source, settings, created_at, last_used, hits
+                in self.execute("SELECT key, size, source, settings, created_at, last_used, hits FROM entries ORDER BY last_used DESC")]
+
+    def stats(self):
+        count, total, hits = self.execute("SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(hits), 0) FROM entries")[0]
+        return dict(entries=count, size=total, hits=hits, max_bytes=self.max_bytes)
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+def result_cache():
+    # Shared instance for run_encode, opened on first use
+    global _result_cache
+    with _result_cache_lock:
+        if _result_cache is None:
+            _result_cache = ResultCache()
+        return _result_cache
+
+
+###JOB_METRICS####
+_current_usage = contextvars.ContextVar("pkumpress_usage", default=None) #ResourceUsage of the job running in this context
+
+
+class ResourceUsage:
+    # CPU time and peak memory of the ffmpeg processes of one job: passes, segments, quality samples and the watermark
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.user_time = 0.0
+        self.system_time = 0.0
+        self.peak_rss_kb = 0 #largest single process; segments running side by side are not added up
+        self.processes = 0
+
+    def add(self, rusage):
+        peak_rss_kb = rusage.ru_maxrss // 1024 if sys.platform == "darwin" else rusage.ru_maxrss #bytes on macOS, KiB elsewhere
+        with self.lock:
+            self.user_time += rusage.ru_utime
+            self.system_time += rusage.ru_stime
+            self.peak_rss_kb = max(self.peak_rss_kb, peak_rss_kb)
+            self.processes += 1
+
+
+def wait_process(process):
+    # Reaps the process with wait4 where there is one, so its rusage can be charged to the job that started it
+    if not hasattr(os, "wait4"): #Windows
+        return process.wait()
+    _, status, rusage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    cancel = _current_cancel.get()
+    if cancel is not None:
+        cancel.discard(process)
+    usage = _current_usage.get()
+    if usage is not None:
+        usage.add(rusage)
+    return process.returncode
+
+
+def run_process(command):
+    # subprocess.run(capture_output=True, text=True, check=True) for the ffmpeg helpers of a job, measured by wait_process.
+    # Output goes through temporary files, so neither pipe can fill up while we wait.
+    with tempfile.TemporaryFile() as stdout_file, tempfile.TemporaryFile() as stderr_file:
+        process = start_process(command, stdout=stdout_file, stderr=stderr_file)
+        return_code = wait_process(process)
+        stdout_file.seek(0)
+        stderr_file.seek(0)
+        stdout = stdout_file.read().decode(errors="replace")
+        stderr = stderr_file.read().decode(errors="replace")
+    if return_code != 0:
+        raise subprocess.CalledProcessError(return_code, command, stdout, stderr)
+    return subprocess.CompletedProcess(command, return_code, stdout, stderr)
+
+
+def _file_size(path):
+    try:
+        return os.path.getsize(path) if path else 0
+    except OSError:
+        return 0
+
+
+def job_metrics(result, host=""):
+    # The structured record of one finished job, as written to the metrics JSONL
+    job = result.job
+    usage = result.usage or ResourceUsage()
+    input_size = _file_size(job.file_path)
+    output_size = _file_size(job.output_path) if result.ok and result.action in ("encoded", "remuxed", "cached") else 0
+    frames = 0
+    if result.ok and result.action in ("encoded", "remuxed"):
+        try:
+            frames = probe_media(job.file_path).frame_count #Cached since the job probed it
+        except (subprocess.CalledProcessError, ValueError, OSError):
+            pass
+    return dict(time=datetime.datetime.now().astimezone().isoformat(timespec="seconds"), host=host,
+                input=job.file_path, output=job.output_path if output_size else "", input_size=input_size, output_size=output_size,
+                compression_ratio=round(input_size / output_size, 3) if output_size else None,
+                codec=job.video_codec, preset=job.preset, crf=job.crf_value, action=result.action,
+                wall_time=round(result.wall_time, 3), relocate_time=round(result.relocate_time, 3),
+                cpu_user=round(usage.user_time, 3), cpu_system=round(usage.system_time, 3),
+                peak_rss_kb=usage.peak_rss_kb, processes=usage.processes,
+                fps=round(frames / result.wall_time, 2) if frames and result.wall_time else 0.0, frames=frames,
+                exit_code=result.return_code, error=result.error_message)
+
+
+class MetricsRecorder:
+    # Appends job_metrics() of every finished job to a JSONL file (path), and keeps counters and histograms that are
+    # rewritten in node-exporter textfile format after each job (textfile_path, should end in .prom).
+    # The counters cover this process only and restart from zero with it, which Prometheus' rate() handles;
+    # processes running side by side need their own textfile, the collector merges every *.prom in its directory.
+    def __init__(self, path=METRICS_PATH, textfile_path=""):
+        self.path = path
+        self.textfile_path = textfile_path
+        self.lock = threading.Lock()
+        self.host = socket.gethostname()
+        self.jobs = collections.Counter() #(status, action) -> finished jobs
+        self.totals = collections.Counter() #cpu_user, cpu_system, input_bytes, output_bytes, frames
+        self.wall_counts = [0] * (len(METRICS_WALL_BUCKETS) + 1) #per bucket, the last one is +Inf
+        self.wall_sum = 0.0
+        self.fps_counts = [0] * (len(METRICS_FPS_BUCKETS) + 1)
+        self.fps_sum = 0.0
+        self.peak_rss_kb = 0
+        self.last_finished = 0.0
+
+    def record(self, result):
+        entry = job_metrics(result, self.host)
+        with self.lock:
+            self.update(entry)
+            if self.path:
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                with open(self.path, "a") as f:
+                    f.write(json.dumps(entry) + "\n")
+            if self.textfile_path:
+                self.write_textfile()
+        return entry
+
+    def update(self, entry):
+        self.jobs[("ok" if entry["exit_code"] == 0 else "failed", entry["action"])] += 1
+        self.totals["cpu_user"] += entry["cpu_user"]
+        self.totals["cpu_system"] += entry["cpu_system"]
+        self.totals["input_bytes"] += entry["input_size"]
+        self.totals["output_bytes"] += entry["output_size"]
+        self.totals["frames"] += entry["frames"]
+        self.totals["relocate_time"] += entry["relocate_time"]
+        self.wall_counts[bisect.bisect_left(METRICS_WALL_BUCKETS, entry["wall_time"])] += 1
+        self.wall_sum += entry["wall_time"]
+        if entry["fps"]:
+            self.fps_counts[bisect.bisect_left(METRICS_FPS_BUCKETS, entry["fps"])] += 1
+            self.fps_sum += entry["fps"]
+        self.peak_rss_kb = max(self.peak_rss_kb, entry["peak_rss_kb"])
+        self.last_finished = time.time()
+
+    def histogram_lines(self, name, buckets, counts, total):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(list(buckets) + ["+Inf"], counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{le="{bound}"}} {cumulative}')
+        lines.append(f"{name}_sum {total:.3f}")
+        lines.append(f"{name}_count {cumulative}")
+        return lines
+
+    def textfile(self):
+        lines = ["# HELP pkumpress_jobs_total Finished compression jobs by outcome and action.", "# TYPE pkumpress_jobs_total counter"]
+        lines += [f'pkumpress_jobs_total{{status="{status}",action="{action}"}} {count}' for (status, action), count in sorted(self.jobs.items())]
+        lines += ["# HELP pkumpress_job_wall_seconds Wall time per job.", "# TYPE pkumpress_job_wall_seconds histogram"]
+        lines += self.histogram_lines("pkumpress_job_wall_seconds", METRICS_WALL_BUCKETS, self.wall_counts, self.wall_sum)
+        lines += ["# HELP pkumpress_job_fps Average encode speed per job in frames per second.", "# TYPE pkumpress_job_fps histogram"]
+        lines += self.histogram_lines("pkumpress_job_fps", METRICS_FPS_BUCKETS, self.fps_counts, self.fps_sum)
+        lines += ["# HELP pkumpress_cpu_seconds_total CPU time of the ffmpeg processes.", "# TYPE pkumpress_cpu_seconds_total counter",
+                  f'pkumpress_cpu_seconds_total{{mode="user"}} {self.totals["cpu_user"]:.3f}',
+                  f'pkumpress_cpu_seconds_total{{mode="system"}} {self.totals["cpu_system"]:.3f}',
+                  "# HELP pkumpress_relocate_seconds_total Time spent moving moov atoms to the front of faststart outputs.",
+                  "# TYPE pkumpress_relocate_seconds_total counter", f'pkumpress_relocate_seconds_total {self.totals["relocate_time"]:.3f}']
+        for name, key, help_text in (("pkumpress_input_bytes_total", "input_bytes", "Size of the inputs of finished jobs."),
+                                     ("pkumpress_output_bytes_total", "output_bytes", "Size of the outputs written."),
+                                     ("pkumpress_frames_total", "frames", "Frames encoded or remuxed.")):
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter", f"{name} {self.totals[key]}"]
+        lines += ["# HELP pkumpress_job_peak_rss_bytes Largest peak memory of a single ffmpeg process.", "# TYPE pkumpress_job_peak_rss_bytes gauge",
+                  f"pkumpress_job_peak_rss_bytes {self.peak_rss_kb * 1024}",
+                  "# HELP pkumpress_last_job_timestamp_seconds When the last job finished.", "# TYPE pkumpress_last_job_timestamp_seconds gauge",
+                  f"pkumpress_last_job_timestamp_seconds {self.last_finished:.3f}"]
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self):
+        # Written next to the target and renamed, so node-exporter never reads half a file
+        directory = os.path.dirname(os.path.abspath(self.textfile_path))
+        os.makedirs(directory, exist_ok=True)
+        temp_path = os.path.join(directory, f".{os.path.basename(self.textfile_path)}.{os.getpid()}.tmp")
+        with open(temp_path, "w") as f:
+            f.write(self.textfile())
+        os.replace(temp_path, self.textfile_path)
+
+
+###JOB_LOGS####
+def job_log_name(file_path):
+    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    name = re.sub(r"[^\w.-]+", "_", os.path.splitext(os.path.basename(file_path))[0])
+    return f"{timestamp}_{name}.log"
+
+
+class JobLogSink:
+    # Streams the ffmpeg output of each job to its own file in directory while the job runs.
+    # open/write/close only queue the line, one writer thread owns the buffered files, so a slow disk never
+    # holds up the caller. A closed log is gzipped and the directory is then rotated by age and total size.
+    # Opening a key that is already open keeps its file and only adds the header.
+    def __init__(self, directory, max_bytes=LOG_MAX_BYTES, max_age_days=LOG_MAX_AGE_DAYS):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age_days = max_age_days
+        self.queue = queue.SimpleQueue()
+        self.thread = None
+        self.thread_lock = threading.Lock()
+        self.files = {} #job key -> open file, writer thread only
+        self.errors = [] #OSError messages from the writer thread, read with take_errors
+
+    def open(self, key, file_path, header=""):
+        with self.thread_lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="job-log-writer", daemon=True)
+                self.thread.start()
+        self.queue.put(("open", key, job_log_name(file_path), header))
+
+    def write(self, key, line):
+        self.queue.put(("write", key, line))
+
+    def close(self, key, footer=""):
+        self.queue.put(("close", key, footer))
+
+    def stop(self):
+        # Closes (and gzips) every log still open, then ends the writer thread
+        with self.thread_lock:
+            thread, self.thread = self.thread, None
+        if thread is not None:
+            self.queue.put(None)
+            thread.join()
+
+    def take_errors(self):
+        errors, self.errors = self.errors, []
+        return errors
+
+    def run(self):
+        last_flush = time.monotonic()
+        while True:
+            try:
+                item = self.queue.get(timeout=LOG_FLUSH_SECONDS)
+            except queue.Empty:
+                item = ()
+            if item is None:
+                break
+            try:
+                self.handle(item)
+            except OSError as e: #A full disk loses log lines, never the encode
+                self.errors.append(str(e))
+            if time.monotonic() - last_flush >= LOG_FLUSH_SECONDS:
+                for f in self.files.values():
+                    try:
+                        f.flush()
+                    except OSError:
+                        pass
+                last_flush = time.monotonic()
+        for key in list(self.files):
+            try:
+                self.handle(("close", key, ""))
+            except OSError as e:
+                self.errors.append(str(e))
+
+    def handle(self, item):
+        if not item:
+            return
+        action, key = item[0], item[1]
+        if action == "open" and key in self.files:
+            if item[3]: #Started again before it was closed (a remote job retried elsewhere), the log carries on in the same file
+                self.files[key].write(item[3] + "\n")
+        elif action == "open":
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, item[2])
+            stem, counter = path[:-len(".log")], 1
+            while os.path.exists(path) or os.path.exists(path + ".gz"): #Same file name started in the same second
+                path = f"{stem}_{counter}.log"
+                counter += 1
+            f = open(path, "x", encoding="utf-8", errors="replace", buffering=LOG_BUFFER_BYTES)
+            self.files[key] = f
+            if item[3]:
+                f.write(item[3] + "\n")
+        elif action == "write":
+            f = self.files.get(key)
+            if f is not None:
+                f.write(item[2] + "\n")
+        elif action == "close":
+            f = self.files.pop(key, None)
+            if f is None:
+                return
+            if item[2]:
+                f.write(item[2] + "\n")
+            f.close()
+            self.compress(f.name)
+            self.rotate()
+
+    def compress(self, path):
+        with open(path, "rb") as source, gzip.open(path + ".gz", "wb") as target:
+            shutil.copyfileobj(source, target)
+        os.remove(path)
+
+    def rotate(self):
+        # Finished logs only: gzipped job logs and the batch logs older versions wrote, never a log still being written
+        logs = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".log.gz") or (name.startswith("compression_log_") and name.endswith(".txt")):
+                path = os.path.join(self.directory, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                logs.append((stat.st_mtime, stat.st_size, path))
+        logs.sort(reverse=True) #Newest first
+        cutoff = time.time() - self.max_age_days * 86400
+        total = 0
+        for mtime, size, path in logs:
+            total += size
+            if mtime < cutoff or total > self.max_bytes:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+
+###WORKER_RESOURCES####
+_current_limits = contextvars.ContextVar("pkumpress_limits", default=None) #ProcessLimits of the job slot running in this context
+_current_cancel = contextvars.ContextVar("pkumpress_cancel", default=None) #JobCancel of the job running in this context
+_tool_paths = {} #name -> path of the util-linux/coreutils tools ProcessLimits.wrap puts before ffmpeg, "" when missing
+
+
+def available_cpus():
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0)) #Honours a taskset/cpuset the app itself was started in
+    return list(range(os.cpu_count() or 1))
+
+
+def format_cpus(cpus):
+    # (0, 1, 2, 3, 8) -> "0-3,8"
+    ranges = []
+    for cpu in sorted(cpus):
+        if ranges and cpu == ranges[-1][1] + 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+    return ",".join(str(first) if first == last else f"{first}-{last}" for first, last in ranges)
+
+
+def tool_path(name):
+    if name not in _tool_paths:
+        _tool_paths[name] = shutil.which(name) or ""
+    return _tool_paths[name]
+
+
+class ProcessLimits:
+    # What every ffmpeg process of one job slot gets: the encoder thread count, the cores it may run on,
+    # CPU and disk priority, and a cap on its address space. 0/empty leaves a setting to the OS/ffmpeg.
+    def __init__(self, threads=0, cpus=(), nice=0, io_class="", memory_limit_mb=0):
+        self.threads = threads
+        self.cpus = tuple(cpus)
+        self.nice = nice
+        self.io_class = io_class
+        self.memory_limit_mb = memory_limit_mb
+
+    def share(self, count):
+        # The budget of one of count processes running side by side (segments, quality samples)
+        threads = max(1, self.threads // count) if self.threads else 0
+        return ProcessLimits(threads, self.cpus, self.nice, self.io_class, self.memory_limit_mb)
+
+    def wrap(self, command):
+        # The limits are in place before ffmpeg runs, so every thread it starts has them: each tool sets its own and execs
+        # the next under the same pid. Whatever has no tool here is left to apply (the stdlib has no ioprio call at all).
+        prefix = []
+        if self.io_class and tool_path("ionice"):
+            prefix += [tool_path("ionice")] + IO_CLASSES[self.io_class]
+        if self.cpus and tool_path("taskset"):
+            prefix += [tool_path("taskset"), "-c", format_cpus(self.cpus)]
+        if self.nice and tool_path("nice") and hasattr(os, "getpriority"):
+            increment = self.nice - os.getpriority(os.PRIO_PROCESS, 0) #nice -n is relative to our own, and going below it needs root
+            if increment > 0:
+                prefix += [tool_path("nice"), "-n", str(increment)]
+        if self.memory_limit_mb and tool_path("prlimit"):
+            prefix += [tool_path("prlimit"), f"--as={self.memory_limit_mb * 1048576}", "--"]
+        return prefix + list(command)
+
+    def apply(self, pid):
+        # Fallback for the limits wrap had no tool for, set right after the process started. On Linux this only reaches
+        # ffmpeg's main thread and whatever it starts afterwards, which is why wrap comes first.
+        # A limit the platform or our privileges do not allow must not fail the encode.
+        try:
+            if self.cpus and not tool_path("taskset") and hasattr(os, "sched_setaffinity"):
+                os.sched_setaffinity(pid, self.cpus)
+            if self.nice and not tool_path("nice") and hasattr(os, "setpriority"):
+                os.setpriority(os.PRIO_PROCESS, pid, max(self.nice, os.getpriority(os.PRIO_PROCESS, 0))) #Never below our own, that needs root
+            if self.memory_limit_mb and not tool_path("prlimit") and resource is not None and hasattr(resource, "prlimit"):
+                limit = self.memory_limit_mb * 1048576
+                resource.prlimit(pid, resource.RLIMIT_AS, (limit, limit))
+        except OSError:
+            pass
+
+    def as_dict(self):
+        return dict(self.__dict__)
+
+
+class JobCancel:
+    # Kills the processes of one job, the running ones and any it starts afterwards, e.g. when a worker's dispatcher hangs up
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.processes = set()
+        self.cancelled = False
+
+    def add(self, process):
+        with self.lock:
+            self.processes.add(process)
+            cancelled = self.cancelled
+        if cancelled:
+            process.kill()
+
+    def discard(self, process):
+        with self.lock:
+            self.processes.discard(process)
+
+    def cancel(self):
+        with self.lock:
+            self.cancelled = True
+            processes = list(self.processes)
+        for process in processes:
+            try:
+                process.kill()
+            except OSError: #Already gone
+                pass
+
+
+def start_process(command, **popen_args):
+    # subprocess.Popen with the limits of the current job slot, killed with the job when it is cancelled
+    limits = _current_limits.get()
+    if limits is None:
+        process = subprocess.Popen(command, **popen_args)
+    else:
+        process = subprocess.Popen(limits.wrap(command), **popen_args)
+        limits.apply(process.pid)
+    cancel = _current_cancel.get()
+    if cancel is not None:
+        cancel.add(process)
+    return process
+
+
+def decoder_thread_args():
+    limits = _current_limits.get()
+    return ["-threads", str(limits.threads)] if limits is not None and limits.threads else []
+
+
+def encoder_thread_args(video_codec, args):
+    # args plus the thread budget of the current job slot: -threads for x264, a pool of that size for x265 (joined to its other -x265-params)
+    args = list(args)
+    limits = _current_limits.get()
+    if limits is None or not limits.threads:
+        return args
+    if video_codec != "libx265":
+        return args + ["-threads", str(limits.threads)]
+    if "-x265-params" in args:
+        index = args.index("-x265-params") + 1
+        args[index] = f"{args[index]}:pools={limits.threads}"
+        return args
+    return args + ["-x265-params", f"pools={limits.threads}"]
+
+
+class WorkerLayout:
+    # Shares the cores out among max_jobs job slots, so the encoder threads of all running jobs add up to the core budget
+    # instead of every ffmpeg starting a thread per core. With pin, each slot is also held to its own block of
+    # neighbouring cores, which usually share a cache. threads overrides the per-job thread count.
+    def __init__(self, max_jobs, threads=0, pin=False, nice=0, io_class="", memory_limit_mb=0, cpus=None):
+        self.cpus = sorted(cpus) if cpus else available_cpus()
+        self.pin = pin and hasattr(os, "sched_setaffinity")
+        count = len(self.cpus)
+        max_jobs = max(1, max_jobs)
+        if max_jobs <= count:
+            blocks = [self.cpus[i * count // max_jobs:(i + 1) * count // max_jobs] for i in range(max_jobs)]
+        else: #More jobs than cores, they take turns on them
+            blocks = [[self.cpus[i % count]] for i in range(max_jobs)]
+        self.slots = [ProcessLimits(threads or len(block), block if self.pin else (), nice, io_class, memory_limit_mb) for block in blocks]
+
+    def limits(self, slot):
+        return self.slots[slot]
+
+    @property
+    def total_threads(self):
+        return sum(limits.threads for limits in self.slots)
+
+    def describe(self):
+        # Readable summary, one line per slot after the totals
+        lines = [f"{len(self.slots)} job(s), {self.total_threads} encoder threads on {len(self.cpus)} cores"
+                 + (" (oversubscribed)" if self.total_threads > len(self.cpus) else "")]
+        for index, limits in enumerate(self.slots):
+            line = f"Job {index + 1}: {limits.threads} thread(s)"
+            if limits.cpus:
+                line += f", cores {format_cpus(limits.cpus)}"
+            lines.append(line)
+        settings = []
+        if self.slots[0].nice:
+            settings.append(f"nice {self.slots[0].nice}")
+        if self.slots[0].io_class:
+            settings.append(f"ionice {self.slots[0].io_class}" + ("" if tool_path("ionice") else " (ionice not found)"))
+        if self.slots[0].memory_limit_mb:
+            settings.append(f"memory limit {self.slots[0].memory_limit_mb} MB per process" + ("" if tool_path("prlimit") or hasattr(resource, "prlimit") else " (not supported here)"))
+        if settings:
+            lines.append(", ".join(settings))
+        return lines
+
+
+###REMOTE_WORKERS####
+# A worker daemon (WorkerServer) runs encode jobs for dispatchers on other machines, or on the same one in other processes.
+# Messages are JSON objects, one per line, on a TCP or Unix stream socket; file contents follow their message as raw bytes.
+# Every request carries the shared "token" of the daemon, a request without it only gets {"type": "error", "message"}.
+#   dispatcher: {"type": "ping"}                       worker: {"type": "pong", "protocol", "host", "slots", "busy"}
+#   dispatcher: {"type": "encode", "job": {...EncodeJob}, "transfer": "shared" | "stream", "input_size", "watermark_size"}
+#   worker:     {"type": "error", "message"} or {"type": "busy"} and hangs up, or {"type": "accepted"}
+#   dispatcher: [input] [watermark] when streaming
+#   worker:     any number of {"type": "progress", ...ProgressEvent} / {"type": "line", "line"},
+#               then {"type": "result", ..., "output_size"} [output]
+class WorkerUnavailable(OSError):
+    # The worker could not be reached or went away mid-job; the job itself may be fine on another worker
+    pass
+
+
+class WorkerBusy(WorkerUnavailable):
+    # All slots of the worker are taken, e.g. by another dispatcher
+    pass
+
+
+def parse_worker_address(address):
+    # "unix:/run/pkumpress.sock" or a path -> (AF_UNIX, path), "host:port" or "host" -> (AF_INET, (host, port))
+    if address.startswith("unix:") or address.startswith("/"):
+        return socket.AF_UNIX, address[len("unix:"):] if address.startswith("unix:") else address
+    host, _, port = address.rpartition(":") if ":" in address else (address, "", "")
+    return socket.AF_INET, (host or "127.0.0.1", int(port) if port else WORKER_PORT) #Other machines only when a host is asked for
+
+
+def send_message(stream, **message):
+    stream.write((json.dumps(message) + "\n").encode())
+    stream.flush()
+
+
+def read_message(stream):
+    line = stream.readline()
+    if not line:
+        raise WorkerUnavailable("connection closed")
+    return json.loads(line)
+
+
+def safe_name(path, default):
+    # The file name part of a path sent by a dispatcher, never one that leaves the directory it is joined to
+    name = os.path.basename(path or "")
+    return default if name in ("", ".", "..") else name
+
+
+def send_file(stream, path):
+    with open(path, "rb") as f:
+        shutil.copyfileobj(f, stream, RELOCATE_BUFFER_BYTES)
+    stream.flush()
+
+
+def receive_file(stream, path, size):
+    with open(path, "wb") as f:
+        while size > 0:
+            chunk = stream.read(min(size, RELOCATE_BUFFER_BYTES))
+            if not chunk:
+                raise WorkerUnavailable("connection closed during a file transfer")
+            f.write(chunk)
+            size -= len(chunk)
+
+
+class WorkerServer:
+    # The worker daemon: runs encode requests with the local engine, max_jobs (the slots of layout) at a time.
+    # Streamed inputs and outputs live in a private directory under work_dir until the dispatcher has them.
+    # Only requests with token are served, and shared-storage jobs only read and write below one of roots;
+    # without roots the daemon takes streamed jobs only.
+    def __init__(self, address, layout=None, work_dir=None, on_event=None, token="", roots=()):
+        if not token:
+            raise ValueError(f"a worker needs a token (--token or {WORKER_TOKEN_ENV}), anyone who can connect could run jobs otherwise")
+        self.token = token
+        self.roots = [os.path.realpath(root) for root in roots]
+        self.family, self.address = parse_worker_address(address)
+        self.layout = layout or WorkerLayout(default_max_jobs())
+        self.work_dir = work_dir
+        self.on_event = on_event #on_event(name, **fields) for the daemon's own log
+        self.free_slots = list(range(len(self.layout.slots)))
+        self.lock = threading.Lock()
+        self.listener = None
+        self.closed = False
+        self.job_dirs = set()
+        self.cancels = set() #JobCancel of every running job
+
+    def event(self, name, **fields):
+        if self.on_event:
+            self.on_event(name, **fields)
+
+    def start(self):
+        if self.family == socket.AF_UNIX and os.path.exists(self.address):
+            os.remove(self.address) #Left behind by an earlier run
+        self.listener = socket.socket(self.family, socket.SOCK_STREAM)
+        if self.family == socket.AF_INET:
+            self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind(self.address)
+        self.listener.listen()
+        self.address = self.listener.getsockname() #The real port when 0 was asked for
+        self.event("worker_listening", address=self.address if self.family == socket.AF_UNIX else f"{self.address[0]}:{self.address[1]}",
+                   slots=len(self.layout.slots))
+
+    def serve_forever(self):
+        if self.listener is None:
+            self.start()
+        while not self.closed:
+            try:
+                connection, _ = self.listener.accept()
+            except OSError:
+                if self.closed:
+                    break
+                raise
+            threading.Thread(target=self.handle, args=(connection,), daemon=True).start()
+
+    def close(self):
+        self.closed = True
+        if self.listener is not None:
+            self.listener.close()
+            if self.family == socket.AF_UNIX and os.path.exists(self.address):
+                os.remove(self.address)
+        with self.lock:
+            job_dirs, self.job_dirs = self.job_dirs, set()
+            cancels = list(self.cancels)
+        for cancel in cancels: #No ffmpeg outlives the daemon
+            cancel.cancel()
+        for job_dir in job_dirs: #Streamed jobs still running when the daemon stops never get to clean up themselves
+            shutil.rmtree(job_dir, ignore_errors=True)
+
+    def check_request(self, request):
+        # The EncodeJob of an encode request, or raises ValueError with the reason it is refused
+        if not hmac.compare_digest(str(request.get("token", "")).encode(), self.token.encode()):
+            raise ValueError("wrong token")
+        if request.get("type") != "encode":
+            return None
+        settings = request.get("job")
+        if not isinstance(settings, dict) or not settings.get("file_path") or not settings.get("output_path"):
+            raise ValueError("the job needs file_path and output_path")
+        if not all(isinstance(settings.get(key, ""), str) for key in ("file_path", "output_path", "watermark_path")):
+            raise ValueError("paths must be strings")
+        unknown = set(settings) - set(inspect.signature(EncodeJob).parameters)
+        if unknown:
+            raise ValueError(f"unknown job settings: {', '.join(sorted(unknown))}")
+        if request.get("transfer") == "stream":
+            for size in ("input_size", "watermark_size"):
+                if not isinstance(request.get(size, 0), int) or request.get(size, 0) < 0:
+                    raise ValueError(f"bad {size}")
+        elif request.get("transfer") == "shared":
+            if not self.roots:
+                raise ValueError("this worker only takes streamed jobs (start it with --root to share paths)")
+            for path in (settings["file_path"], settings.get("output_path"), settings.get("watermark_path")):
+                if path and not self.in_roots(path):
+                    raise ValueError(f"{path} is outside the directories this worker may use")
+        else:
+            raise ValueError(f"unknown transfer {request.get('transfer')!r}")
+        try:
+            return EncodeJob(**settings)
+        except (TypeError, ValueError, KeyError) as e:
+            raise ValueError(f"bad job settings: {e}") from e
+
+    def in_roots(self, path):
+        path = os.path.realpath(path)
+        return any(os.path.commonpath([root, path]) == root for root in self.roots)
+
+    def handle(self, connection):
+        try:
+            with connection, connection.makefile("rb") as reader, connection.makefile("wb") as writer:
+                request = read_message(reader)
+                if not isinstance(request, dict):
+                    raise ValueError("requests are JSON objects")
+                try:
+                    job = self.check_request(request)
+                except ValueError as e:
+                    send_message(writer, type="error", message=str(e))
+                    self.event("worker_refused", request=request.get("type"), message=str(e))
+                    return
+                if request.get("type") == "ping":
+                    with self.lock:
+                        busy = len(self.layout.slots) - len(self.free_slots)
+                    send_message(writer, type="pong", protocol=WORKER_PROTOCOL, host=socket.gethostname(), slots=len(self.layout.slots), busy=busy)
+                elif request.get("type") == "encode":
+                    with self.lock:
+                        slot = self.free_slots.pop(0) if self.free_slots else None
+                    if slot is None:
+                        send_message(writer, type="busy")
+                        return
+                    try:
+                        send_message(writer, type="accepted")
+                        self.encode(job, request, reader, writer, slot)
+                    finally:
+                        with self.lock:
+                            self.free_slots.append(slot)
+        except (OSError, ValueError, TypeError, KeyError) as e: #A dispatcher that went away or sent garbage only ends its own connection
+            self.event("worker_error", message=str(e))
+
+    def encode(self, job, request, reader, writer, slot):
+        streamed = request.get("transfer") == "stream"
+        job_dir = tempfile.mkdtemp(prefix="pkumpress_worker_", dir=self.work_dir) if streamed else None
+        if job_dir:
+            with self.lock:
+                self.job_dirs.add(job_dir)
+        send_lock = threading.Lock()
+        cancel = JobCancel() #The dispatcher has retried the job elsewhere once it hung up, so its ffmpeg is stopped
+        finished = threading.Event()
+        with self.lock:
+            self.cancels.add(cancel)
+
+        def send(**message):
+            if cancel.cancelled:
+                return
+            try:
+                with send_lock:
+                    send_message(writer, **message)
+            except OSError:
+                cancel.cancel()
+
+        def watch_dispatcher():
+            # Nothing is sent to us after the inputs, so the read only returns once the dispatcher hangs up
+            try:
+                reader.read(1)
+            except (OSError, ValueError):
+                pass
+            if not finished.is_set():
+                cancel.cancel()
+
+        try:
+            if streamed:
+                job.file_path = os.path.join(job_dir, safe_name(job.file_path, "input"))
+                receive_file(reader, job.file_path, request["input_size"])
+                if job.watermark_path:
+                    job.watermark_path = os.path.join(job_dir, "watermark" + os.path.splitext(safe_name(job.watermark_path, ""))[1])
+                    receive_file(reader, job.watermark_path, request["watermark_size"])
+                job.output_path = os.path.join(job_dir, safe_name(request["job"]["output_path"], "output.mp4"))
+            self.event("job_start", input=request["job"]["file_path"], output=request["job"]["output_path"], slot=slot)
+            threading.Thread(target=watch_dispatcher, daemon=True).start()
+            result = run_encode_safe(job, lambda event: send(type="progress", **event.as_dict()),
+                                     lambda line: send(type="line", line=line), self.layout.limits(slot), cancel)
+            finished.set()
+            usage = result.usage or ResourceUsage()
+            output_size = _file_size(job.output_path) if streamed and result.ok and result.action in ("encoded", "remuxed", "cached") else 0
+            send(type="result", return_code=result.return_code, error_message=result.error_message, action=result.action,
+                 reason=result.reason, wall_time=result.wall_time, relocate_time=result.relocate_time, crf_value=job.crf_value,
+                 usage=dict(user_time=usage.user_time, system_time=usage.system_time, peak_rss_kb=usage.peak_rss_kb, processes=usage.processes),
+                 output_size=output_size)
+            if output_size and not cancel.cancelled:
+                with send_lock:
+                    send_file(writer, job.output_path)
+            self.event("job_finished", input=request["job"]["file_path"], exit_code=result.return_code, error=result.error_message,
+                       wall_time=round(result.wall_time, 3), delivered=not cancel.cancelled)
+        finally:
+            finished.set()
+            with self.lock:
+                self.cancels.discard(cancel)
+            if job_dir:
+                with self.lock:
+                    self.job_dirs.discard(job_dir)
+                shutil.rmtree(job_dir, ignore_errors=True)
+
+
+class RemoteWorker:
+    # The dispatcher's handle on one worker daemon
+    def __init__(self, address, transfer="shared", timeout=WORKER_TIMEOUT, token=""):
+        self.address = address
+        self.transfer = transfer
+        self.timeout = timeout
+        self.token = token
+        self.healthy = False
+        self.slots = 0
+        self.busy = 0
+        self.host = ""
+        self.last_error = "not checked yet"
+
+    def connect(self):
+        family, address = parse_worker_address(self.address)
+        if family == socket.AF_INET and address[0] == "0.0.0.0":
+            address = ("127.0.0.1", address[1])
+        connection = socket.socket(family, socket.SOCK_STREAM)
+        connection.settimeout(self.timeout)
+        try:
+            connection.connect(address)
+        except OSError:
+            connection.close()
+            raise
+        return connection
+
+    def mark_down(self, error):
+        self.healthy = False
+        self.last_error = error
+
+    def ping(self):
+        try:
+            with self.connect() as connection, connection.makefile("rb") as reader, connection.makefile("wb") as writer:
+                send_message(writer, type="ping", token=self.token)
+                reply = read_message(reader)
+            if reply.get("type") == "error":
+                raise ValueError(f"refused: {reply.get('message')}")
+            if reply.get("protocol") != WORKER_PROTOCOL:
+                raise ValueError(f"speaks protocol {reply.get('protocol')}, we speak {WORKER_PROTOCOL}")
+            self.slots, self.busy, self.host = reply["slots"], reply["busy"], reply["host"]
+            self.healthy, self.last_error = True, ""
+        except (OSError, ValueError, KeyError) as e:
+            self.mark_down(str(e))
+        return self.healthy
+
+    def encode(self, job, on_progress=None, on_line=None):
+        # Runs job on the worker and returns its EncodeResult. Raises WorkerUnavailable (WorkerBusy) if the worker
+        # cannot be reached, is full or goes away, so the job can go to another one; ffmpeg failures come back in the result.
+        streamed = self.transfer == "stream"
+        partial_tag = f"{safe_name(self.host, 'worker')}-{os.urandom(4).hex()}" #A retry never shares partial files with an attempt still running
+        request = dict(type="encode", token=self.token, job=dict(job.as_dict(), partial_tag=partial_tag), transfer=self.transfer)
+        try:
+            if streamed:
+                request["input_size"] = os.path.getsize(job.file_path)
+                request["watermark_size"] = os.path.getsize(job.watermark_path) if job.watermark_path else 0
+        except OSError as e: #Our own input is missing, no worker would do better
+            return EncodeResult(job, -1, str(e))
+        try:
+            with self.connect() as connection, connection.makefile("rb") as reader, connection.makefile("wb") as writer:
+                connection.settimeout(None) #An auto CRF search can be quiet for a long time, keepalive notices a dead peer
+                connection.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+                send_message(writer, **request)
+                reply = read_message(reader)
+                if reply["type"] == "busy":
+                    raise WorkerBusy(f"all {self.slots} slots are taken")
+                if reply["type"] == "error": #Settings or paths this worker will not take, another one would most likely say the same
+                    return EncodeResult(job, -1, f"Worker {self.address} refused the job: {reply.get('message')}")
+                if streamed:
+                    send_file(writer, job.file_path)
+                    if job.watermark_path:
+                        send_file(writer, job.watermark_path)
+                while True:
+                    reply = read_message(reader)
+                    if reply["type"] == "progress":
+                        if on_progress:
+                            on_progress(ProgressEvent(**{key: value for key, value in reply.items() if key != "type"}))
+                    elif reply["type"] == "line":
+                        if on_line:
+                            on_line(reply["line"])
+                    elif reply["type"] == "result":
+                        break
+                if streamed and reply["output_size"]:
+                    partial_path = partial_output_path(job.output_path, partial_tag)
+                    try:
+                        receive_file(reader, partial_path, reply["output_size"])
+                        commit_output(partial_path, job.output_path)
+                    finally:
+                        remove_partial_output(job.output_path, partial_tag)
+        except WorkerUnavailable:
+            raise
+        except (OSError, ValueError, KeyError) as e:
+            raise WorkerUnavailable(str(e)) from e
+        job.crf_value = reply.get("crf_value", job.crf_value) #Auto CRF picks it on the worker
+        usage = ResourceUsage()
+        for key, value in reply.get("usage", {}).items():
+            setattr(usage, key, value)
+        return EncodeResult(job, reply["return_code"], reply["error_message"], reply["wall_time"], reply["action"], reply["reason"],
+                            usage, reply.get("relocate_time", 0.0))
+
+    def status(self):
+        if not self.healthy:
+            return f"{self.address}: down ({self.last_error})"
+        return f"{self.address}: {self.host}, {self.busy}/{self.slots} slots busy"
+
+
+class WorkerPool:
+    # The remote workers a dispatcher spreads its queue over. They are pinged when the pool is created and then
+    # every health_seconds in the background; a worker that fails a job is marked down until it answers again.
+    def __init__(self, addresses, transfer="shared", retries=WORKER_RETRIES, health_seconds=WORKER_HEALTH_SECONDS, token=""):
+        self.workers = [RemoteWorker(address, transfer, token=token) for address in addresses]
+        self.retries = retries
+        self.stopped = threading.Event()
+        self.check()
+        self.health_thread = threading.Thread(target=self.run_health_checks, args=(health_seconds,), daemon=True)
+        self.health_thread.start()
+
+    def check(self):
+        run_threads(lambda index: self.workers[index].ping(), len(self.workers))
+
+    def run_health_checks(self, health_seconds):
+        while not self.stopped.wait(health_seconds):
+            self.check()
+
+    def close(self):
+        self.stopped.set()
+
+
+###PROFILES####
+def profile_path(name):
+    return os.path.join(PROFILES_DIR, f"{name}.json")
+
+
+def list_profiles():
+    if not os.path.isdir(PROFILES_DIR):
+        return []
+    return sorted(os.path.splitext(filename)[0] for filename in os.listdir(PROFILES_DIR) if filename.endswith(".json"))
+
+
+def save_profile(name, settings):
+    # settings are EncodeJob keyword arguments without file_path/output_path
+    settings = {key: value for key, value in EncodeJob("", **settings).as_dict().items() if key not in ("file_path", "output_path", "partial_tag")}
+    os.makedirs(PROFILES_DIR, exist_ok=True)
+    temp_path = profile_path(name) + ".tmp"
+    with open(temp_path, "w") as f:
+        json.dump(settings, f, indent=2)
+    os.replace(temp_path, profile_path(name))
+    return settings
+
+
+def load_profile(name):
+    with open(profile_path(name)) as f:
+        settings = json.load(f)
+    try:
+        EncodeJob("", **settings) #Refuse profiles with unknown keys before they reach a batch
+    except TypeError as e:
+        raise ValueError(f"Invalid profile {name!r}: {e}")
+    return settings
+
+
+###WATCH_FOLDER####
+def is_watch_candidate(path):
+    # Cheap name check while a file is still arriving; its content is sniffed once it is stable
+    name = os.path.basename(path)
+    if _matches(DEFAULT_EXCLUDES, name, name): #Never pick up our own outputs
+        return False
+    return os.path.splitext(name)[1].lower() not in NON_VIDEO_EXTENSIONS
+
+
+class Inotify:
+    # Minimal ctypes binding, only used to learn about new files sooner than the next poll
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_Q_OVERFLOW = 0x00004000
+    IN_ISDIR = 0x40000000
+    EVENT_HEADER = struct.Struct("iIII") #wd, mask, cookie, name length
+
+    def __init__(self):
+        import ctypes
+        import ctypes.util
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.paths = {} #watch descriptor -> directory
+
+    def add_watch(self, directory):
+        import ctypes
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_CREATE)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {directory}")
+        self.paths[wd] = directory
+
+    def read(self, timeout):
+        # Returns [(path, mask)], waits at most timeout seconds
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return []
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset + self.EVENT_HEADER.size <= len(data):
+            wd, mask, _, length = self.EVENT_HEADER.unpack_from(data, offset)
+            offset += self.EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b"\0")
+            offset += length
+            directory = self.paths.get(wd)
+            if directory is not None or mask & self.IN_Q_OVERFLOW:
+                events.append((os.path.join(directory, os.fsdecode(name)) if directory else "", mask))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class FolderWatcher:
+    # Finds video files appearing in the watched directories and hands each one out once it stopped growing.
+    # inotify (Linux) reports new files immediately; otherwise, and as a safety net, the directories are rescanned.
+    def __init__(self, directories, recursive=False, stable_seconds=WATCH_STABLE_SECONDS, poll_seconds=WATCH_POLL_SECONDS,
+                 use_inotify=True):
+        self.directories = [os.path.abspath(directory) for directory in directories]
+        self.recursive = recursive
+        self.stable_seconds = stable_seconds
+        self.poll_seconds = poll_seconds
+        self.candidates = {} #path -> (size, mtime_ns, unchanged since)
+        self.handed_out = {} #path -> (size, mtime_ns) already returned by poll()
+        self.last_scan = None
+        self.inotify = None
+        self.inotify_error = "" #Why inotify could not be used and the directories are polled instead, for the caller to report
+        if use_inotify and sys.platform.startswith("linux"):
+            try:
+                self.inotify = Inotify()
+                for directory in self.walk_directories():
+                    self.inotify.add_watch(directory)
+            except OSError as e: #Out of watches, or a filesystem without inotify (NFS, SMB)
+                self.inotify_error = str(e)
+                if self.inotify:
+                    self.inotify.close()
+                self.inotify = None
+
+    @property
+    def mode(self):
+        return "inotify" if self.inotify else "polling"
+
+    def walk_directories(self):
+        for top in self.directories:
+            if not os.path.isdir(top):
+                continue
+            yield top
+            if self.recursive:
+                for root, dirs, _ in os.walk(top):
+                    dirs[:] = [d for d in dirs if not d.startswith(".")] #Skips our own segment/pass work dirs
+                    for d in dirs:
+                        yield os.path.join(root, d)
+
+    def scan(self):
+        for directory in self.walk_directories():
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        if entry.is_file() and is_watch_candidate(entry.path):
+                            self.consider(entry.path)
+            except OSError:
+                continue
+        self.last_scan = time.monotonic()
+
+    def consider(self, path):
+        if path not in self.candidates:
+            self.candidates[path] = (-1, -1, time.monotonic())
+
+    def poll(self, timeout=1.0):
+        # Returns the paths that became stable since the last call
+        if self.inotify:
+            for path, mask in self.inotify.read(timeout):
+                if mask & Inotify.IN_Q_OVERFLOW:
+                    self.last_scan = None
+                elif mask & Inotify.IN_ISDIR:
+                    if self.recursive and not os.path.basename(path).startswith("."):
+                        try:
+                            self.inotify.add_watch(path)
+                        except OSError:
+                            pass
+                        self.last_scan = None #Files may have landed before the watch existed
+                elif is_watch_candidate(path):
+                    self.consider(path)
+            rescan_after = WATCH_RESCAN_SECONDS
+        else:
+            time.sleep(timeout)
+            rescan_after = self.poll_seconds
+        if self.last_scan is None or time.monotonic() - self.last_scan >= rescan_after:
+            self.scan()
+        return self.check_candidates()
+
+    def check_candidates(self):
+        now = time.monotonic()
+        ready = []
+        for path, (size, mtime_ns, since) in list(self.candidates.items()):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                del self.candidates[path] #Deleted or moved away before it settled
+                continue
+            version = (stat.st_size, stat.st_mtime_ns)
+            if self.handed_out.get(path) == version:
+                del self.candidates[path]
+            elif version != (size, mtime_ns):
+                self.candidates[path] = (stat.st_size, stat.st_mtime_ns, now)
+            elif stat.st_size > 0 and now - since >= self.stable_seconds:
+                del self.candidates[path]
+                self.handed_out[path] = version
+                if sniff_container(path) is not None:
+                    ready.append(path)
+        return ready
+
+    def close(self):
+        if self.inotify:
+            self.inotify.close()
+            self.inotify = None
@@ -0,0 +1,491 @@
+# Headless front end for the compression engine, e.g.
+#   python pkumpress.py compress --crf 23 --codec libx265 --preset slow --jobs 8 DIR
+#   python pkumpress.py resume          (jobs of a batch that was cut short by a crash or reboot)
+#   python pkumpress.py watch --profile office --output-dir OUT INBOX
+#   python pkumpress.py cache stats     (results reused instead of encoding the same input again)
+#   PKUMPRESS_WORKER_TOKEN=secret python pkumpress.py worker --listen 0.0.0.0:8765 --root /mnt/media --jobs 2      (on each encode box)
+#   PKUMPRESS_WORKER_TOKEN=secret python pkumpress.py compress --worker box1:8765 --worker box2:8765 --jobs 0 DIR      (spread the batch over them)
+# Every event is printed to stdout as one JSON object per line; ffmpeg's own log goes to stderr with --verbose.
+# Each finished job is also appended to ~/.pkumpress/metrics.jsonl (--metrics), and --metrics-textfile keeps node-exporter totals.
+# The cores are split among the --jobs slots (--threads, --pin-cpus), and --nice/--ionice/--memory-limit keep ffmpeg out of other services' way.
+import argparse
+import json
+import os
+import signal
+import sys
+import threading
+import time
+
+from engine import (DEFAULT_CRF_VALUES, PRESETS, VIDEO_CODECS,
+        SEGMENT_MIN_DURATION, QUALITY_FLOORS, PREFLIGHT_CODECS, PREFLIGHT_MAX_BPP, JOURNAL_PATH, JobJournal,
+        PRIORITY_LANES, QUEUE_ORDERS, WATCH_STABLE_SECONDS, WATCH_POLL_SECONDS, DEFAULT_EXCLUDES,
+        default_max_jobs, find_videos, plan_jobs, make_output_path, run_batch,
+        JobRunner, FolderWatcher, load_profile, save_profile, CACHE_DIR, ResultCache, METRICS_PATH, MetricsRecorder,
+        NICE_LEVELS, IO_CLASSES, WorkerLayout, MP4_LAYOUTS, AUDIO_MODES,
+        WORKER_PORT, WORKER_RETRIES, TRANSFERS, WORKER_TOKEN_ENV, WorkerServer, WorkerPool)
+
+
+_print_lock = threading.Lock()
+
+
+def emit(event, **fields):
+    fields = dict(event=event, time=round(time.time(), 3), **fields)
+    with _print_lock:
+        sys.stdout.write(json.dumps(fields) + "\n")
+        sys.stdout.flush()
+
+
+def metrics_recorder(args):
+    if args.no_metrics or not (args.metrics or args.metrics_textfile):
+        return None
+    return MetricsRecorder(args.metrics or "", args.metrics_textfile or "")
+
+
+def record_metrics(recorder, result):
+    # A full disk or a bad textfile path must not stop the batch
+    if recorder is None:
+        return
+    try:
+        recorder.record(result)
+    except OSError as e:
+        emit("error", message=f"Could not record the job metrics: {e}")
+
+
+def worker_layout(args, max_jobs):
+    if max_jobs == 0: #Remote workers only
+        return None
+    layout = WorkerLayout(max_jobs, args.threads, args.pin_cpus, NICE_LEVELS[args.nice], args.ionice or "", args.memory_limit)
+    emit("worker_layout", cores=len(layout.cpus), threads=layout.total_threads, slots=[limits.as_dict() for limits in layout.slots])
+    return layout
+
+
+def worker_pool(args):
+    if not args.worker:
+        return None
+    pool = WorkerPool(args.worker, args.transfer, args.retries, token=args.worker_token)
+    emit("workers", workers=[dict(address=worker.address, healthy=worker.healthy, host=worker.host, slots=worker.slots,
+                                  error=worker.last_error) for worker in pool.workers])
+    return pool
+
+
+def codec_name(value):
+    # Accept the GUI display names too ("Codec-265")
+    codec = VIDEO_CODECS.get(value, value)
+    if codec not in VIDEO_CODECS.values():
+        raise argparse.ArgumentTypeError(f"unknown codec {value!r}, choose from {', '.join(VIDEO_CODECS.values())}")
+    return codec
+
+
+def encoding_settings(args):
+    # EncodeJob keyword arguments from the encoding flags, the same shape a saved profile has
+    auto_crf = args.auto_crf or args.level == "Auto"
+    level = "Auto" if auto_crf else args.level #Same output naming as the GUI's Auto level
+    crf_value = args.crf if args.crf is not None else DEFAULT_CRF_VALUES.get(level, DEFAULT_CRF_VALUES["Medium"])[0]
+    return dict(crf_value=crf_value, compression_level=level, video_codec=args.codec, watermark_path=args.watermark or "",
+                x=args.watermark_x, y=args.watermark_y, preset=args.preset,
+                segments=args.segments, segment_min_duration=args.segment_min_duration,
+                target_size_mb=args.target_size or 0, target_bitrate_kbps=args.target_bitrate or 0,
+                auto_crf=auto_crf, quality_metric=args.quality_metric, quality_floor=args.quality_floor,
+                preflight=args.preflight, preflight_codecs=args.preflight_codecs.split(","),
+                preflight_max_bpp=args.preflight_max_bpp, preflight_min_size_mb=args.preflight_min_size,
+                priority=PRIORITY_LANES[args.priority], output_dir=os.path.abspath(args.output_dir) if args.output_dir else "",
+                use_cache=not args.no_cache, mp4_layout=args.mp4_layout, keyframe_interval=args.keyframe_interval,
+                audio_mode=args.audio)
+
+
+def compress_command(args):
+    settings = encoding_settings(args)
+    if args.save_profile:
+        save_profile(args.save_profile, settings)
+    discovery = dict(recursive=args.recursive, include=args.include or (), max_depth=args.max_depth,
+                     exclude=DEFAULT_EXCLUDES if args.exclude is None else args.exclude)
+    urgent = find_videos(args.high_priority or [], **discovery)
+    files = find_videos(args.paths, **discovery) + urgent
+    if not files:
+        emit("error", message="No video files found")
+        return 2
+
+    if settings["output_dir"]:
+        os.makedirs(settings["output_dir"], exist_ok=True)
+    jobs = plan_jobs(files, **settings)
+    for job in jobs:
+        if job.file_path in urgent:
+            job.priority = PRIORITY_LANES["High"]
+    journal = None if args.no_journal else JobJournal(args.journal)
+    row_ids = journal.add_jobs(jobs) if journal else None
+    emit("batch_start", jobs=len(jobs), max_jobs=args.jobs, order=args.order,
+         crf=settings["crf_value"], codec=args.codec, preset=args.preset)
+    return run_jobs(jobs, args, journal, row_ids)
+
+
+def watch_command(args):
+    if args.profile:
+        try:
+            settings = load_profile(args.profile)
+        except (OSError, ValueError) as e:
+            emit("error", message=f"Cannot load profile {args.profile!r}: {e}")
+            return 2
+    else:
+        settings = encoding_settings(args)
+    if args.save_profile:
+        save_profile(args.save_profile, settings)
+    if args.output_dir: #--output-dir also applies on top of a profile
+        settings["output_dir"] = os.path.abspath(args.output_dir)
+    if args.no_cache:
+        settings["use_cache"] = False
+    if settings.get("output_dir"):
+        os.makedirs(settings["output_dir"], exist_ok=True)
+
+    journal = JobJournal(args.journal)
+    metrics = metrics_recorder(args)
+    watcher = FolderWatcher(args.paths, args.recursive, args.stable_seconds, args.poll_seconds, not args.no_inotify)
+    reserved = set() #Output names of jobs that have not finished yet
+    reserved_lock = threading.Lock()
+    job_rows = {} #EncodeJob -> journal row id
+
+    def on_start(job_id, job):
+        journal.mark_running(job_rows[job], job.output_path)
+        emit("job_start", job=job_id, input=job.file_path, output=job.output_path, priority=job.priority)
+
+    def on_progress(job_id, progress):
+        emit("progress", job=job_id, **progress.as_dict())
+
+    def on_line(job_id, line):
+        if args.verbose:
+            with _print_lock:
+                sys.stderr.write(f"[{job_id}] {line}\n")
+
+    def on_finished(job_id, result):
+        journal.mark_finished(job_rows[result.job], result)
+        record_metrics(metrics, result)
+        with reserved_lock:
+            reserved.discard(result.job.output_path)
+        emit("job_finished", job=job_id, input=result.job.file_path, output=result.job.output_path,
+             crf=result.job.crf_value, action=result.action, reason=result.reason,
+             exit_code=result.return_code, error=result.error_message,
+             wall_time=round(result.wall_time, 3), relocate_time=round(result.relocate_time, 3))
+
+    pool = worker_pool(args)
+    runner = JobRunner(args.jobs, args.order, on_start, on_progress, on_line, on_finished, worker_layout(args, args.jobs), pool)
+    emit("watch_start", paths=watcher.directories, mode=watcher.mode, recursive=args.recursive,
+         output_dir=settings.get("output_dir", ""), profile=args.profile or "", max_jobs=args.jobs)
+    if watcher.inotify_error:
+        emit("watch_polling", poll_seconds=args.poll_seconds, message=f"inotify unavailable: {watcher.inotify_error}")
+    entries = journal.interrupted(watched_only=True) #What a previous watcher was killed in the middle of
+    if entries:
+        for path in journal.clean_partial_outputs(entries):
+            emit("partial_removed", path=path)
+        jobs = [job for _, job in entries]
+        with reserved_lock:
+            resumed_output_paths(jobs, reserved)
+        job_rows.update((job, row_id) for row_id, job in entries)
+        for job in jobs:
+            emit("job_queued", input=job.file_path, output=job.output_path, resumed=True)
+        runner.submit(jobs)
+    try:
+        while True:
+            new_files = {}
+            for path in watcher.poll(1.0):
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                if not journal.watched_claimed(path, stat.st_size, stat.st_mtime_ns):
+                    new_files[path] = (stat.st_size, stat.st_mtime_ns)
+            if new_files:
+                with reserved_lock:
+                    jobs = plan_jobs(list(new_files), reserved=reserved, **settings)
+                row_ids = journal.add_jobs(jobs, [new_files[job.file_path] for job in jobs])
+                claimed = []
+                for job, row_id in zip(jobs, row_ids):
+                    if row_id is None: #Another watcher queued it first
+                        with reserved_lock:
+                            reserved.discard(job.output_path)
+                        continue
+                    job_rows[job] = row_id
+                    claimed.append(job)
+                    emit("job_queued", input=job.file_path, output=job.output_path)
+                runner.submit(claimed)
+            if args.once and watcher.last_scan is not None and not watcher.candidates and not runner.busy():
+                break
+    except KeyboardInterrupt:
+        emit("watch_stopped", reason="interrupted")
+        return 130 #Running jobs stay "running" in the journal, the next watch (or resume) takes them back
+    finally:
+        watcher.close()
+    runner.close()
+    if pool is not None:
+        pool.close()
+    emit("watch_stopped", reason="idle")
+    failed = sum(1 for result in runner.results.values() if not result.ok)
+    return 1 if failed else 0
+
+
+def resumed_output_paths(jobs, reserved):
+    # Interrupted jobs keep their output name unless it was taken in the meantime; reserved gains every name used
+    reserved.update(job.output_path for job in jobs if job.output_path)
+    for job in jobs:
+        if not job.output_path or os.path.exists(job.output_path):
+            job.output_path = make_output_path(job.file_path, job.compression_level, reserved)
+            reserved.add(job.output_path)
+
+
+def resume_command(args):
+    journal = JobJournal(args.journal)
+    entries = journal.interrupted()
+    for path in journal.clean_partial_outputs(entries):
+        emit("partial_removed", path=path)
+    if args.discard:
+        journal.cancel([row_id for row_id, _ in entries])
+        emit("batch_discarded", jobs=len(entries))
+        return 0
+    if not entries:
+        emit("error", message="No interrupted jobs in the journal")
+        return 2
+
+    row_ids = [row_id for row_id, _ in entries]
+    jobs = [job for _, job in entries]
+    resumed_output_paths(jobs, set())
+    emit("batch_start", jobs=len(jobs), max_jobs=args.jobs, order=args.order, resumed=True)
+    return run_jobs(jobs, args, journal, row_ids)
+
+
+def worker_interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+
+def worker_command(args):
+    try:
+        server = WorkerServer(args.listen, worker_layout(args, max(1, args.jobs)), args.work_dir, emit, args.token, args.root or ())
+    except ValueError as e:
+        emit("error", message=str(e))
+        return 2
+    signal.signal(signal.SIGTERM, worker_interrupt) #A service manager stopping the daemon should clean up like Ctrl+C does
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        emit("worker_stopped", reason="interrupted")
+    finally:
+        server.close()
+    return 0
+
+
+def cache_command(args):
+    cache = ResultCache(args.cache_dir)
+    if args.action == "limit":
+        if args.megabytes is None:
+            emit("error", message="cache limit needs the new size in MB")
+            return 2
+        emit("cache_evicted", entries=cache.set_limit(args.megabytes * 1024 * 1024))
+    elif args.action == "list":
+        for key, size, source, settings, created_at, last_used, hits in cache.entries():
+            emit("cache_entry", key=key, size=size, source=source, crf=settings.get("crf_value"), codec=settings.get("video_codec"),
+                 preset=settings.get("preset"), created_at=round(created_at, 3), last_used=round(last_used, 3), hits=hits)
+    elif args.action == "purge":
+        if not (args.keys or args.all or args.older_than_days is not None):
+            emit("error", message="cache purge needs keys, --all or --older-than-days")
+            return 2
+        if args.keys:
+            removed = cache.purge(args.keys)
+        else:
+            removed = cache.purge(older_than_days=None if args.all else args.older_than_days)
+        emit("cache_purged", entries=removed)
+    emit("cache_stats", path=cache.directory, **cache.stats())
+    cache.close()
+    return 0
+
+
+def run_jobs(jobs, args, journal=None, row_ids=None):
+    job_progress = [0] * len(jobs)
+    metrics = metrics_recorder(args)
+
+    def on_start(job_id, job):
+        if journal:
+            journal.mark_running(row_ids[job_id], job.output_path)
+        emit("job_start", job=job_id, input=job.file_path, output=job.output_path, priority=job.priority)
+
+    def on_progress(job_id, progress):
+        job_progress[job_id] = progress.percent
+        emit("progress", job=job_id, batch_percent=sum(job_progress) // len(job_progress), **progress.as_dict())
+
+    def on_line(job_id, line):
+        if args.verbose:
+            with _print_lock:
+                sys.stderr.write(f"[{job_id}] {line}\n")
+
+    def on_finished(job_id, result):
+        job_progress[job_id] = 100
+        if journal:
+            journal.mark_finished(row_ids[job_id], result)
+        record_metrics(metrics, result)
+        emit("job_finished", job=job_id, input=result.job.file_path, output=result.job.output_path,
+             crf=result.job.crf_value, action=result.action, reason=result.reason,
+             exit_code=result.return_code, error=result.error_message,
+             wall_time=round(result.wall_time, 3), relocate_time=round(result.relocate_time, 3))
+
+    pool = worker_pool(args)
+    results = run_batch(jobs, args.jobs, on_start, on_progress, on_line, on_finished, args.order,
+                        worker_layout(args, min(args.jobs, len(jobs))), pool)
+    if pool is not None:
+        pool.close()
+    failed = [result for result in results if not result.ok]
+    actions = {}
+    for result in results:
+        if result.ok:
+            actions[result.action] = actions.get(result.action, 0) + 1
+    emit("batch_finished", jobs=len(results), failed=len(failed), actions=actions,
+         not_encoded=[dict(input=result.job.file_path, action=result.action, reason=result.reason)
+                      for result in results if result.ok and result.action != "encoded"])
+    return 1 if failed else 0
+
+
+def add_encoding_arguments(parser):
+    parser.add_argument("--level", choices=list(DEFAULT_CRF_VALUES) + ["Auto"], default="Low",
+                        help="compression level, used for the output name and the default CRF")
+    rate_control = parser.add_mutually_exclusive_group()
+    rate_control.add_argument("--crf", type=int, help="CRF value (default: the first value of --level)")
+    rate_control.add_argument("--target-size", type=float, metavar="MB",
+                              help="two-pass encode sized to this many MiB, audio included")
+    rate_control.add_argument("--target-bitrate", type=int, metavar="KBPS",
+                              help="two-pass encode at this average bitrate, audio included")
+    rate_control.add_argument("--auto-crf", action="store_true",
+                              help="pick the highest CRF whose sample encodes meet --quality-floor")
+    parser.add_argument("--quality-metric", choices=list(QUALITY_FLOORS), default="ssim", help="metric used by --auto-crf")
+    parser.add_argument("--quality-floor", type=float, help="minimum score for --auto-crf (default depends on the metric)")
+    parser.add_argument("--codec", type=codec_name, default="libx264", help="libx264 or libx265")
+    parser.add_argument("--preset", choices=PRESETS, default="medium")
+    parser.add_argument("--jobs", type=int, default=default_max_jobs(), help="concurrent ffmpeg processes")
+    parser.add_argument("--order", choices=QUEUE_ORDERS, default="sjf",
+                        help="start the shortest estimated jobs first (duration x resolution x preset) or keep the given order")
+    parser.add_argument("--priority", choices=list(PRIORITY_LANES), default="Normal", help="queue lane of the positional paths")
+    parser.add_argument("--audio", choices=AUDIO_MODES, default="auto",
+                        help="auto copies audio tracks mp4 can hold at a modest bitrate and re-encodes the rest to AAC, transcode re-encodes every track")
+    parser.add_argument("--watermark", help="watermark image overlaid on every output")
+    parser.add_argument("--watermark-x", type=int, default=10, help="watermark x position in video pixels")
+    parser.add_argument("--watermark-y", type=int, default=10, help="watermark y position in video pixels")
+    parser.add_argument("--segments", type=int, default=1,
+                        help="split long inputs at keyframes into this many segments encoded concurrently")
+    parser.add_argument("--segment-min-duration", type=float, default=SEGMENT_MIN_DURATION,
+                        help="only split inputs at least this many seconds long")
+    parser.add_argument("--preflight", action="store_true",
+                        help="skip or remux inputs that are already efficient, keep the original when the encode is larger")
+    parser.add_argument("--preflight-codecs", default=",".join(PREFLIGHT_CODECS),
+                        help="comma separated source codecs eligible for skip/remux")
+    parser.add_argument("--preflight-max-bpp", type=float, default=PREFLIGHT_MAX_BPP,
+                        help="bits per pixel per frame at or below which an eligible source is not re-encoded")
+    parser.add_argument("--preflight-min-size", type=float, default=0, metavar="MB",
+                        help="skip inputs smaller than this")
+    parser.add_argument("--output-dir", help="write the compressed files here instead of next to their source")
+    parser.add_argument("--mp4-layout", choices=MP4_LAYOUTS, default="standard",
+                        help="faststart moves the index to the front so playback starts while downloading, fragmented suits progressive streaming")
+    parser.add_argument("--keyframe-interval", type=float, default=0, metavar="SECONDS",
+                        help="GOP length, e.g. 2 for streaming (default: left to the encoder)")
+    parser.add_argument("--save-profile", metavar="NAME", help="also store these settings as a profile for watch --profile")
+    parser.add_argument("--journal", default=JOURNAL_PATH, help="SQLite job journal used by the resume command")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="always encode, even when an earlier run compressed the same input with the same settings")
+    add_resource_arguments(parser)
+    add_dispatch_arguments(parser)
+    add_metrics_arguments(parser)
+    parser.add_argument("-v", "--verbose", action="store_true", help="print ffmpeg's log to stderr")
+
+
+def add_dispatch_arguments(parser):
+    parser.add_argument("--worker", action="append", metavar="ADDRESS",
+                        help="worker daemon (host:port or unix:/path) that also takes jobs from the queue (repeatable); "
+                             "--jobs 0 leaves all encoding to the workers")
+    parser.add_argument("--transfer", choices=TRANSFERS, default="shared",
+                        help="shared: workers open the input and output paths themselves (same mounts), stream: files go over the connection")
+    parser.add_argument("--retries", type=int, default=WORKER_RETRIES,
+                        help="times a job is sent to another worker after its worker went away")
+    parser.add_argument("--worker-token", default=os.environ.get(WORKER_TOKEN_ENV, ""),
+                        help=f"shared secret of the worker daemons (default: ${WORKER_TOKEN_ENV})")
+
+
+def add_resource_arguments(parser):
+    parser.add_argument("--threads", type=int, default=0,
+                        help="encoder threads per job (default: the cores divided among --jobs, so all jobs together use each core once)")
+    parser.add_argument("--pin-cpus", action="store_true", help="keep each job on its own block of cores")
+    parser.add_argument("--nice", choices=list(NICE_LEVELS), default="Normal", help="CPU priority of the ffmpeg processes")
+    parser.add_argument("--ionice", choices=[name for name in IO_CLASSES if name], help="disk priority of the ffmpeg processes (needs ionice)")
+    parser.add_argument("--memory-limit", type=int, default=0, metavar="MB", help="address space limit per ffmpeg process, 0 for none")
+
+
+def add_metrics_arguments(parser):
+    parser.add_argument("--metrics", default=METRICS_PATH, metavar="PATH", help="JSONL file every finished job is appended to")
+    parser.add_argument("--metrics-textfile", metavar="PATH",
+                        help="also keep job counters and histograms in this node-exporter textfile (*.prom), one file per running process")
+    parser.add_argument("--no-metrics", action="store_true", help="record no job metrics at all")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="pkumpress", description="Batch video compression without the GUI")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    compress = commands.add_parser("compress", help="compress video files or directories")
+    compress.add_argument("paths", nargs="+", help="video files and/or directories")
+    add_encoding_arguments(compress)
+    compress.add_argument("--high-priority", action="append", metavar="PATH",
+                          help="file or directory queued in the High lane, ahead of everything else (repeatable)")
+    compress.add_argument("--no-journal", action="store_true", help="do not record the batch in the journal")
+    compress.add_argument("-r", "--recursive", action="store_true", help="also look for videos in subdirectories")
+    compress.add_argument("--max-depth", type=int, help="with --recursive, how many directory levels to descend (default: all)")
+    compress.add_argument("--include", action="append", metavar="GLOB",
+                          help="only take files matching this pattern, e.g. '*.mts' or 'day1/*' (repeatable)")
+    compress.add_argument("--exclude", action="append", metavar="GLOB",
+                          help=f"skip files and directories matching this pattern (repeatable, default: {' '.join(DEFAULT_EXCLUDES)})")
+    compress.set_defaults(func=compress_command)
+
+    watch = commands.add_parser("watch", help="keep compressing video files as they appear in directories")
+    watch.add_argument("paths", nargs="+", help="directories to watch")
+    add_encoding_arguments(watch)
+    watch.add_argument("--profile", help="saved settings profile, replaces the encoding flags (--output-dir still applies)")
+    watch.add_argument("--recursive", action="store_true", help="also watch subdirectories")
+    watch.add_argument("--stable-seconds", type=float, default=WATCH_STABLE_SECONDS,
+                       help="a file counts as complete once its size has not changed for this long")
+    watch.add_argument("--poll-seconds", type=float, default=WATCH_POLL_SECONDS, help="scan interval when inotify is not available")
+    watch.add_argument("--no-inotify", action="store_true", help="always poll, e.g. for network shares")
+    watch.add_argument("--once", action="store_true", help="exit when every file present has been compressed")
+    watch.set_defaults(func=watch_command)
+
+    resume = commands.add_parser("resume", help="finish the jobs of batches that were interrupted")
+    resume.add_argument("--journal", default=JOURNAL_PATH, help="SQLite job journal")
+    resume.add_argument("--jobs", type=int, default=default_max_jobs(), help="concurrent ffmpeg processes")
+    resume.add_argument("--order", choices=QUEUE_ORDERS, default="sjf", help="see compress --order")
+    resume.add_argument("--discard", action="store_true", help="remove partial outputs and drop the interrupted jobs instead")
+    add_resource_arguments(resume)
+    add_dispatch_arguments(resume)
+    add_metrics_arguments(resume)
+    resume.add_argument("-v", "--verbose", action="store_true", help="print ffmpeg's log to stderr")
+    resume.set_defaults(func=resume_command)
+
+    worker = commands.add_parser("worker", help="run encode jobs sent by other pkumpress instances")
+    worker.add_argument("--listen", default=f"127.0.0.1:{WORKER_PORT}",
+                        help="host:port or unix:/path to accept dispatchers on (default: this machine only, give 0.0.0.0:PORT for others)")
+    worker.add_argument("--token", default=os.environ.get(WORKER_TOKEN_ENV, ""),
+                        help=f"shared secret every dispatcher has to send (default: ${WORKER_TOKEN_ENV}), required")
+    worker.add_argument("--root", action="append", metavar="DIR",
+                        help="directory shared-storage jobs may read and write below (repeatable); without it only streamed jobs are taken")
+    worker.add_argument("--jobs", type=int, default=default_max_jobs(), help="jobs run at the same time")
+    worker.add_argument("--work-dir", help="where streamed inputs and outputs are kept while a job runs (default: the temp directory)")
+    add_resource_arguments(worker)
+    worker.set_defaults(func=worker_command)
+
+    cache = commands.add_parser("cache", help="inspect or purge the cache of earlier encode results")
+    cache.add_argument("action", choices=("stats", "list", "purge", "limit"), nargs="?", default="stats")
+    cache.add_argument("keys", nargs="*", help="purge: entries to remove (keys from list)")
+    cache.add_argument("--all", action="store_true", help="purge: remove every entry")
+    cache.add_argument("--older-than-days", type=float, help="purge: remove entries not used for this many days")
+    cache.add_argument("--megabytes", type=int, help="limit: new size limit, least recently used entries are evicted to fit")
+    cache.add_argument("--cache-dir", default=CACHE_DIR, help="cache location")
+    cache.set_defaults(func=cache_command)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())